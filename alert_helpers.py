@@ -0,0 +1,145 @@
+"""
+Wishlist alerts: back-in-stock and price-drop notifications.
+
+Admin edits only record a StockEvent row, so restocking a popular shoe with
+thousands of watchers doesn't hold up the admin request. The email worker
+(`flask send-emails`) fans each event out: it pages through the shoe's
+watchers with one indexed query per batch, skips users already alerted about
+the same shoe recently, and bulk-inserts the alerts and outbox emails.
+
+Events are claimed one at a time: each is locked, fanned out and marked
+Done in a single transaction, so a concurrent send-emails run skips it
+instead of alerting the same watchers again. Without mail configured the
+events stay Pending until a worker that can send them picks them up.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from extensions import db
+from models import StockEvent, WishlistAlert, Wishlist, User, EmailOutbox
+
+# Alert Configuration
+ALERT_BATCH_SIZE = int(os.getenv('ALERT_BATCH_SIZE', 500))  # Watchers per fan-out batch
+ALERT_DEDUPE_HOURS = int(os.getenv('ALERT_DEDUPE_HOURS', 24))  # One alert per user, shoe and kind per window
+ALERT_EVENTS_PER_RUN = int(os.getenv('ALERT_EVENTS_PER_RUN', 10))
+
+
+def _shoe_url(shoe):
+    try:
+        return url_for('product_detail', shoe_id=shoe.id, _external=True)
+    except RuntimeError:
+        # Outside a request (e.g. CLI scripts)
+        return None
+
+
+def record_stock_event(shoe, kind, **payload):
+    """Queue a wishlist alert event for a shoe; the caller commits"""
+    payload.setdefault('shoe_name', shoe.name)
+    payload.setdefault('shoe_url', _shoe_url(shoe))
+    event = StockEvent(shoe_id=shoe.id, kind=kind, payload=json.dumps(payload))
+    db.session.add(event)
+    return event
+
+
+def record_restock(shoe, sizes):
+    """Alert watchers that sizes of a shoe came back in stock"""
+    if sizes:
+        return record_stock_event(shoe, 'back_in_stock', sizes=sorted(sizes), price=float(shoe.price or 0))
+
+
+def record_price_change(shoe, old_price):
+    """Alert watchers if the shoe's price went down"""
+    if old_price is not None and shoe.price is not None and shoe.price < old_price:
+        return record_stock_event(shoe, 'price_drop', old_price=float(old_price), new_price=float(shoe.price))
+
+
+def fan_out_event(event, batch_size=None):
+    """
+    Queue alert emails for everyone watching the event's shoe; the caller commits
+
+    Returns:
+        int: Number of users alerted
+    """
+    batch_size = batch_size or ALERT_BATCH_SIZE
+    payload = json.loads(event.payload or '{}')
+    now = datetime.utcnow()
+
+    recently_alerted = db.select(WishlistAlert.id).where(
+        WishlistAlert.user_id == Wishlist.user_id,
+        WishlistAlert.shoe_id == event.shoe_id,
+        WishlistAlert.kind == event.kind,
+        WishlistAlert.created_at >= now - timedelta(hours=ALERT_DEDUPE_HOURS)
+    ).exists()
+
+    watchers = db.select(Wishlist.user_id, User.email, User.name)\
+                 .join(User, User.id == Wishlist.user_id)\
+                 .where(Wishlist.shoe_id == event.shoe_id, ~recently_alerted)\
+                 .order_by(Wishlist.user_id)\
+                 .limit(batch_size)
+
+    alerted = 0
+    last_user_id = 0
+    while True:
+        batch = db.session.execute(watchers.where(Wishlist.user_id > last_user_id)).all()
+        if not batch:
+            break
+        last_user_id = batch[-1].user_id
+
+        db.session.execute(db.insert(WishlistAlert), [
+            {'user_id': user_id, 'shoe_id': event.shoe_id, 'kind': event.kind, 'created_at': now}
+            for user_id, _, _ in batch
+        ])
+        db.session.execute(db.insert(EmailOutbox), [
+            {
+                'kind': event.kind,
+                'recipient': email,
+                'order_id': None,
+                'payload': json.dumps(dict(payload, customer_name=name)),
+                'coalesce_key': f"{event.kind}:{event.shoe_id}:{user_id}",
+                'status': 'Pending',
+                'attempts': 0,
+                'next_attempt_at': now,
+                'created_at': now
+            }
+            for user_id, email, name in batch
+        ])
+        alerted += len(batch)
+
+    return alerted
+
+
+def process_stock_events(limit=None, batch_size=None):
+    """
+    Fan out pending stock events
+
+    Returns:
+        dict: Counts of processed events and alerted users
+    """
+    summary = {'events': 0, 'alerts': 0}
+    if not current_app.config.get('MAIL_USERNAME'):
+        current_app.logger.warning("Email not configured, leaving wishlist alert events pending")
+        return summary
+
+    for _ in range(limit or ALERT_EVENTS_PER_RUN):
+        # The lock is held until the commit below, so no other run fans out this event
+        event = StockEvent.query.filter_by(status='Pending')\
+                                .order_by(StockEvent.id)\
+                                .populate_existing()\
+                                .with_for_update(skip_locked=True)\
+                                .first()
+        if event is None:
+            break
+        try:
+            summary['alerts'] += fan_out_event(event, batch_size)
+            event.status = 'Done'
+            event.processed_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        summary['events'] += 1
+
+    if summary['events']:
+        current_app.logger.info(f"Wishlist alerts: {summary['events']} events, {summary['alerts']} users alerted")
+    return summary
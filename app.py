@@ -1,16 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, abort
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from flask_wtf.csrf import CSRFProtect
-from extensions import db
-from flask_migrate import Migrate
-from flask_caching import Cache
+from extensions import db, cache
 from datetime import timedelta, datetime
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
+import hmac
 import os
 import re
 import logging
+import click
+import importlib.util
+from profiling_helpers import init_profiling
+from database_helpers import engine_options, configure_engine, pool_stats, replica_database_url, replica_reads, replica_status
+from metrics_helpers import init_metrics, render_metrics, STOCK_CONFLICTS
+from popularity_helpers import init_events, record_event
 # Import flask_session conditionally
 try:
     from flask_session import Session
@@ -24,12 +29,10 @@ load_dotenv()
 # Initialize extensions
 bcrypt = Bcrypt()
 login_manager = LoginManager()
-migrate = Migrate()
-cache = Cache()
 
 # Email will be initialized conditionally
 try:
-    from email_helpers import mail, init_mail
+    from email_helpers import mail, init_mail, send_order_confirmation, send_payment_confirmation, send_order_status_update
     EMAIL_AVAILABLE = True
 except ImportError:
     EMAIL_AVAILABLE = False
@@ -42,18 +45,23 @@ def create_app():
     database_url = os.getenv('DATABASE_URL')
     if database_url and database_url.startswith("postgres://"):
         database_url = database_url.replace("postgres://", "postgresql://", 1)
+    replica_url = replica_database_url()
     
     # Configure application
     app.config.update(
         SECRET_KEY=os.getenv('SECRET_KEY', 'your-secret-key-here'),
         SQLALCHEMY_DATABASE_URI=database_url or 'sqlite:///site.db',
+        SQLALCHEMY_ENGINE_OPTIONS=engine_options(database_url or 'sqlite:///site.db'),
+        SQLALCHEMY_BINDS={'replica': dict(engine_options(replica_url), url=replica_url)} if replica_url else {},
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
         B2_ENDPOINT_URL=os.getenv('B2_ENDPOINT_URL', 'https://s3.us-east-005.backblazeb2.com'),
         B2_REGION_NAME=os.getenv('B2_REGION_NAME', 'us-east-005'),
         MAX_CONTENT_LENGTH=16 * 1024 * 1024,  # 16MB
         ALLOWED_EXTENSIONS={'png', 'jpg', 'jpeg', 'gif', 'webp'},
-        CACHE_TYPE='SimpleCache',
+        CACHE_TYPE='RedisCache' if os.getenv('REDIS_URL') else 'SimpleCache',
+        CACHE_REDIS_URL=os.getenv('REDIS_URL'),
         CACHE_DEFAULT_TIMEOUT=300,
+        BCRYPT_LOG_ROUNDS=int(os.getenv('BCRYPT_LOG_ROUNDS', 12)),
         SESSION_COOKIE_SECURE=True,
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
@@ -70,7 +78,9 @@ def create_app():
             import redis
             app.config['SESSION_REDIS'] = redis.from_url(redis_url)
         except ImportError:
-            # Fallback to filesystem sessions if redis is not available
+            # Fallback to filesystem sessions and a local cache if redis is not available
+            app.config['SESSION_TYPE'] = 'filesystem'
+            app.config['CACHE_TYPE'] = 'SimpleCache'
             app.config['SESSION_FILE_DIR'] = '/tmp/flask_session'
             os.makedirs(app.config['SESSION_FILE_DIR'], exist_ok=True)
     else:
@@ -86,9 +96,16 @@ def create_app():
 
     # Initialize extensions with app
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            configure_engine(engine)  # SQLite pragmas (WAL, busy timeout)
     bcrypt.init_app(app)
     login_manager.init_app(app)
-    migrate.init_app(app, db)
+    # Alembic is only needed by `flask db ...`, which loads the app inside a click
+    # context; web workers skip importing it
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
     cache.init_app(app)
     
     # Initialize Flask-Session after setting config (if available)
@@ -99,6 +116,15 @@ def create_app():
     if EMAIL_AVAILABLE:
         init_mail(app)
     
+    # Per-request SQL counts and timings (Server-Timing, logs, /admin/debug/profiling)
+    init_profiling(app)
+    
+    # Prometheus metrics for /metrics
+    init_metrics(app, db, cache)
+    
+    # Buffered product view/cart/wishlist events for popularity scores
+    init_events(app)
+    
     login_manager.login_view = 'login'
 
     # Configure logging
@@ -106,11 +132,8 @@ def create_app():
         logging.basicConfig(level=logging.INFO)
         app.logger.addHandler(logging.StreamHandler())
 
-    # Import models after app and db are initialized
-    with app.app_context():
-        from models import User, Shoe, Order, ShoeSize, Wishlist, ProductImage, Review
-        db.create_all()
-
+    # No database access here: the schema is managed by `flask db upgrade`
+    # (build.sh / release phase), so booting a worker never touches the DB
     return app
 
 app = create_app()
@@ -119,16 +142,25 @@ csrf = CSRFProtect(app)
 # Import forms and routes after app creation
 from forms import RegistrationForm, LoginForm, PaymentForm, ShoeForm, ShoeSizeForm, AddToCartForm, GuestCheckoutForm
 # Import models after app creation
-from models import User, Shoe, Order, ShoeSize
-
-# Import b2_helpers conditionally
-try:
-    from b2_helpers import upload_to_b2
-    B2_AVAILABLE = True
-except ImportError:
-    B2_AVAILABLE = False
-    def upload_to_b2(file, filename):
-        return None  # Fallback function
+from models import User, Shoe, Order, ShoeSize, OrderStatusAudit
+from order_helpers import VALID_ORDER_STATUSES
+from auth_helpers import load_principal
+from password_helpers import PasswordHasherBusy, login_rate_limited, reset_login_attempts, needs_rehash
+import cart_helpers
+import wishlist_helpers
+from alert_helpers import record_restock, record_price_change
+from catalog_helpers import get_catalog
+from recommendation_helpers import recommended_for
+from search_helpers import search_catalog, search_cache_stats
+from shoe_cache_helpers import get_many, get_shoe
+from read_model_helpers import order_rows, shoe_rows, wishlist_rows
+
+# b2sdk is slow to import, so b2_helpers is only loaded on the first upload
+B2_AVAILABLE = importlib.util.find_spec('b2sdk') is not None
+
+def upload_to_b2(file, filename):
+    from b2_helpers import upload_to_b2 as b2_upload
+    return b2_upload(file, filename)
 
 def allowed_file(filename):
     """Check if the file has an allowed extension"""
@@ -152,13 +184,11 @@ def flash_errors(form):
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_principal(int(user_id))
 
 @app.route('/')
+@replica_reads
 def index():
-    from models import Wishlist
-    from sqlalchemy import func
-    
     page = request.args.get('page', 1, type=int)
     sort_by = request.args.get('sort', 'newest')
     
@@ -167,66 +197,32 @@ def index():
     max_price = request.args.get('max_price', type=float)
     category = request.args.get('category', '')
     availability = request.args.get('availability', '')
+    size = request.args.get('size', '')
+    
+    # Filter, sort and paginate the in-memory catalog (no SQL on a warm worker)
+    catalog = get_catalog()
+    filters = dict(min_price=min_price, max_price=max_price, category=category,
+                   availability=availability, size=size)
+    positions = catalog.select(sort_by=sort_by, **filters)
+    # ?cursor= (infinite scroll, "Load more") continues after the last shoe seen
+    cursor = request.args.get('cursor')
+    if cursor:
+        shoes = catalog.page_after(positions, cursor, sort_by=sort_by, per_page=9)
+    else:
+        shoes = catalog.paginate(positions, page=page, per_page=9, sort_by=sort_by)
+    facets = catalog.facet_counts(**filters)
     
-    # Build query with filters
-    query = Shoe.query.options(db.joinedload(Shoe.sizes))
-    
-    # Apply price filters
-    if min_price is not None:
-        query = query.filter(Shoe.price >= min_price)
-    if max_price is not None:
-        query = query.filter(Shoe.price <= max_price)
-    
-    # Apply category filter
-    if category:
-        query = query.filter(Shoe.category == category)
-    
-    # Apply availability filter
-    if availability == 'in_stock':
-        # Only show products with at least one size in stock
-        query = query.join(ShoeSize).filter(ShoeSize.quantity > 0)
-    elif availability == 'out_of_stock':
-        # Products with no sizes or all sizes out of stock
-        query = query.outerjoin(ShoeSize).group_by(Shoe.id).having(
-            func.coalesce(func.sum(ShoeSize.quantity), 0) == 0
-        )
-    
-    # Apply sorting
-    if sort_by == 'price_low':
-        query = query.order_by(Shoe.price.asc())
-    elif sort_by == 'price_high':
-        query = query.order_by(Shoe.price.desc())
-    elif sort_by == 'name_az':
-        query = query.order_by(Shoe.name.asc())
-    elif sort_by == 'name_za':
-        query = query.order_by(Shoe.name.desc())
-    else:  # newest (default)
-        query = query.order_by(Shoe.id.desc())
-    
-    shoes = query.paginate(page=page, per_page=9)
-    
-    # Get user's wishlist if logged in
-    wishlist_ids = []
+    # Get user's wishlist if logged in (cached ID set, no query on a hit)
+    wishlist_ids = frozenset()
     if current_user.is_authenticated:
-        wishlist_items = Wishlist.query.filter_by(user_id=current_user.id).all()
-        wishlist_ids = [item.shoe_id for item in wishlist_items]
-    
-    forms_dict = {}
-    for shoe in shoes.items:  # Note: use shoes.items for paginated results
-        form = AddToCartForm()
-        form.size.choices = [(str(size.size), str(size.size)) for size in shoe.sizes]
-        forms_dict[shoe.id] = form
-    
-    # Get related/recommended products (different from current page items)
-    displayed_ids = [shoe.id for shoe in shoes.items]
-    related_products = Shoe.query.options(db.joinedload(Shoe.sizes))\
-                                 .filter(Shoe.id.notin_(displayed_ids) if displayed_ids else True)\
-                                 .order_by(func.random())\
-                                 .limit(3)\
-                                 .all()
-    
-    return render_template('index.html', shoes=shoes, forms_dict=forms_dict, 
-                         wishlist_ids=wishlist_ids, related_products=related_products)
+        wishlist_ids = wishlist_helpers.get_wishlist_ids(current_user.id)
+    
+    # Shoes bought or wishlisted with this page's shoes, topped up from the shuffled pool
+    related_products = recommended_for([shoe.id for shoe in shoes.items], 3)
+    
+    return render_template('index.html', shoes=shoes,
+                         wishlist_ids=wishlist_ids, related_products=related_products,
+                         facets=facets, cursor=cursor)
 
 # @app.route('/')
 # def index():
@@ -263,12 +259,16 @@ def index():
 def register():
     form = RegistrationForm()
     if form.validate_on_submit():
-        user = User(
-            email=form.email.data,
-            password=form.password.data,
-            name=form.name.data,
-            address=form.address.data
-        )
+        try:
+            user = User(
+                email=form.email.data,
+                password=form.password.data,
+                name=form.name.data,
+                address=form.address.data
+            )
+        except PasswordHasherBusy:
+            flash('We are handling a lot of sign-ups right now. Please try again in a moment.', 'warning')
+            return render_template('register.html', form=form), 503
         db.session.add(user)
         db.session.commit()
         flash('Registration successful! Please login', 'success')
@@ -296,25 +296,50 @@ def login():
     next_url = request.args.get('next', url_for('index'))
     
     if form.validate_on_submit():
+        if login_rate_limited(form.email.data):
+            flash('Too many login attempts. Please wait a few minutes and try again.', 'danger')
+            return render_template('login.html', form=form, next=next_url), 429
+        
         user = User.query.filter_by(email=form.email.data).first()
         
-        if user and user.verify_password(form.password.data):
+        try:
+            valid = user is not None and user.verify_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('We are handling a lot of logins right now. Please try again in a moment.', 'warning')
+            return render_template('login.html', form=form, next=next_url), 503
+        
+        if valid:
+            reset_login_attempts(form.email.data)
+            
+            # Upgrade the hash if the bcrypt cost has changed since it was made
+            if needs_rehash(user.password_hash):
+                try:
+                    user.password = form.password.data
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning(f"Password rehash skipped for user {user.id}: {str(e)}")
+            
             # Login user and commit session
             login_user(user, remember=True)
             session.modified = True
             
+            # Carry the guest cart over to the user's cart
+            try:
+                cart_helpers.merge_guest_cart(user)
+            except Exception as e:
+                app.logger.error(f"Cart merge error: {str(e)}")
+
             # Handle pending cart items
             if 'pending_cart_item' in session:
                 item = session.pop('pending_cart_item')
                 try:
-                    shoe = Shoe.query.get(item.get('shoe_id'))
+                    shoe = get_shoe(item.get('shoe_id'))
                     if shoe:
                         size_inv = next((s for s in shoe.sizes 
                                        if s.size == item.get('size') and s.quantity > 0), None)
                         if size_inv:
-                            cart = session.get('cart', [])
-                            cart.append(item)
-                            session['cart'] = cart
+                            cart_helpers.add_to_cart(shoe.id, size_inv.size)
                             flash('Item added to cart!', 'success')
                         else:
                             flash('Selected size no longer available', 'warning')
@@ -335,6 +360,7 @@ def logout():
 
 @app.route('/admin', methods=['GET'])
 @login_required
+@replica_reads
 def admin():
     if not current_user.is_admin:
         return redirect(url_for('index'))
@@ -348,28 +374,29 @@ def admin():
     
     # Filter data based on admin type
     try:
+        # Read-only rows: the dashboard only displays them
         if current_user.is_super_admin():
             # Super admin sees all orders and shoes
-            orders = Order.query.order_by(Order.created_at.desc()).all()
-            shoes = Shoe.query.all()
+            orders = order_rows()
+            shoes = shoe_rows()
             admin_type = 'super_admin'
         elif current_user.is_limited_admin():
             # Limited admin sees only their own products and related orders
-            shoes = Shoe.query.filter_by(created_by=current_user.id).all()
+            shoes = shoe_rows(Shoe.created_by == current_user.id)
             # Get orders for shoes created by this admin
             shoe_ids = [shoe.id for shoe in shoes]
-            orders = Order.query.filter(Order.shoe_id.in_(shoe_ids)).order_by(Order.created_at.desc()).all() if shoe_ids else []
+            orders = order_rows(Order.shoe_id.in_(shoe_ids)) if shoe_ids else []
             admin_type = 'limited_admin'
         else:
             # Fallback for regular admin (backward compatibility)
-            orders = Order.query.order_by(Order.created_at.desc()).all()
-            shoes = Shoe.query.all()
+            orders = order_rows()
+            shoes = shoe_rows()
             admin_type = 'admin'
     except Exception as e:
         # Fallback if there are any issues with the new fields
         app.logger.error(f"Admin type check failed: {str(e)}")
-        orders = Order.query.order_by(Order.created_at.desc()).all()
-        shoes = Shoe.query.all()
+        orders = order_rows()
+        shoes = shoe_rows()
         admin_type = 'admin'
     
     # Calculate Analytics
@@ -529,7 +556,6 @@ def add_shoe():
             
             db.session.add(new_shoe)
             db.session.commit()
-            cache.clear()
             flash('Shoe added successfully! Now add sizes', 'success')
             return redirect(url_for('manage_shoe_sizes', shoe_id=new_shoe.id))
             
@@ -591,23 +617,29 @@ def update_shoe_sizes(shoe_id):
     existing_sizes = {size.size: size for size in shoe.sizes}
 
     # Update or create sizes
+    restocked = set()
     for size_value in selected_sizes:
         if size_value in existing_sizes:
+            if not existing_sizes[size_value].quantity:
+                restocked.add(size_value)
             # Update existing size to in stock (quantity = 1)
             existing_sizes[size_value].quantity = 1
-        else:
+        elif size_value not in restocked:
             # Create new size entry
             new_size = ShoeSize(shoe_id=shoe_id, size=size_value, quantity=1)
             db.session.add(new_size)
+            restocked.add(size_value)
 
     # Mark unselected sizes as out of stock (quantity = 0)
     for size_value, size_obj in existing_sizes.items():
         if size_value not in selected_sizes:
             size_obj.quantity = 0
 
+    # Watchers are notified by the email worker, not in this request
+    record_restock(shoe, restocked)
+
     try:
         db.session.commit()
-        cache.clear()
         flash('Sizes updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -631,7 +663,6 @@ def delete_size(size_id):
 
     db.session.delete(size)
     db.session.commit()
-    cache.clear()
     flash('Size deleted successfully!', 'success')
     return redirect(url_for('manage_shoe_sizes', shoe_id=shoe_id))
 
@@ -652,6 +683,7 @@ def update_shoe(shoe_id):
     if form.validate_on_submit():
         try:
             # Update fields
+            old_price = shoe.price
             shoe.name = form.name.data
             shoe.price = form.price.data
             shoe.description = form.description.data
@@ -682,8 +714,8 @@ def update_shoe(shoe_id):
             if new_image_url:
                 shoe.image_url = new_image_url
             
+            record_price_change(shoe, old_price)
             db.session.commit()
-            cache.clear()
             flash('Shoe updated successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -770,6 +802,8 @@ def verify_payment(order_id):
         if order.payment_code == admin_code:
             order.status = 'Verified'
             order.payment_status = 'Completed'
+            if EMAIL_AVAILABLE:
+                send_payment_confirmation(order)
             db.session.commit()
             flash('Payment verified! Order can be shipped', 'success')
         else:
@@ -793,18 +827,70 @@ def update_order_status(order_id):
             return redirect(url_for('admin'))
 
     new_status = request.form.get('order_status')
-    valid_statuses = ['Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled']
 
-    if new_status not in valid_statuses:
+    if new_status not in VALID_ORDER_STATUSES:
         flash('Invalid order status.', 'danger')
         return redirect(url_for('admin'))
 
+    if order.status != new_status:
+        db.session.add(OrderStatusAudit(order_id=order.id, old_status=order.status,
+                                        new_status=new_status, changed_by=current_user.id))
     order.status = new_status
+    if EMAIL_AVAILABLE:
+        send_order_status_update(order, new_status)
     db.session.commit()
     flash(f'Order #{order_id} status updated to {new_status}', 'success')
 
     return redirect(url_for('admin'))
 
+@app.route('/admin/orders/bulk_status', methods=['POST'])
+@login_required
+def bulk_update_order_status():
+    """Change the status of many orders at once (form post or JSON)"""
+    from order_helpers import bulk_update_order_status as apply_bulk_status
+
+    wants_json = request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+    if not current_user.is_admin:
+        if wants_json:
+            return jsonify({'success': False, 'error': 'Access denied'}), 403
+        flash('Access denied.', 'danger')
+        return redirect(url_for('index'))
+
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        raw_ids = data.get('order_ids', [])
+        new_status = data.get('status')
+    else:
+        raw_ids = request.form.getlist('order_ids')
+        new_status = request.form.get('order_status')
+
+    try:
+        order_ids = sorted({int(order_id) for order_id in raw_ids})
+        if not order_ids:
+            raise ValueError('No orders selected')
+        changed_ids = apply_bulk_status(order_ids, new_status, current_user)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        if wants_json:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        flash(str(e), 'danger')
+        return redirect(url_for('admin', _anchor='orders'))
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Bulk order status update failed: {str(e)}", exc_info=True)
+        if wants_json:
+            return jsonify({'success': False, 'error': 'Bulk update failed'}), 500
+        flash('Error updating orders.', 'danger')
+        return redirect(url_for('admin', _anchor='orders'))
+
+    if wants_json:
+        return jsonify({'success': True, 'updated': changed_ids, 'status': new_status})
+
+    flash(f'{len(changed_ids)} of {len(order_ids)} orders updated to {new_status}', 'success')
+    return redirect(url_for('admin', _anchor='orders'))
+
 # @app.route('/add_to_cart/<int:shoe_id>', methods=['POST'])
 # @login_required
 # def add_to_cart(shoe_id):
@@ -837,10 +923,25 @@ def update_order_status(order_id):
 #     flash('Item added to cart', 'success')
 #     return redirect(url_for('index'))
 
+def wants_json():
+    """Whether the request came from the storefront's fetch() calls"""
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def cart_response(message, category, redirect_url, status=200, **data):
+    """
+    Answer a cart action: JSON with the new cart count for AJAX requests,
+    otherwise flash the message and redirect
+    """
+    if wants_json():
+        return jsonify({'success': status < 400, 'message': message, 'category': category,
+                        'count': cart_helpers.cart_count(), **data}), status
+    flash(message, category)
+    return redirect(redirect_url)
+
 @app.route('/add_to_cart/<int:shoe_id>', methods=['POST'])
 def add_to_cart(shoe_id):
     # Retrieve shoe FIRST to get available sizes
-    shoe = Shoe.query.options(db.joinedload(Shoe.sizes)).get_or_404(shoe_id)
+    shoe = get_shoe(shoe_id) or abort(404)
     
     # Create form and DYNAMICALLY SET CHOICES
     form = AddToCartForm(request.form)
@@ -848,8 +949,7 @@ def add_to_cart(shoe_id):
     
     # Validate after setting choices
     if not form.validate():
-        flash('Invalid form submission. Please try again.', 'danger')
-        return redirect(url_for('index'))
+        return cart_response('Invalid form submission. Please try again.', 'danger', url_for('index'), 400)
     
     # Get selected size and convert to int
     # try:
@@ -863,72 +963,112 @@ def add_to_cart(shoe_id):
     size_inv = next((s for s in shoe.sizes if str(s.size) == selected_size), None)
     # Validate stock
     if not size_inv or size_inv.quantity < 1:
-        flash(f"Size {selected_size} of {shoe.name} is out of stock", 'danger')
-        return redirect(url_for('index'))
+        STOCK_CONFLICTS.inc(stage='add_to_cart')
+        return cart_response(f"Size {selected_size} of {shoe.name} is out of stock", 'danger',
+                             url_for('index'), 409)
     
     # Add to cart (works for both authenticated and guest users)
-    cart = session.get('cart', [])
-    cart.append({
-        'shoe_id': shoe_id,
-        'size': selected_size
-    })
-    session['cart'] = cart
-    session.modified = True  # Explicitly mark session as modified
-    flash(f"{shoe.name} (Size {selected_size}) added to cart!", 'success')
-    return redirect(request.form.get('next', url_for('index')))
-
-@app.route('/remove_from_cart/<int:index>', methods=['POST'])
-def remove_from_cart(index):
-    cart = session.get('cart', [])
-    
-    if 0 <= index < len(cart):
-        item = cart.pop(index)
-        session['cart'] = cart
-        session.modified = True
-        
-        # Restore stock if needed (only if item is a dictionary)
-        if isinstance(item, dict):
-            size_inv = ShoeSize.query.filter_by(
-                shoe_id=item.get('shoe_id'),
-                size=item.get('size')
-            ).first()
-            
-            if size_inv:
-                size_inv.quantity += 1
-                db.session.commit()
-            
-        flash('Item removed from cart', 'success')
+    quantity = cart_helpers.add_to_cart(shoe_id, selected_size)
+    record_event(shoe_id, 'cart')
+    next_url = request.form.get('next', url_for('index'))
+    if quantity > size_inv.quantity:
+        STOCK_CONFLICTS.inc(stage='add_to_cart')
+        cart_helpers.set_cart_quantity(shoe_id, selected_size, size_inv.quantity)
+        return cart_response(f"Only {size_inv.quantity} of {shoe.name} (Size {selected_size}) left in stock",
+                             'warning', next_url, quantity=size_inv.quantity)
+    return cart_response(f"{shoe.name} (Size {selected_size}) added to cart!", 'success', next_url,
+                         quantity=quantity)
+
+@app.route('/remove_from_cart/<int:shoe_id>/<path:size>', methods=['POST'])
+def remove_from_cart(shoe_id, size):
+    # Items only leave stock when an order is paid, so there is nothing to restore here
+    cart_helpers.remove_from_cart(shoe_id, size)
+    if wants_json():
+        return jsonify({'success': True, 'message': 'Item removed from cart', 'category': 'success',
+                        **cart_summary()})
+    flash('Item removed from cart', 'success')
     return redirect(url_for('view_cart'))
 
-@app.route('/cart')
-def view_cart():
+@app.route('/update_cart/<int:shoe_id>/<path:size>', methods=['POST'])
+def update_cart(shoe_id, size):
+    """Set the quantity of a cart line (0 removes it), capped at CART_MAX_QUANTITY and the stock left"""
+    try:
+        quantity = int(request.form.get('quantity', ''))
+    except ValueError:
+        quantity = -1
+    if quantity < 0:
+        return cart_response('Invalid quantity', 'danger', url_for('view_cart'), 400)
+    if quantity == 0:
+        return remove_from_cart(shoe_id, size)
+    over_limit = quantity > cart_helpers.CART_MAX_QUANTITY
+    quantity = min(quantity, cart_helpers.CART_MAX_QUANTITY)
+
+    shoe = get_shoe(shoe_id)
+    size_inv = next((s for s in shoe.sizes if s.size == size), None) if shoe else None
+    if not size_inv or size_inv.quantity < 1:
+        STOCK_CONFLICTS.inc(stage='update_cart')
+        cart_helpers.remove_from_cart(shoe_id, size)
+        message, category = f"Size {size} is no longer available and was removed from your cart", 'danger'
+    elif quantity > size_inv.quantity:
+        STOCK_CONFLICTS.inc(stage='update_cart')
+        cart_helpers.set_cart_quantity(shoe_id, size, size_inv.quantity)
+        message, category = f"Only {size_inv.quantity} of {shoe.name} (Size {size}) left in stock", 'warning'
+    elif over_limit:
+        cart_helpers.set_cart_quantity(shoe_id, size, quantity)
+        message, category = f"You can add up to {quantity} of {shoe.name} (Size {size}) to your cart", 'warning'
+    else:
+        cart_helpers.set_cart_quantity(shoe_id, size, quantity)
+        message, category = 'Cart updated', 'success'
+
+    if wants_json():
+        return jsonify({'success': True, 'message': message, 'category': category, **cart_summary()})
+    flash(message, category)
+    return redirect(url_for('view_cart'))
+
+def load_cart_items():
+    """Resolve the visitor's cart lines to shoes, from the shoe cache where possible"""
+    lines = cart_helpers.get_cart_lines()
+    if not lines:
+        return [], 0
+
+    shoes = get_many(shoe_id for shoe_id, _ in lines)
     cart_items = []
     total = 0
-    
-    if 'cart' in session:
-        for item in session['cart']:
-            # Ensure item is a dictionary
-            if isinstance(item, dict):
-                shoe = Shoe.query.get(item.get('shoe_id'))
-                if shoe:
-
-                    price = shoe.price if shoe.price else 0
-                    cart_items.append({
-                        'shoe': shoe,
-                        'size': item.get('size', 'N/A'),
-                        'price': shoe.price
-                    })
-                    total += shoe.price
-            # Handle legacy format (shoe ID as integer)
-            # elif isinstance(item, int):
-            #     shoe = Shoe.query.get(item)
-            #     if shoe:
-            #         cart_items.append({
-            #             'shoe': shoe,
-            #             'size': 'Size not specified',
-            #             'price': shoe.price
-            #         })
-            #         total += shoe.price
+    for (shoe_id, size), quantity in lines.items():
+        shoe = shoes.get(shoe_id)
+        if not shoe:
+            continue
+        price = shoe.price or 0
+        cart_items.append({
+            'shoe': shoe,
+            'size': size,
+            'quantity': quantity,
+            'price': price,
+            'line_total': price * quantity
+        })
+        total += price * quantity
+    return cart_items, total
+
+def cart_summary():
+    """Cart lines, item count and total as JSON-ready data"""
+    cart_items, total = load_cart_items()
+    return {
+        'count': cart_helpers.cart_count(),
+        'total': round(total, 2),
+        'items': [{'shoe_id': item['shoe'].id, 'name': item['shoe'].name, 'image_url': item['shoe'].image_url,
+                   'size': item['size'], 'quantity': item['quantity'], 'price': item['price'],
+                   'line_total': round(item['line_total'], 2)}
+                  for item in cart_items]
+    }
+
+@app.route('/cart/summary')
+def cart_summary_json():
+    """The visitor's cart as JSON, for the storefront scripts"""
+    return jsonify({'success': True, **cart_summary()})
+
+@app.route('/cart')
+def view_cart():
+    cart_items, total = load_cart_items()
     
     form = PaymentForm()
     return render_template('cart.html', cart=cart_items, total=total, form=form)
@@ -936,8 +1076,8 @@ def view_cart():
 @app.route('/checkout', methods=['GET', 'POST'])
 def checkout():
     # Check if cart is empty
-    cart = session.get('cart', [])
-    if not cart:
+    cart_items, total = load_cart_items()
+    if not cart_items:
         flash('Your cart is empty. Please add items before checkout.', 'warning')
         return redirect(url_for('view_cart'))
     
@@ -956,34 +1096,18 @@ def checkout():
         else:
             guest_form = GuestCheckoutForm()
     
-    cart_items = []
-    total = 0
-    
-    # First pass: validate stock
-    for item in cart:
-        shoe_id = item['shoe_id'] if isinstance(item, dict) else item
-        shoe = Shoe.query.get(shoe_id)
-        
-        if not shoe:
-            continue
-            
-        # Get size if available
-        size = item['size'] if isinstance(item, dict) and 'size' in item else 'Size not specified'
-        
-        # For dictionary items, validate size stock
-        if isinstance(item, dict):
-            size_inv = next((s for s in shoe.sizes if s.size == item.get('size')), None)
-            
-            if not size_inv or size_inv.quantity < 1:
-                flash(f"Size {item.get('size', 'unknown')} of {shoe.name} is no longer available", 'danger')
-                return redirect(url_for('view_cart'))
+    # Validate stock for every line
+    for item in cart_items:
+        shoe = item['shoe']
+        size_inv = next((s for s in shoe.sizes if s.size == item['size']), None)
         
-        cart_items.append({
-            'shoe': shoe,
-            'size': size,
-            'price': shoe.price
-        })
-        total += shoe.price
+        if not size_inv or size_inv.quantity < item['quantity']:
+            STOCK_CONFLICTS.inc(stage='checkout')
+            if size_inv and size_inv.quantity > 0:
+                flash(f"Only {size_inv.quantity} of {shoe.name} (Size {item['size']}) left in stock", 'danger')
+            else:
+                flash(f"Size {item['size']} of {shoe.name} is no longer available", 'danger')
+            return redirect(url_for('view_cart'))
     
     if request.method == 'POST':
         try:
@@ -1019,27 +1143,28 @@ def checkout():
                 shoe = item['shoe']
                 size = item['size']
                 
-                # Create order
-                order = Order(
-                    user_id=user_id,  # None for guests
-                    shoe_id=shoe.id,
-                    size=size,
-                    phone_number=phone_number,
-                    payment_method=payment_method,
-                    payment_status='Pending',
-                    amount=shoe.price,
-                    status='Pending',
-                    # Guest checkout fields
-                    guest_name=customer_name if not is_authenticated else None,
-                    guest_email=customer_email if not is_authenticated else None,
-                    guest_phone=phone_number if not is_authenticated else None,
-                    delivery_address=delivery_address,
-                    delivery_city=delivery_city,
-                    delivery_instructions=delivery_instructions
-                )
-                db.session.add(order)
-                db.session.flush()  # Get the order ID
-                order_ids.append(order.id)
+                # Create one order per unit; stock and fulfilment are tracked per order
+                for _ in range(item['quantity']):
+                    order = Order(
+                        user_id=user_id,  # None for guests
+                        shoe_id=shoe.id,
+                        size=size,
+                        phone_number=phone_number,
+                        payment_method=payment_method,
+                        payment_status='Pending',
+                        amount=shoe.price,
+                        status='Pending',
+                        # Guest checkout fields
+                        guest_name=customer_name if not is_authenticated else None,
+                        guest_email=customer_email if not is_authenticated else None,
+                        guest_phone=phone_number if not is_authenticated else None,
+                        delivery_address=delivery_address,
+                        delivery_city=delivery_city,
+                        delivery_instructions=delivery_instructions
+                    )
+                    db.session.add(order)
+                    db.session.flush()  # Get the order ID
+                    order_ids.append(order.id)
             
             db.session.commit()
             
@@ -1169,9 +1294,12 @@ def checkout():
                         size_inv = next((s for s in shoe.sizes if s.size == order.size), None)
                         if size_inv and size_inv.quantity > 0:
                             size_inv.quantity -= 1
+                    
+                    if EMAIL_AVAILABLE:
+                        send_order_confirmation(order)
                 
                 db.session.commit()
-                session.pop('cart', None)
+                cart_helpers.clear_cart()
                 flash('Payment submitted! We will verify and process your order shortly.', 'success')
                 
                 # Redirect based on authentication status
@@ -1229,11 +1357,14 @@ def pesapal_callback():
                         size_inv = next((s for s in order.shoe.sizes if s.size == order.size), None)
                         if size_inv and size_inv.quantity > 0:
                             size_inv.quantity -= 1
+                    
+                    if EMAIL_AVAILABLE:
+                        send_payment_confirmation(order)
                 
                 db.session.commit()
                 
                 # Clear cart
-                session.pop('cart', None)
+                cart_helpers.clear_cart()
                 
                 flash('Payment successful! Your order is being processed.', 'success')
                 
@@ -1345,6 +1476,9 @@ def mpesa_callback():
                     size_inv = next((s for s in order.shoe.sizes if s.size == order.size), None)
                     if size_inv and size_inv.quantity > 0:
                         size_inv.quantity -= 1
+                
+                if EMAIL_AVAILABLE:
+                    send_payment_confirmation(order)
             
             db.session.commit()
             app.logger.info(f"M-Pesa payment completed: Receipt {mpesa_receipt}")
@@ -1424,6 +1558,9 @@ def pesapal_ipn():
                                 size_inv = next((s for s in order.shoe.sizes if s.size == order.size), None)
                                 if size_inv and size_inv.quantity > 0:
                                     size_inv.quantity -= 1
+                            
+                            if EMAIL_AVAILABLE:
+                                send_payment_confirmation(order)
                     
                     db.session.commit()
                     app.logger.info(f"IPN: Payment completed for tracking ID {order_tracking_id}")
@@ -1473,6 +1610,7 @@ def guest_order_confirmation(order_id):
 
 @app.route('/admin/export/orders')
 @login_required
+@replica_reads
 def export_orders():
     """Export orders to CSV"""
     if not current_user.is_admin:
@@ -1484,7 +1622,7 @@ def export_orders():
     from flask import make_response
     
     # Get all orders
-    orders = Order.query.order_by(Order.created_at.desc()).all()
+    orders = order_rows()
     
     # Create CSV
     si = StringIO()
@@ -1524,6 +1662,7 @@ def export_orders():
 
 @app.route('/admin/export/products')
 @login_required
+@replica_reads
 def export_products():
     """Export products inventory to CSV"""
     if not current_user.is_admin:
@@ -1535,7 +1674,7 @@ def export_products():
     from flask import make_response
     
     # Get all products
-    shoes = Shoe.query.all()
+    shoes = shoe_rows()
     
     # Create CSV
     si = StringIO()
@@ -1571,33 +1710,68 @@ def export_products():
     
     return output
 
+@app.route('/admin/debug/profiling')
+@login_required
+def profiling_debug():
+    """Recent requests with their SQL counts, DB time and slowest statements"""
+    if not current_user.is_super_admin():
+        flash('Unauthorized access', 'danger')
+        return redirect(url_for('index'))
+    
+    from profiling_helpers import recent_requests
+    
+    sort_by = request.args.get('sort', 'recent')
+    requests_seen = recent_requests()
+    if sort_by in ('duration_ms', 'queries', 'db_ms'):
+        requests_seen.sort(key=lambda entry: entry[sort_by], reverse=True)
+    
+    return render_template('admin_profiling.html', requests_seen=requests_seen, sort_by=sort_by,
+                           pool=pool_stats(db.engine))
+
+@app.route('/admin/debug/profiling/<int:request_id>.txt')
+@login_required
+def profiling_stacks(request_id):
+    """Collapsed stack samples for one request, ready for flamegraph.pl or speedscope"""
+    if not current_user.is_super_admin():
+        flash('Unauthorized access', 'danger')
+        return redirect(url_for('index'))
+    
+    from profiling_helpers import collapsed_stacks
+    
+    stacks = collapsed_stacks(request_id)
+    if stacks is None:
+        return 'Profile not found (profiles are kept per worker process)', 404
+    
+    response = make_response(stacks)
+    response.headers['Content-Type'] = 'text/plain; charset=utf-8'
+    response.headers['Content-Disposition'] = f'attachment; filename=request-{request_id}.folded.txt'
+    return response
+
 @app.route('/search')
+@replica_reads
 def search():
     query = request.args.get('q', '')
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     
-    results = Shoe.query.options(db.joinedload(Shoe.sizes))\
-                        .filter(
-                            db.or_(
-                                Shoe.name.ilike(f'%{query}%'),
-                                Shoe.description.ilike(f'%{query}%'),
-                                Shoe.category.ilike(f'%{query}%')
-                            )
-                        ).paginate(page=page, per_page=9)
+    # Substring match, most popular first; typo-tolerant match by similarity if that finds nothing
+    catalog = get_catalog()
+    positions, sort_by, suggestion = search_catalog(catalog, query)
+    if cursor and sort_by:
+        results = catalog.page_after(positions, cursor, sort_by=sort_by, per_page=9)
+    else:
+        cursor = None
+        results = catalog.paginate(positions, page=page, per_page=9, sort_by=sort_by)
     
-    return render_template('search.html', results=results, query=query)
+    return render_template('search.html', results=results, query=query, cursor=cursor,
+                         suggestion=suggestion, fuzzy=sort_by is None)
 
 # Wishlist Routes
 @app.route('/wishlist')
 @login_required
 def wishlist():
     """Display user's wishlist"""
-    from models import Wishlist
-    
-    wishlist_items = Wishlist.query.filter_by(user_id=current_user.id)\
-                                   .join(Shoe)\
-                                   .options(db.joinedload(Wishlist.shoe).joinedload(Shoe.sizes))\
-                                   .all()
+    wishlist_items = wishlist_rows(current_user.id)
     
     return render_template('wishlist.html', wishlist_items=wishlist_items)
 
@@ -1605,21 +1779,14 @@ def wishlist():
 @login_required
 def add_to_wishlist(shoe_id):
     """Add item to wishlist"""
-    from models import Wishlist
-    
     try:
-        shoe = Shoe.query.get_or_404(shoe_id)
-        
-        # Check if already in wishlist
-        existing = Wishlist.query.filter_by(user_id=current_user.id, shoe_id=shoe_id).first()
+        shoe = get_shoe(shoe_id) or abort(404)
         
-        if existing:
-            flash(f'{shoe.name} is already in your wishlist!', 'info')
-        else:
-            wishlist_item = Wishlist(user_id=current_user.id, shoe_id=shoe_id)
-            db.session.add(wishlist_item)
-            db.session.commit()
+        if wishlist_helpers.add_to_wishlist(current_user.id, shoe_id):
+            record_event(shoe_id, 'wishlist')
             flash(f'{shoe.name} added to wishlist!', 'success')
+        else:
+            flash(f'{shoe.name} is already in your wishlist!', 'info')
         
         # Return JSON for AJAX requests
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -1637,6 +1804,32 @@ def add_to_wishlist(shoe_id):
         
         return redirect(request.referrer or url_for('index'))
 
+@app.route('/wishlist/toggle/<int:shoe_id>', methods=['POST'])
+@login_required
+def toggle_wishlist(shoe_id):
+    """Heart/unheart a product from listing pages"""
+    try:
+        in_wishlist = wishlist_helpers.toggle_wishlist(current_user.id, shoe_id)
+        if in_wishlist:
+            record_event(shoe_id, 'wishlist')
+        
+        # Return JSON for AJAX requests
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'success': True, 'in_wishlist': in_wishlist})
+        
+        flash('Added to wishlist!' if in_wishlist else 'Removed from wishlist', 'success')
+        return redirect(request.referrer or url_for('index'))
+        
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error toggling wishlist: {str(e)}")
+        
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        flash('Error updating wishlist', 'danger')
+        return redirect(request.referrer or url_for('index'))
+
 @app.route('/wishlist/remove/<int:wishlist_id>', methods=['POST'])
 @login_required
 def remove_from_wishlist(wishlist_id):
@@ -1652,8 +1845,7 @@ def remove_from_wishlist(wishlist_id):
             return redirect(url_for('wishlist'))
         
         shoe_name = wishlist_item.shoe.name
-        db.session.delete(wishlist_item)
-        db.session.commit()
+        wishlist_helpers.remove_from_wishlist(current_user.id, wishlist_item.shoe_id)
         
         flash(f'{shoe_name} removed from wishlist', 'success')
         
@@ -1727,12 +1919,14 @@ def add_review(shoe_id):
     return redirect(request.referrer or url_for('index'))
 
 @app.route('/product/<int:shoe_id>')
+@replica_reads
 def product_detail(shoe_id):
     """Show product details with reviews"""
     from models import Review
     from sqlalchemy import func
     
-    shoe = Shoe.query.options(db.joinedload(Shoe.sizes)).get_or_404(shoe_id)
+    shoe = get_shoe(shoe_id) or abort(404)
+    record_event(shoe_id, 'view')
     
     # Get reviews
     reviews = Review.query.filter_by(shoe_id=shoe_id)\
@@ -1758,24 +1952,19 @@ def product_detail(shoe_id):
             payment_status='Completed'
         ).first() is not None
     
+    # Customers who bought or wishlisted this shoe also liked
+    recommendations = recommended_for([shoe_id], 3)
+    
     return render_template('product_detail.html', shoe=shoe, reviews=reviews, 
                          avg_rating=avg_rating, user_review=user_review, 
-                         has_purchased=has_purchased)
+                         has_purchased=has_purchased, recommendations=recommendations)
 
 @app.route('/migrate_cart')
 @login_required
 def migrate_cart():
     if 'cart' in session:
-        new_cart = []
-        for item in session['cart']:
-            if isinstance(item, int):
-                new_cart.append({
-                    'shoe_id': item,
-                    'size': 'Size not specified'
-                })
-            else:
-                new_cart.append(item)
-        session['cart'] = new_cart
+        # Reading the cart moves the old session list into the cart store
+        cart_helpers.get_cart_lines()
         flash('Cart migrated to new format', 'success')
     return redirect(url_for('view_cart'))
 
@@ -2057,6 +2246,126 @@ def test_b2():
             "status": "error",
             "message": f"Test failed: {str(e)}"
         }), 500
+
+# Scheduled jobs (run with `flask --app app <command>`, e.g. from a cron job)
+@app.cli.command('reconcile-payments')
+@click.option('--older-than', type=int, default=None, help='Only check orders pending for at least this many minutes')
+@click.option('--expire-after', type=int, default=None, help='Expire unresolved orders pending for this many minutes')
+@click.option('--batch-size', type=int, default=None, help='Orders loaded per batch')
+@click.option('--workers', type=int, default=None, help='Concurrent gateway queries')
+@click.option('--rate', type=float, default=None, help='Maximum gateway queries per second')
+def reconcile_payments_command(older_than, expire_after, batch_size, workers, rate):
+    """Settle or expire M-Pesa/Pesapal orders whose callback never arrived"""
+    from reconcile_helpers import reconcile_pending_payments
+
+    summary = reconcile_pending_payments(
+        older_than_minutes=older_than,
+        expire_after_minutes=expire_after,
+        batch_size=batch_size,
+        max_workers=workers,
+        rate_per_second=rate
+    )
+    click.echo(
+        f"Checked {summary['transactions']} transactions: "
+        f"{summary['settled']} orders settled, {summary['expired']} expired, "
+        f"{summary['skipped']} still pending"
+    )
+
+@app.cli.command('send-emails')
+@click.option('--batch-size', type=int, default=None, help='Messages sent per SMTP connection')
+@click.option('--loop', is_flag=True, help='Keep polling the outbox instead of exiting')
+@click.option('--interval', type=int, default=10, help='Seconds between polls with --loop')
+def send_emails_command(batch_size, loop, interval):
+    """Fan out wishlist alerts and deliver queued emails from the outbox"""
+    import time
+    from email_helpers import send_queued_emails
+    from alert_helpers import process_stock_events
+
+    while True:
+        alerts = process_stock_events()
+        if alerts['events']:
+            click.echo(f"Queued {alerts['alerts']} wishlist alerts for {alerts['events']} stock events")
+        summary = send_queued_emails(batch_size=batch_size)
+        # Keep draining while due messages remain
+        if alerts['events'] or summary['sent'] + summary['retried'] + summary['failed']:
+            click.echo(f"Sent {summary['sent']}, retrying {summary['retried']}, failed {summary['failed']}")
+            continue
+        if not loop:
+            break
+        db.session.remove()
+        time.sleep(interval)
+
+@app.cli.command('build-recommendations')
+@click.option('--top-k', type=int, default=None, help='Neighbours stored per shoe')
+def build_recommendations_command(top_k):
+    """Rebuild item-to-item recommendations from orders and wishlists"""
+    from recommendation_helpers import build_recommendations
+
+    summary = build_recommendations(top_k=top_k)
+    click.echo(
+        f"Stored {summary['recommendations']} recommendations for {summary['shoes']} shoes "
+        f"from {summary['customers']} customers"
+    )
+
+@app.cli.command('compute-popularity')
+def compute_popularity_command():
+    """Recompute decayed popularity scores from recent product events"""
+    from popularity_helpers import compute_popularity
+
+    summary = compute_popularity()
+    click.echo(
+        f"Scored {summary['shoes']} shoes from {summary['events']} events, "
+        f"deleted {summary['deleted']} expired events"
+    )
+
+@app.route('/metrics')
+@csrf.exempt
+def metrics():
+    """Prometheus metrics aggregated across worker processes"""
+    token = os.getenv('METRICS_TOKEN')
+    # Closed until a token is configured; init_metrics() warns at startup
+    supplied = request.headers.get('Authorization', '').encode()
+    if not token or not hmac.compare_digest(supplied, f'Bearer {token}'.encode()):
+        return 'Unauthorized', 401
+    
+    from models import EmailOutbox, StockEvent
+    
+    gauges = {}
+    try:
+        queue = db.session.execute(
+            db.select(EmailOutbox.status, db.func.count(EmailOutbox.id))
+              .where(EmailOutbox.status.in_(['Pending', 'Failed']))
+              .group_by(EmailOutbox.status)
+        ).all()
+        gauges['email_outbox_messages'] = ('Outbox emails waiting to be sent or given up on',
+                                           [({'status': status}, count) for status, count in queue])
+        pending_events = db.session.scalar(
+            db.select(db.func.count(StockEvent.id)).where(StockEvent.status == 'Pending')
+        )
+        gauges['stock_events_pending'] = ('Wishlist alert events not yet fanned out', [({}, pending_events)])
+    except Exception as e:
+        app.logger.error(f"Metrics queue depth error: {str(e)}")
+    
+    # Pool usage of the worker that served this scrape
+    stats = pool_stats(db.engine)
+    gauges['db_pool_connections'] = ('Connections in this worker\'s DB pool by state', [
+        ({'state': state}, stats[state]) for state in ('size', 'checked_in', 'checked_out', 'overflow') if state in stats
+    ])
+    
+    if 'replica' in db.engines:
+        replica = replica_status()
+        gauges['db_replica_healthy'] = ('Whether reads are being served from the replica', [({}, int(replica['healthy']))])
+        if replica['lag'] is not None:
+            gauges['db_replica_lag_seconds'] = ('Last measured replica lag', [({}, replica['lag'])])
+    
+    search_cache = search_cache_stats()
+    gauges['search_cache_bytes'] = ('Approximate size of this worker\'s search result cache', [({}, search_cache['bytes'])])
+    gauges['search_cache_entries'] = ('Queries in this worker\'s search result cache', [({}, search_cache['entries'])])
+    
+    response = make_response(render_metrics(gauges))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
 # Add this to app.py
 @app.template_filter('float')
 def format_float(value, decimals=2):
@@ -2065,6 +2374,11 @@ def format_float(value, decimals=2):
     except (ValueError, TypeError):
         return value
 
+@app.context_processor
+def inject_cart_count():
+    # Called from the navbar badge, so pages that don't render it never touch the cart store
+    return {'cart_count': cart_helpers.cart_count}
+
 # Error Handlers
 @app.errorhandler(404)
 def page_not_found(e):
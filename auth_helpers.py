@@ -0,0 +1,119 @@
+"""
+Cached user principal for Flask-Login.
+
+load_user() used to run a primary-key query on every authenticated request.
+It now returns a UserPrincipal: a small, immutable snapshot of the fields
+routes and templates actually read. The snapshot lives in the shared cache
+for a short TTL and is dropped whenever the user row changes.
+
+Code that needs to modify the user loads the User model explicitly.
+"""
+import os
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from extensions import db, cache
+from database_helpers import primary_reads
+from models import User, Shoe
+
+PRINCIPAL_CACHE_TTL = int(os.getenv('PRINCIPAL_CACHE_TTL', 60))  # Seconds
+
+
+class UserPrincipal:
+    """Read-only stand-in for the logged-in User"""
+
+    __slots__ = ('id', 'name', 'email', 'is_admin', 'admin_type', 'product_limit')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, name, email, is_admin, admin_type, product_limit):
+        for slot, value in zip(self.__slots__, (id, name, email, is_admin, admin_type, product_limit)):
+            object.__setattr__(self, slot, value)
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.name, user.email, bool(user.is_admin),
+                   user.admin_type or 'user', user.product_limit or 0)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('UserPrincipal is immutable')
+
+    def __reduce__(self):
+        return (UserPrincipal, tuple(getattr(self, slot) for slot in self.__slots__))
+
+    def __eq__(self, other):
+        return isinstance(other, (UserPrincipal, User)) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def get_id(self):
+        return str(self.id)
+
+    def is_super_admin(self):
+        """Check if user is a super admin"""
+        return self.is_admin and self.admin_type == 'super_admin'
+
+    def is_limited_admin(self):
+        """Check if user is a limited admin"""
+        return self.is_admin and self.admin_type == 'limited_admin'
+
+    def get_product_count(self):
+        """Get the number of products created by this user"""
+        return db.session.scalar(db.select(db.func.count(Shoe.id)).where(Shoe.created_by == self.id)) or 0
+
+    def can_add_product(self):
+        """Check if user can add more products"""
+        if self.is_super_admin():
+            return True
+        if self.is_limited_admin():
+            return self.get_product_count() < self.product_limit
+        return False
+
+
+def _cache_key(user_id):
+    return f"principal:{user_id}"
+
+
+def load_principal(user_id):
+    """Return the cached principal for a user ID, loading it on a miss"""
+    key = _cache_key(user_id)
+    principal = cache.get(key)
+    if principal is None:
+        # The principal is cached for PRINCIPAL_CACHE_TTL, so don't fill it from a lagging replica
+        with primary_reads():
+            user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        principal = UserPrincipal.from_user(user)
+        cache.set(key, principal, timeout=PRINCIPAL_CACHE_TTL)
+    return principal
+
+
+def invalidate_principal(user_id):
+    try:
+        cache.delete(_cache_key(user_id))
+    except Exception as e:
+        current_app.logger.warning(f"Could not invalidate principal {user_id}: {str(e)}")
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _remember_changed_user(mapper, connection, target):
+    # Invalidate after commit so a concurrent request can't re-cache the old row
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_principal(user_id)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('changed_user_ids', None)
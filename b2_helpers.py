@@ -1,9 +1,11 @@
 from b2sdk.v2 import B2Api, InMemoryAccountInfo, UploadSourceBytes
 from b2sdk.v2.exception import B2SimpleError
 from flask import current_app
+from metrics_helpers import track_gateway
 import logging
 import traceback
 
+@track_gateway('b2', 'upload')
 def upload_to_b2(file, filename):
     try:
         # Get configuration from app
@@ -0,0 +1,406 @@
+"""
+Storefront benchmark harness.
+
+Seeds a synthetic SQLite database, drives the main storefront, checkout and
+admin routes through the Flask test client and reports latency percentiles,
+SQL queries per request, template render time and peak Python memory per
+route. Results are written as JSON and can be compared against a saved
+baseline to catch regressions. It also times worker cold start: importing the app and
+serving the first request in a fresh interpreter.
+
+Usage:
+    python benchmark.py                         # seed, run, print a report
+    python benchmark.py --save-baseline         # store results as the baseline
+    python benchmark.py --compare               # fail (exit 1) on regressions
+    python benchmark.py --shoes 5000 --orders 50000 --requests 200
+    python benchmark.py --routes none --startup-runs 20   # cold start only
+
+The database is rebuilt on every run unless --reuse-db is given. The app is
+imported only after DATABASE_URL points at the benchmark database, so this
+never touches the real one.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+DEFAULT_DB = '/tmp/legit_benchmark.db'
+DEFAULT_OUTPUT = 'benchmarks/latest.json'
+DEFAULT_BASELINE = 'benchmarks/baseline.json'
+
+CATEGORIES = ['Shoes', 'Sneakers', 'Boots', 'Sandals', 'Heels', 'Loafers']
+SIZES = ['36', '37', '38', '39', '40', '41', '42', '43', '44', '45']
+# Run in a fresh interpreter per cold-start sample
+STARTUP_PROBE = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get('/').data
+served = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_request_ms': (served - imported) * 1000}))
+'''
+
+WORDS = ['air', 'classic', 'runner', 'leather', 'suede', 'canvas', 'sport', 'street',
+         'trail', 'court', 'retro', 'slip-on', 'high-top', 'low', 'chelsea', 'desert']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark storefront routes against a synthetic database')
+    parser.add_argument('--db', default=DEFAULT_DB, help='SQLite file for the synthetic database')
+    parser.add_argument('--reuse-db', action='store_true', help='Skip seeding if the database already exists')
+    parser.add_argument('--shoes', type=int, default=1000)
+    parser.add_argument('--sizes', type=int, default=6, help='Sizes per shoe')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=3000)
+    parser.add_argument('--wishlist', type=int, default=3000, help='Wishlist rows')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per route')
+    parser.add_argument('--startup-runs', type=int, default=5, help='Cold-start samples (0 to skip)')
+    parser.add_argument('--routes', help='Comma-separated subset of routes to run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='Also write the results to --baseline')
+    parser.add_argument('--compare', action='store_true', help='Compare with --baseline and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed p95 slowdown before flagging (0.25 = 25%%)')
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Point the app at the benchmark database before it is imported"""
+    if not args.reuse_db and os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    os.environ.pop('REDIS_URL', None)
+    os.environ.pop('MAIL_USERNAME', None)
+    # Cheap hashes; the benchmark measures routes, not bcrypt
+    os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+    os.environ.setdefault('PASSWORD_POOL_WORKERS', '0')
+
+
+def seed_database(args, rng):
+    """Bulk-insert synthetic users, shoes, sizes, orders, reviews and wishlists"""
+    from extensions import db
+    from models import User, Shoe, ShoeSize, Order, Review, Wishlist, CartItem
+    from password_helpers import hash_password
+
+    # Throwaway database, so build the schema straight from the models
+    db.create_all()
+    if db.session.scalar(db.select(db.func.count(Shoe.id))):
+        return
+
+    now = datetime.utcnow()
+    password_hash = hash_password('benchmark')
+
+    users = [{'email': 'admin@bench.local', 'name': 'Bench Admin', 'password_hash': password_hash,
+              'is_admin': True, 'admin_type': 'super_admin', 'product_limit': 0, 'created_at': now}]
+    users += [{'email': f'user{i}@bench.local', 'name': f'User {i}', 'password_hash': password_hash,
+               'is_admin': False, 'admin_type': 'user', 'product_limit': 0, 'created_at': now}
+              for i in range(args.users)]
+    db.session.execute(db.insert(User), users)
+
+    shoes = []
+    for i in range(args.shoes):
+        name = ' '.join(rng.sample(WORDS, 2)).title() + f' {i}'
+        shoes.append({
+            'name': name,
+            'price': round(rng.uniform(500, 15000), 2),
+            'description': f'{name} in {rng.choice(WORDS)} finish. ' * 3,
+            'image_url': f'https://example.com/images/{i}.jpg',
+            'category': rng.choice(CATEGORIES),
+            'created_by': 1,
+            'created_at': now - timedelta(minutes=args.shoes - i)
+        })
+    db.session.execute(db.insert(Shoe), shoes)
+
+    sizes_per_shoe = min(args.sizes, len(SIZES))
+    db.session.execute(db.insert(ShoeSize), [
+        {'shoe_id': shoe_id, 'size': size, 'quantity': rng.choice([0, 1, 2, 5, 10])}
+        for shoe_id in range(1, args.shoes + 1)
+        for size in rng.sample(SIZES, sizes_per_shoe)
+    ])
+
+    db.session.execute(db.insert(Order), [
+        {
+            'user_id': rng.randint(2, args.users + 1),
+            'shoe_id': rng.randint(1, args.shoes),
+            'size': rng.choice(SIZES),
+            'payment_method': rng.choice(['mpesa_stk', 'pesapal', 'manual_mpesa']),
+            'payment_status': rng.choice(['Completed', 'Completed', 'Pending', 'Failed']),
+            'status': rng.choice(['Pending', 'Processing', 'Shipped', 'Delivered']),
+            'amount': round(rng.uniform(500, 15000), 2),
+            'phone_number': '254700000000',
+            'created_at': now - timedelta(hours=rng.randint(0, 24 * 90)),
+            'updated_at': now
+        }
+        for _ in range(args.orders)
+    ])
+
+    pairs = {(rng.randint(2, args.users + 1), rng.randint(1, args.shoes)) for _ in range(args.reviews)}
+    db.session.execute(db.insert(Review), [
+        {'user_id': user_id, 'shoe_id': shoe_id, 'rating': rng.randint(1, 5),
+         'comment': 'Synthetic review', 'verified_purchase': rng.random() < 0.5,
+         'created_at': now, 'updated_at': now}
+        for user_id, shoe_id in pairs
+    ])
+
+    pairs = {(rng.randint(2, args.users + 1), rng.randint(1, args.shoes)) for _ in range(args.wishlist)}
+    db.session.execute(db.insert(Wishlist), [
+        {'user_id': user_id, 'shoe_id': shoe_id, 'created_at': now} for user_id, shoe_id in pairs
+    ])
+
+    # A small cart for the shopper used by the cart and checkout routes
+    db.session.execute(db.insert(CartItem), [
+        {'owner_key': 'user:2', 'shoe_id': shoe_id, 'size': size, 'quantity': 1, 'updated_at': now}
+        for shoe_id, size in db.session.execute(
+            db.select(ShoeSize.shoe_id, ShoeSize.size).where(ShoeSize.quantity > 0).limit(3)
+        ).all()
+    ])
+
+    db.session.commit()
+
+
+def build_scenarios(args, rng):
+    """Route name -> (client role, function returning a URL)"""
+    queries = WORDS + ['boot', 'sneak', 'leathr']
+    return {
+        'index': ('guest', lambda: '/'),
+        'index_page_filtered': ('guest', lambda: f'/?page={rng.randint(1, 10)}&sort=price_low'
+                                                 f'&category={rng.choice(CATEGORIES)}&availability=in_stock'),
+        'index_logged_in': ('shopper', lambda: '/'),
+        'search': ('guest', lambda: f'/search?q={rng.choice(queries)}'),
+        'product_detail': ('guest', lambda: f'/product/{rng.randint(1, args.shoes)}'),
+        'view_cart': ('shopper', lambda: '/cart'),
+        'checkout': ('shopper', lambda: '/checkout'),
+        'wishlist': ('shopper', lambda: '/wishlist'),
+        'admin': ('admin', lambda: '/admin'),
+        'export_orders': ('admin', lambda: '/admin/export/orders'),
+        'export_products': ('admin', lambda: '/admin/export/products'),
+    }
+
+
+def make_clients(app):
+    """Test clients for a guest, a shopper (user 2) and the super admin (user 1)"""
+    clients = {'guest': app.test_client()}
+    for role, user_id in (('admin', 1), ('shopper', 2)):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        clients[role] = client
+    return clients
+
+
+class RenderTimer:
+    """Adds up the time spent rendering templates"""
+
+    def __init__(self, app):
+        from flask import before_render_template, template_rendered
+        self.total = 0.0
+        self._started = []
+        before_render_template.connect(self._on_start, app)
+        template_rendered.connect(self._on_end, app)
+
+    def _on_start(self, sender, **extra):
+        self._started.append(time.perf_counter())
+
+    def _on_end(self, sender, **extra):
+        if self._started:
+            self.total += time.perf_counter() - self._started.pop()
+
+
+class QueryCounter:
+    """Counts SQL statements sent to the engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_scenario(client, make_url, counter, render_timer, requests, warmup):
+    for _ in range(warmup):
+        client.get(make_url())
+
+    timings, renders, queries, statuses = [], [], [], set()
+    for _ in range(requests):
+        url = make_url()
+        before = counter.count
+        rendered = render_timer.total
+        start = time.perf_counter()
+        response = client.get(url)
+        _ = response.data
+        timings.append((time.perf_counter() - start) * 1000)
+        renders.append((render_timer.total - rendered) * 1000)
+        queries.append(counter.count - before)
+        statuses.add(response.status_code)
+
+    # Separate pass for memory so tracemalloc overhead doesn't skew latency
+    tracemalloc.start()
+    client.get(make_url()).data
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'render_ms': round(statistics.fmean(renders), 3),
+        'queries_per_request': round(statistics.fmean(queries), 2),
+        'max_queries': max(queries),
+        'peak_memory_kb': round(peak / 1024, 1),
+        'status_codes': sorted(statuses)
+    }
+
+
+def measure_startup(runs):
+    """Time app import and first request in fresh interpreters"""
+    samples = {'process_ms': [], 'import_ms': [], 'first_request_ms': []}
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout
+        samples['process_ms'].append((time.perf_counter() - start) * 1000)
+        for key, value in json.loads(output.strip().splitlines()[-1]).items():
+            samples[key].append(value)
+
+    result = {'runs': runs}
+    for key, values in samples.items():
+        result[f'{key}_p50'] = round(percentile(values, 50), 1)
+        result[f'{key}_max'] = round(max(values), 1)
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results with a baseline
+
+    Returns:
+        list: Human-readable regression messages (empty if none)
+    """
+    regressions = []
+    for route, current in results['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append(f"{route}: queries/request {previous['queries_per_request']} -> {current['queries_per_request']}")
+        if current['peak_memory_kb'] > previous['peak_memory_kb'] * (1 + tolerance):
+            regressions.append(f"{route}: peak memory {previous['peak_memory_kb']}KB -> {current['peak_memory_kb']}KB")
+
+    current, previous = results.get('startup'), baseline.get('startup')
+    if current and previous and current['process_ms_p50'] > previous['process_ms_p50'] * (1 + tolerance):
+        regressions.append(f"startup: {previous['process_ms_p50']:.0f}ms -> {current['process_ms_p50']:.0f}ms")
+    return regressions
+
+
+def print_report(results):
+    header = f"{'route':<22}{'p50':>9}{'p95':>9}{'p99':>9}{'render':>9}{'queries':>9}{'peak KB':>10}  status"
+    print(header)
+    print('-' * len(header))
+    for route, r in results['routes'].items():
+        print(f"{route:<22}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}{r.get('render_ms', 0):>9.2f}"
+              f"{r['queries_per_request']:>9}{r['peak_memory_kb']:>10}  {','.join(map(str, r['status_codes']))}")
+
+    startup = results.get('startup')
+    if startup:
+        print(f"\ncold start ({startup['runs']} runs, p50/max ms): process {startup['process_ms_p50']}/{startup['process_ms_max']}, "
+              f"import {startup['import_ms_p50']}/{startup['import_ms_max']}, "
+              f"first request {startup['first_request_ms_p50']}/{startup['first_request_ms_max']}")
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    configure_environment(args)
+
+    from app import app
+    from extensions import db
+
+    app.config.update(WTF_CSRF_ENABLED=False, SESSION_COOKIE_SECURE=False)
+
+    with app.app_context():
+        start = time.perf_counter()
+        seed_database(args, rng)
+        seed_seconds = time.perf_counter() - start
+        counter = QueryCounter(db.engine)
+    render_timer = RenderTimer(app)
+
+    scenarios = build_scenarios(args, rng)
+    if args.routes:
+        wanted = {name.strip() for name in args.routes.split(',')}
+        scenarios = {name: scenario for name, scenario in scenarios.items() if name in wanted}
+
+    clients = make_clients(app)
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'dataset': {key: getattr(args, key) for key in ('shoes', 'sizes', 'users', 'orders', 'reviews', 'wishlist')},
+            'seed_seconds': round(seed_seconds, 2)
+        },
+        'routes': {}
+    }
+
+    for name, (role, make_url) in scenarios.items():
+        results['routes'][name] = run_scenario(clients[role], make_url, counter, render_timer, args.requests,
+                                              args.warmup)
+
+    if args.startup_runs > 0:
+        results['startup'] = measure_startup(args.startup_runs)
+
+    print_report(results)
+    write_json(args.output, results)
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nRegressions:')
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print('\nNo regressions against baseline')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""
+Server-side shopping cart store.
+
+Carts used to live in session['cart'] as a list with one dict per item, so
+every add/remove rewrote the whole (filesystem) session and a cart only
+existed on the machine that served it. Carts are now kept per owner, as
+quantity-aggregated lines keyed by (shoe_id, size):
+
+- a Redis hash per cart when REDIS_URL is configured
+  (cart:<owner>, field "<shoe_id>:<size>" -> quantity)
+- otherwise the cart_items table
+
+The owner is 'user:<id>' for logged-in customers and 'guest:<token>' for
+guests, with the token kept in the session. The guest cart is merged into
+the user's cart on login.
+"""
+import os
+import secrets
+from datetime import datetime, timedelta
+from flask import current_app, session
+from flask_login import current_user
+from extensions import db
+from models import CartItem
+
+# Cart Configuration
+CART_GUEST_TTL_DAYS = int(os.getenv('CART_GUEST_TTL_DAYS', 30))  # Abandoned guest carts expire
+CART_MAX_QUANTITY = int(os.getenv('CART_MAX_QUANTITY', 20))  # Per product and size
+
+
+def _field(shoe_id, size):
+    return f"{shoe_id}:{size}"
+
+
+def _parse_field(field):
+    if isinstance(field, bytes):
+        field = field.decode('utf-8')
+    shoe_id, size = field.split(':', 1)
+    return int(shoe_id), size
+
+
+class RedisCartStore:
+    """Carts as Redis hashes; every operation is a single O(1) hash command"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, owner):
+        return f"cart:{owner}"
+
+    def _touch(self, pipe, owner):
+        if owner.startswith('guest:'):
+            pipe.expire(self._key(owner), timedelta(days=CART_GUEST_TTL_DAYS))
+
+    def lines(self, owner):
+        return {_parse_field(field): int(quantity)
+                for field, quantity in self.client.hgetall(self._key(owner)).items()}
+
+    def count(self, owner):
+        return sum(int(quantity) for quantity in self.client.hvals(self._key(owner)))
+
+    def add(self, owner, shoe_id, size, quantity=1):
+        pipe = self.client.pipeline()
+        pipe.hincrby(self._key(owner), _field(shoe_id, size), quantity)
+        self._touch(pipe, owner)
+        return pipe.execute()[0]
+
+    def set_quantity(self, owner, shoe_id, size, quantity):
+        if quantity <= 0:
+            return self.remove(owner, shoe_id, size)
+        pipe = self.client.pipeline()
+        pipe.hset(self._key(owner), _field(shoe_id, size), quantity)
+        self._touch(pipe, owner)
+        pipe.execute()
+
+    def remove(self, owner, shoe_id, size):
+        self.client.hdel(self._key(owner), _field(shoe_id, size))
+
+    def clear(self, owner):
+        self.client.delete(self._key(owner))
+
+    def merge(self, source, target):
+        lines = self.client.hgetall(self._key(source))
+        if not lines:
+            return
+        pipe = self.client.pipeline()
+        for field, quantity in lines.items():
+            pipe.hincrby(self._key(target), field, int(quantity))
+        pipe.delete(self._key(source))
+        merged = pipe.execute()[:len(lines)]
+
+        over = [field for field, quantity in zip(lines, merged) if quantity > CART_MAX_QUANTITY]
+        if over:
+            self.client.hset(self._key(target), mapping={field: CART_MAX_QUANTITY for field in over})
+
+
+class DatabaseCartStore:
+    """Carts as cart_items rows, one per (owner, shoe_id, size)"""
+
+    def _upsert(self, owner, shoe_id, size, quantity, replace=False):
+        values = {'owner_key': owner, 'shoe_id': shoe_id, 'size': size,
+                  'quantity': quantity, 'updated_at': datetime.utcnow()}
+        dialect = db.session.get_bind().dialect.name
+
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            stmt = insert(CartItem).values(**values)
+            new_quantity = stmt.excluded.quantity if replace else CartItem.quantity + stmt.excluded.quantity
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['owner_key', 'shoe_id', 'size'],
+                set_={'quantity': new_quantity, 'updated_at': stmt.excluded.updated_at}
+            ))
+            return
+
+        line = CartItem.query.filter_by(owner_key=owner, shoe_id=shoe_id, size=size).first()
+        if line:
+            line.quantity = quantity if replace else line.quantity + quantity
+        else:
+            db.session.add(CartItem(**values))
+
+    def lines(self, owner):
+        rows = db.session.execute(
+            db.select(CartItem.shoe_id, CartItem.size, CartItem.quantity)
+              .where(CartItem.owner_key == owner)
+              .order_by(CartItem.id)
+        ).all()
+        return {(shoe_id, size): quantity for shoe_id, size, quantity in rows}
+
+    def count(self, owner):
+        return db.session.scalar(
+            db.select(db.func.coalesce(db.func.sum(CartItem.quantity), 0))
+              .where(CartItem.owner_key == owner)
+        )
+
+    def add(self, owner, shoe_id, size, quantity=1):
+        self._upsert(owner, shoe_id, size, quantity)
+        db.session.commit()
+        return db.session.scalar(
+            db.select(CartItem.quantity)
+              .where(CartItem.owner_key == owner, CartItem.shoe_id == shoe_id, CartItem.size == size)
+        )
+
+    def set_quantity(self, owner, shoe_id, size, quantity):
+        if quantity <= 0:
+            return self.remove(owner, shoe_id, size)
+        self._upsert(owner, shoe_id, size, quantity, replace=True)
+        db.session.commit()
+
+    def remove(self, owner, shoe_id, size):
+        CartItem.query.filter_by(owner_key=owner, shoe_id=shoe_id, size=size).delete()
+        db.session.commit()
+
+    def clear(self, owner):
+        CartItem.query.filter_by(owner_key=owner).delete()
+        db.session.commit()
+
+    def merge(self, source, target):
+        for (shoe_id, size), quantity in self.lines(source).items():
+            self._upsert(target, shoe_id, size, quantity)
+        CartItem.query.filter(CartItem.owner_key == target, CartItem.quantity > CART_MAX_QUANTITY)\
+                      .update({'quantity': CART_MAX_QUANTITY}, synchronize_session=False)
+        CartItem.query.filter_by(owner_key=source).delete()
+        db.session.commit()
+
+
+def get_cart_store():
+    """Return the cart store for this app, created on first use"""
+    store = current_app.extensions.get('cart_store')
+    if store is None:
+        client = current_app.config.get('SESSION_REDIS')
+        store = RedisCartStore(client) if client is not None else DatabaseCartStore()
+        current_app.extensions['cart_store'] = store
+    return store
+
+
+def cart_owner(create=False):
+    """
+    Cart owner key for the current visitor
+
+    Guests only get a token once they add something, so browsing doesn't
+    create carts. Returns None for a guest without a cart.
+    """
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+
+    token = session.get('cart_token')
+    if not token and create:
+        token = session['cart_token'] = secrets.token_urlsafe(16)
+    return f"guest:{token}" if token else None
+
+
+def _import_session_cart(owner):
+    """Move a legacy session['cart'] list into the cart store"""
+    legacy = session.pop('cart', None)
+    if not legacy:
+        return
+    store = get_cart_store()
+    for item in legacy:
+        if isinstance(item, dict) and item.get('shoe_id'):
+            store.add(owner, int(item['shoe_id']), str(item.get('size', 'Size not specified')))
+        elif isinstance(item, int):
+            store.add(owner, item, 'Size not specified')
+
+
+def get_cart_lines():
+    """
+    Current visitor's cart
+
+    Returns:
+        dict: {(shoe_id, size): quantity}
+    """
+    owner = cart_owner(create='cart' in session)
+    if owner is None:
+        return {}
+    if 'cart' in session:
+        _import_session_cart(owner)
+    return get_cart_store().lines(owner)
+
+
+def cart_count():
+    """Number of items (summing quantities) in the current visitor's cart"""
+    owner = cart_owner()
+    if owner is None:
+        return len(session.get('cart') or [])
+    if 'cart' in session:
+        _import_session_cart(owner)
+    return get_cart_store().count(owner)
+
+
+def add_to_cart(shoe_id, size, quantity=1):
+    """
+    Add items to the current visitor's cart
+
+    Returns:
+        int: New quantity of the line, capped at CART_MAX_QUANTITY
+    """
+    owner = cart_owner(create=True)
+    store = get_cart_store()
+    new_quantity = store.add(owner, shoe_id, size, quantity)
+    if new_quantity > CART_MAX_QUANTITY:
+        store.set_quantity(owner, shoe_id, size, CART_MAX_QUANTITY)
+        new_quantity = CART_MAX_QUANTITY
+    return new_quantity
+
+
+def set_cart_quantity(shoe_id, size, quantity):
+    owner = cart_owner()
+    if owner is not None:
+        get_cart_store().set_quantity(owner, shoe_id, size, min(quantity, CART_MAX_QUANTITY))
+
+
+def remove_from_cart(shoe_id, size):
+    owner = cart_owner()
+    if owner is not None:
+        get_cart_store().remove(owner, shoe_id, size)
+
+
+def clear_cart():
+    owner = cart_owner()
+    if owner is not None:
+        get_cart_store().clear(owner)
+    session.pop('cart', None)
+
+
+def merge_guest_cart(user):
+    """
+    Fold the guest cart into the user's cart after login
+
+    Call after login_user(); quantities of lines in both carts are added,
+    up to CART_MAX_QUANTITY.
+    """
+    owner = f"user:{user.id}"
+    token = session.pop('cart_token', None)
+    if token:
+        get_cart_store().merge(f"guest:{token}", owner)
+    if 'cart' in session:
+        _import_session_cart(owner)
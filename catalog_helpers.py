@@ -0,0 +1,742 @@
+"""
+Shared, memory-mapped catalog snapshot for storefront listings.
+
+The catalog (shoes and their sizes) is small next to the traffic that lists
+it, so listing, search and related-products lookups are answered from a
+read-only snapshot instead of SQL. The snapshot is a compact binary file in
+CATALOG_SNAPSHOT_DIR that every gunicorn worker memory-maps, so the pages
+live once in the OS page cache however many workers there are, and a new
+worker starts serving from the existing file without querying anything.
+
+File layout (little-endian): an 8-byte magic, the format version and the
+length of a JSON directory, the directory itself (catalog version, build
+time, categories, sizes and where each section starts), then 8-byte aligned
+sections:
+
+- filter columns: shoe IDs, prices, category codes, an in-stock flag and one
+  availability flag array per size
+- popularity scores (from popularity_helpers), for the popular sort and
+  search ranking
+- one precomputed permutation per sort order
+- display rows, one JSON record per shoe, decoded only for the page shown
+- lowercased search text, searched in place with mmap.find()
+- facet bitsets (one bit per shoe) for every category, price bucket, size
+  and the in-stock flag; the sidebar counts are ANDs and popcounts of these
+
+Listings page with keyset cursors: an opaque token holding the sort values of
+the last shoe shown. The next page starts after that shoe wherever it now
+sits, so infinite scroll neither repeats nor skips shoes when the catalog
+changes between requests. Totals are the length of the filtered positions.
+
+Columns are read through NumPy views when NumPy is installed and through
+memoryview casts otherwise; neither copies the data.
+
+Commits that touch Shoe or ShoeSize rows publish the changed shoe IDs: in the
+shared cache (versioned, when it is Redis) or in an append-only change log
+next to the snapshot (when the cache is per-process). A worker checks for
+changes at most every CATALOG_CHECK_SECONDS. The first one to notice takes a
+file lock, reloads only the changed shoes, writes a new file and atomically
+renames it over the old one; the others map the new file. Mappings of the old
+file stay valid until the requests using them finish.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import event
+from extensions import db, cache, cache_is_shared
+from database_helpers import primary_reads
+from models import Shoe, ShoeSize
+from read_model_helpers import CatalogShoe, shoe_rows
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # No cross-process lock; concurrent rebuilds are wasted work, not errors
+
+# Catalog Configuration
+CATALOG_SNAPSHOT_DIR = os.getenv('CATALOG_SNAPSHOT_DIR', '/tmp/legit_catalog')
+CATALOG_CHECK_SECONDS = float(os.getenv('CATALOG_CHECK_SECONDS', 2))  # How often a worker looks for product changes
+CATALOG_MAX_AGE = float(os.getenv('CATALOG_MAX_AGE', 600))  # Full rebuild at least this often (seconds)
+CATALOG_MAX_INCREMENTAL = int(os.getenv('CATALOG_MAX_INCREMENTAL', 200))  # More changed shoes than this: rebuild
+PRICE_FACET_BOUNDS = [float(bound) for bound in os.getenv('PRICE_FACET_BOUNDS', '1000,2500,5000,10000').split(',')]
+
+CATALOG_VERSION_KEY = 'catalog:version'
+SORT_ORDERS = ('newest', 'price_low', 'price_high', 'name_az', 'name_za', 'popular')
+# Keyset of each listing order as (column, descending) pairs; ties go newest first
+SORT_KEYS = {
+    'newest': (('id', True),),
+    'price_low': (('price', False), ('id', True)),
+    'price_high': (('price', True), ('id', True)),
+    'name_az': (('name', False), ('id', True)),
+    'name_za': (('name', True), ('id', True)),
+    'popular': (('popularity', True), ('id', True))
+}
+_CURSOR_TYPES = {'id': (int,), 'price': (int, float), 'name': (str,), 'popularity': (int, float)}
+
+MAGIC = b'LGCATSNP'
+FORMAT_VERSION = 4
+_HEADER = struct.Struct('<8sII')  # magic, format version, directory length
+_NUMPY_TYPES = {'q': 'int64', 'd': 'float64', 'i': 'int32', '?': 'bool'}
+
+
+class CatalogPagination(Pagination):
+    """Flask-SQLAlchemy pagination over snapshot positions"""
+
+    def _query_items(self):
+        snapshot = self._query_args['snapshot']
+        positions = self._query_args['positions']
+        return [snapshot.row(i) for i in positions[self._query_offset:self._query_offset + self.per_page]]
+
+    def _query_count(self):
+        return len(self._query_args['positions'])
+
+    @property
+    def next_cursor(self):
+        """Cursor continuing after this page, or None on the last page or an unsorted listing"""
+        if not self.has_next or self._query_args['sort_by'] is None:
+            return None
+        last = self._query_args['positions'][self._query_offset + len(self.items) - 1]
+        return self._query_args['snapshot'].cursor_for(int(last), self._query_args['sort_by'])
+
+
+class CatalogCursorPage:
+    """One keyset-paginated page of snapshot positions"""
+
+    def __init__(self, snapshot, positions, start, per_page, sort_by):
+        end = start + per_page
+        self.items = [snapshot.row(int(i)) for i in positions[start:end]]
+        self.per_page = per_page
+        self.total = len(positions)
+        self.has_next = end < self.total
+        self.next_cursor = snapshot.cursor_for(int(positions[end - 1]), sort_by) if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def encode_cursor(sort_by, values):
+    """Opaque token for the sort values of the last shoe on a page"""
+    raw = json.dumps([sort_by, values], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(token, sort_by):
+    """Sort values from a token made for this sort order, or None"""
+    try:
+        cursor_sort, values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    keys = SORT_KEYS.get(sort_by, ())
+    if cursor_sort != sort_by or not isinstance(values, list) or len(values) != len(keys):
+        return None
+    for (column, _), value in zip(keys, values):
+        if isinstance(value, bool) or not isinstance(value, _CURSOR_TYPES[column]):
+            return None
+    return values
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _pack_bits(flags):
+    """Bitset (int, bit i = position i) from a sequence of truthy flags or a NumPy bool array"""
+    if NUMPY_AVAILABLE and isinstance(flags, np.ndarray):
+        return int.from_bytes(np.packbits(flags, bitorder='little').tobytes(), 'little')
+    return int(''.join('1' if flag else '0' for flag in reversed(flags)) or '0', 2)
+
+
+def price_buckets(bounds):
+    """[(low, high)] price ranges between the bounds; high is None for the last one"""
+    edges = [0.0] + sorted(bounds)
+    return [(low, round(high - 0.01, 2)) for low, high in zip(edges, edges[1:])] + [(edges[-1], None)]
+
+
+def size_sort_key(size):
+    """Numeric sizes in numeric order, then the rest alphabetically"""
+    try:
+        return (0, float(size), '')
+    except (TypeError, ValueError):
+        return (1, 0.0, str(size))
+
+
+def serialize_catalog(rows, version, changed_since=None):
+    """
+    Encode catalog rows as a snapshot file
+
+    changed_since is (base version, changed shoe IDs) for an incremental
+    build, so per-shoe caches can carry over from the base snapshot.
+    """
+    rows = sorted(rows, key=lambda row: row.id)
+    n = len(rows)
+
+    categories = {}
+    category_codes = [categories.setdefault(row.category, len(categories)) for row in rows]
+    prices = [float(row.price or 0) for row in rows]
+    popularity = [float(row.popularity or 0) for row in rows]
+    in_stock = bytes(int(any((size.quantity or 0) > 0 for size in row.sizes)) for row in rows)
+    size_stock = {}
+    for i, row in enumerate(rows):
+        for size in row.sizes:
+            if (size.quantity or 0) > 0:
+                size_stock.setdefault(size.size, bytearray(n))[i] = 1
+
+    # Newest first is the base order; the other orders break ties the same way
+    newest = list(range(n - 1, -1, -1))
+    orders = {
+        'newest': newest,
+        'price_low': sorted(newest, key=lambda i: prices[i]),
+        'price_high': sorted(newest, key=lambda i: -prices[i]),
+        'name_az': sorted(newest, key=lambda i: rows[i].name),
+        'name_za': sorted(newest, key=lambda i: rows[i].name, reverse=True),
+        'popular': sorted(newest, key=lambda i: -popularity[i])
+    }
+
+    records = [json.dumps(row.to_record(), separators=(',', ':')).encode() for row in rows]
+    texts = [row.search_text.replace('\x00', '').encode() + b'\x00' for row in rows]
+
+    def offsets(chunks):
+        result = array('q', [0])
+        for chunk in chunks:
+            result.append(result[-1] + len(chunk))
+        return result
+
+    sections = [
+        ('ids', 'q', array('q', [row.id for row in rows]).tobytes()),
+        ('price', 'd', array('d', prices).tobytes()),
+        ('popularity', 'd', array('d', popularity).tobytes()),
+        ('category', 'i', array('i', category_codes).tobytes()),
+        ('in_stock', '?', in_stock),
+        ('row_offsets', 'q', offsets(records).tobytes()),
+        ('rows', 'blob', b''.join(records)),
+        ('search_offsets', 'q', offsets(texts).tobytes()),
+        ('search', 'blob', b''.join(texts))
+    ]
+    sections += [(f'order:{name}', 'i', array('i', order).tobytes()) for name, order in orders.items()]
+    sizes = sorted(size_stock, key=size_sort_key)
+    sections += [(f'size:{size}', '?', bytes(size_stock[size])) for size in sizes]
+
+    # Facet bitsets
+    def bits(flags):
+        return _pack_bits(flags).to_bytes((n + 7) // 8, 'little')
+
+    buckets = price_buckets(PRICE_FACET_BOUNDS)
+    sections.append(('bits:in_stock', 'bits', bits(in_stock)))
+    sections += [(f'bits:category:{code}', 'bits', bits([c == code for c in category_codes]))
+                 for code in range(len(categories))]
+    sections += [(f'bits:price:{i}', 'bits', bits([price >= low and (high is None or price <= high) for price in prices]))
+                 for i, (low, high) in enumerate(buckets)]
+    sections += [(f'bits:size:{size}', 'bits', bits(size_stock[size])) for size in sizes]
+
+    directory = {'version': version, 'built_at': time.time(), 'count': n,
+                 'categories': list(categories), 'sizes': sizes, 'price_buckets': buckets,
+                 'changed_since': changed_since, 'sections': {}}
+    body = bytearray()
+    for name, fmt, data in sections:
+        body.extend(b'\x00' * (_align(len(body)) - len(body)))
+        directory['sections'][name] = [len(body), fmt, len(data)]
+        body.extend(data)
+
+    encoded = json.dumps(directory, separators=(',', ':')).encode()
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(encoded)) + encoded
+    return header + b'\x00' * (_align(len(header)) - len(header)) + bytes(body)
+
+
+class CatalogSnapshot:
+    """Read-only view over a snapshot file (an mmap, or bytes when no file could be written)"""
+
+    def __init__(self, buffer, file_id=None):
+        magic, format_version, directory_length = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError('Not a catalog snapshot of this format')
+        directory = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + directory_length]))
+
+        self.buffer = buffer
+        self.file_id = file_id
+        self.version = directory['version']
+        self.built_at = directory['built_at']
+        self.changed_since = directory['changed_since']
+        self.count = directory['count']
+        self.categories = {name: code for code, name in enumerate(directory['categories'])}
+        self._base = _align(_HEADER.size + directory_length)
+        self._sections = directory['sections']
+
+        self.ids = self._column('ids')
+        self.price = self._column('price')
+        self.popularity = self._column('popularity')
+        self.category = self._column('category')
+        self.in_stock = self._column('in_stock')
+        self.row_offsets = self._column('row_offsets')
+        self.search_offsets = self._column('search_offsets')
+        self.orders = {name: self._column(f'order:{name}') for name in SORT_ORDERS}
+        self.size_stock = {size: self._column(f'size:{size}') for size in directory['sizes']}
+
+        # Facet bitsets are small (one bit per shoe), so each worker holds them as ints
+        self.price_buckets = [tuple(bucket) for bucket in directory['price_buckets']]
+        self._all_bits = (1 << self.count) - 1
+        self._in_stock_bits = self._bitset('bits:in_stock')
+        self._category_bits = {name: self._bitset(f'bits:category:{code}') for name, code in self.categories.items()}
+        self._price_bits = [self._bitset(f'bits:price:{i}') for i in range(len(self.price_buckets))]
+        self._size_bits = {size: self._bitset(f'bits:size:{size}') for size in directory['sizes']}
+
+        self._ranks = {}  # Sort order -> position's place in it, built on first use
+        self._pool = None  # Shuffled in-stock positions for sample(), built on first use
+        self._pool_turns = itertools.count()
+
+    def _column(self, name):
+        offset, fmt, length = self._sections[name]
+        start = self._base + offset
+        if NUMPY_AVAILABLE:
+            dtype = np.dtype(_NUMPY_TYPES[fmt])
+            return np.frombuffer(self.buffer, dtype=dtype, count=length // dtype.itemsize, offset=start)
+        return memoryview(self.buffer)[start:start + length].cast(fmt)
+
+    def _blob_start(self, name):
+        return self._base + self._sections[name][0]
+
+    def _bitset(self, name):
+        offset, _, length = self._sections[name]
+        return int.from_bytes(self.buffer[self._base + offset:self._base + offset + length], 'little')
+
+    def __len__(self):
+        return self.count
+
+    def row(self, position):
+        """Decode the display row at a position"""
+        start = self._blob_start('rows')
+        record = self.buffer[start + int(self.row_offsets[position]):start + int(self.row_offsets[position + 1])]
+        return CatalogShoe.from_record(json.loads(bytes(record)))
+
+    def rows(self):
+        return [self.row(i) for i in range(self.count)]
+
+    def positions_of(self, shoe_ids):
+        """Positions of shoes by ID, in the same order, skipping IDs not in this snapshot"""
+        if NUMPY_AVAILABLE:
+            shoe_ids = np.asarray(shoe_ids, dtype=np.int64)
+            positions = np.minimum(np.searchsorted(self.ids, shoe_ids), max(self.count - 1, 0))
+            return positions[self.ids[positions] == shoe_ids] if self.count else positions[:0]
+        positions = (bisect_left(self.ids, shoe_id) for shoe_id in shoe_ids)
+        return [position for position, shoe_id in zip(positions, shoe_ids)
+                if position < self.count and self.ids[position] == shoe_id]
+
+    def get(self, shoe_id):
+        position = bisect_left(self.ids, shoe_id)
+        if position < self.count and self.ids[position] == shoe_id:
+            return self.row(position)
+        return None
+
+    def select(self, min_price=None, max_price=None, category=None, availability=None, size=None, sort_by='newest'):
+        """
+        Positions of the shoes matching the filters, in display order
+
+        Mirrors the storefront's SQL: price bounds are inclusive, in_stock means
+        at least one size available, out_of_stock means none.
+        """
+        order = self.orders.get(sort_by, self.orders['newest'])
+        category_code = self.categories.get(category, -1) if category else None
+        size_flags = self.size_stock.get(size) if size else None
+
+        if NUMPY_AVAILABLE:
+            mask = np.ones(self.count, dtype=bool)
+            if min_price is not None:
+                mask &= self.price >= min_price
+            if max_price is not None:
+                mask &= self.price <= max_price
+            if category_code is not None:
+                mask &= self.category == category_code
+            if availability == 'in_stock':
+                mask &= self.in_stock
+            elif availability == 'out_of_stock':
+                mask &= ~self.in_stock
+            if size:
+                mask &= size_flags if size_flags is not None else False
+            return order[mask[order]]
+
+        def keep(i):
+            return ((min_price is None or self.price[i] >= min_price) and
+                    (max_price is None or self.price[i] <= max_price) and
+                    (category_code is None or self.category[i] == category_code) and
+                    (availability != 'in_stock' or self.in_stock[i]) and
+                    (availability != 'out_of_stock' or not self.in_stock[i]) and
+                    (not size or (size_flags is not None and size_flags[i])))
+        return [i for i in order if keep(i)]
+
+    def facet_counts(self, min_price=None, max_price=None, category=None, availability=None, size=None):
+        """
+        Result counts for each value of each facet
+
+        Each facet is counted with every other applied filter but not its own,
+        so the sidebar shows what choosing a different value would return.
+
+        Returns:
+            dict: category and size as [(value, count)], price as
+                [(low, high, count)], availability as {'in_stock': n, 'out_of_stock': n}
+        """
+        everything = self._all_bits
+
+        price = everything
+        if min_price is not None or max_price is not None:
+            if NUMPY_AVAILABLE:
+                mask = np.ones(self.count, dtype=bool)
+                if min_price is not None:
+                    mask &= self.price >= min_price
+                if max_price is not None:
+                    mask &= self.price <= max_price
+                price = _pack_bits(mask)
+            else:
+                price = _pack_bits([(min_price is None or p >= min_price) and (max_price is None or p <= max_price)
+                                    for p in self.price])
+        by_category = self._category_bits.get(category, 0) if category else everything
+        by_availability = {'in_stock': self._in_stock_bits,
+                           'out_of_stock': everything & ~self._in_stock_bits}.get(availability, everything)
+        by_size = self._size_bits.get(size, 0) if size else everything
+
+        return {
+            'category': sorted(((name, (bits & price & by_availability & by_size).bit_count())
+                                for name, bits in self._category_bits.items() if name),
+                               key=lambda item: item[0].lower()),
+            'price': [(low, high, (bits & by_category & by_availability & by_size).bit_count())
+                      for (low, high), bits in zip(self.price_buckets, self._price_bits)],
+            'size': [(name, (bits & price & by_category & by_availability).bit_count())
+                     for name, bits in self._size_bits.items()],
+            'availability': {
+                'in_stock': (self._in_stock_bits & price & by_category & by_size).bit_count(),
+                'out_of_stock': (everything & ~self._in_stock_bits & price & by_category & by_size).bit_count()
+            }
+        }
+
+    def sort(self, positions, sort_by):
+        """The given positions (e.g. search results) rearranged into a sort order"""
+        sort_by = sort_by if sort_by in SORT_ORDERS else 'newest'
+        ranks = self._ranks.get(sort_by)
+        if ranks is None:
+            order = self.orders[sort_by]
+            if NUMPY_AVAILABLE:
+                ranks = np.empty(self.count, dtype=np.int32)
+                ranks[order] = np.arange(self.count, dtype=np.int32)
+            else:
+                ranks = [0] * self.count
+                for rank, position in enumerate(order):
+                    ranks[position] = rank
+            self._ranks[sort_by] = ranks
+        if NUMPY_AVAILABLE:
+            positions = np.asarray(positions, dtype=np.int64)
+            return positions[np.argsort(ranks[positions], kind='stable')]
+        return sorted(positions, key=ranks.__getitem__)
+
+    def search_text(self, position):
+        """Lowercased name, description and category of the shoe at a position"""
+        start = self._blob_start('search')
+        return bytes(self.buffer[start + int(self.search_offsets[position]):
+                                 start + int(self.search_offsets[position + 1]) - 1]).decode()
+
+    def search(self, text):
+        """Positions of shoes whose name, description or category contains the text, oldest first"""
+        needle = (text or '').lower().replace('\x00', '').encode()
+        if not needle:
+            return list(range(self.count))
+
+        start = self._blob_start('search')
+        end = start + self._sections['search'][2]
+        positions = []
+        cursor = start
+        while True:
+            found = self.buffer.find(needle, cursor, end)
+            if found < 0:
+                return positions
+            position = bisect_right(self.search_offsets, found - start) - 1
+            positions.append(position)
+            cursor = start + int(self.search_offsets[position + 1])
+
+    def paginate(self, positions, page=None, per_page=9, error_out=True, sort_by='newest'):
+        """Numbered pages of positions; sort_by=None for an order cursors can't resume (no next_cursor)"""
+        if sort_by is not None and sort_by not in SORT_KEYS:
+            sort_by = 'newest'
+        return CatalogPagination(page=page, per_page=per_page, error_out=error_out,
+                                 snapshot=self, positions=positions, sort_by=sort_by)
+
+    def sort_values(self, position, sort_by):
+        """Values of the shoe at a position for the keyset of a sort order"""
+        values = []
+        for column, _ in SORT_KEYS[sort_by]:
+            if column == 'id':
+                values.append(int(self.ids[position]))
+            elif column == 'price':
+                values.append(float(self.price[position]))
+            elif column == 'popularity':
+                values.append(float(self.popularity[position]))
+            else:
+                values.append(self.row(position).name)
+        return values
+
+    def cursor_for(self, position, sort_by):
+        return encode_cursor(sort_by, self.sort_values(position, sort_by))
+
+    def _after(self, position, sort_by, cursor):
+        for (_, descending), value, bound in zip(SORT_KEYS[sort_by], self.sort_values(position, sort_by), cursor):
+            if value != bound:
+                return value < bound if descending else value > bound
+        return False
+
+    def page_after(self, positions, cursor, sort_by='newest', per_page=9):
+        """
+        The page of positions following a cursor token
+
+        positions must be in sort_by order. Shoes sorting after the cursor are
+        found by binary search, so any page costs the same as the first. An
+        invalid or foreign cursor starts from the beginning.
+        """
+        sort_by = sort_by if sort_by in SORT_KEYS else 'newest'
+        values = decode_cursor(cursor, sort_by) if cursor else None
+        start = 0
+        if values is not None:
+            high = len(positions)
+            while start < high:
+                middle = (start + high) // 2
+                if self._after(int(positions[middle]), sort_by, values):
+                    high = middle
+                else:
+                    start = middle + 1
+        return CatalogCursorPage(self, positions, start, per_page, sort_by)
+
+    def sample(self, k, exclude=()):
+        """
+        Up to k shoes not in exclude (a set of shoe IDs)
+
+        Shoes are dealt in turn from a pool of the in-stock shoes shuffled once
+        per snapshot, so successive calls show different shoes without drawing
+        random numbers per request.
+        """
+        if self._pool is None:
+            pool = [i for i in range(self.count) if self.in_stock[i]] or list(range(self.count))
+            random.shuffle(pool)
+            self._pool = pool
+        if k <= 0 or not self._pool:
+            return []
+
+        start = next(self._pool_turns) * k
+        rows = []
+        for offset in range(len(self._pool)):
+            position = self._pool[(start + offset) % len(self._pool)]
+            if int(self.ids[position]) not in exclude:
+                rows.append(self.row(position))
+                if len(rows) == k:
+                    break
+        return rows
+
+
+_state = {'snapshot': None, 'checked_at': float('-inf')}
+_lock = threading.Lock()
+
+
+def _paths():
+    """Snapshot, lock and change-log paths for the configured database"""
+    digest = hashlib.sha1(current_app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+    base = os.path.join(CATALOG_SNAPSHOT_DIR, f"catalog-{digest}")
+    return base + '.bin', base + '.lock', base + '.changes'
+
+
+def _load_rows(shoe_ids=None):
+    """CatalogShoe rows for all shoes, or only the given IDs (two queries either way)"""
+    # A stale replica would leave the snapshot stale until the next change
+    with primary_reads():
+        return shoe_rows() if shoe_ids is None else shoe_rows(Shoe.id.in_(shoe_ids))
+
+
+def _current_version():
+    """Latest published change version, or None if unknown"""
+    try:
+        if cache_is_shared():
+            return cache.get(CATALOG_VERSION_KEY)
+        return os.stat(_paths()[2]).st_size
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        current_app.logger.warning(f"Catalog version lookup failed: {str(e)}")
+        return None
+
+
+def _changed_ids(from_version, to_version):
+    """Shoe IDs changed between two versions, or None if that can't be told"""
+    changed = set()
+    if cache_is_shared():
+        if to_version - from_version > CATALOG_MAX_INCREMENTAL:
+            return None
+        keys = [f"catalog:changes:{version}" for version in range(from_version + 1, to_version + 1)]
+        for ids in cache.get_many(*keys):
+            if ids is None:
+                return None
+            changed.update(ids)
+    else:
+        # The change log's size is its version: read the lines appended since
+        with open(_paths()[2], 'rb') as f:
+            f.seek(from_version)
+            for line in f.read(to_version - from_version).split(b'\n'):
+                changed.update(int(shoe_id) for shoe_id in line.split(b',') if shoe_id)
+    return changed if len(changed) <= CATALOG_MAX_INCREMENTAL else None
+
+
+def _is_current(snapshot, version):
+    if version is not None and snapshot.version != version:
+        return False
+    return time.time() - snapshot.built_at < CATALOG_MAX_AGE
+
+
+def _map_file():
+    """Snapshot from the shared file (reusing this worker's mapping if unchanged), or None"""
+    path = _paths()[0]
+    try:
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            current = _state['snapshot']
+            if current is not None and current.file_id == file_id:
+                return current
+            return CatalogSnapshot(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), file_id)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+@contextmanager
+def _file_lock(blocking):
+    """Cross-process build lock; yields False if another process holds it"""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(CATALOG_SNAPSHOT_DIR, exist_ok=True)
+    with open(_paths()[1], 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _build(base, version):
+    """Write a snapshot for version, reusing unchanged rows of base, and map it"""
+    if version is None:
+        version = base.version if base is not None else 0
+
+    changed = None
+    if base is not None and version >= base.version and time.time() - base.built_at < CATALOG_MAX_AGE:
+        changed = _changed_ids(base.version, version)
+    if changed is None:
+        rows = _load_rows()
+    else:
+        rows = [row for row in base.rows() if row.id not in changed] + _load_rows(changed)
+
+    data = serialize_catalog(rows, version,
+                             changed_since=(base.version, sorted(changed)) if changed is not None else None)
+    path = _paths()[0]
+    try:
+        os.makedirs(CATALOG_SNAPSHOT_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        current_app.logger.warning(f"Catalog snapshot not shared, keeping it in this worker: {str(e)}")
+        return CatalogSnapshot(data)
+    return _map_file() or CatalogSnapshot(data)
+
+
+def get_catalog():
+    """The current catalog snapshot, refreshed if products changed"""
+    snapshot = _state['snapshot']
+    if snapshot is not None and time.monotonic() - _state['checked_at'] < CATALOG_CHECK_SECONDS:
+        return snapshot
+
+    # One thread per worker checks; the others keep serving the current snapshot
+    if not _lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        _state['checked_at'] = time.monotonic()
+        version = _current_version()
+        if snapshot is not None and _is_current(snapshot, version):
+            return snapshot
+
+        # Another worker may already have written it
+        mapped = _map_file()
+        if mapped is not None and _is_current(mapped, version):
+            _state['snapshot'] = mapped
+            return mapped
+
+        with _file_lock(blocking=snapshot is None) as locked:
+            if not locked:
+                # Another worker is building it; pick it up on the next check
+                return snapshot
+            mapped = _map_file()
+            if mapped is None or not _is_current(mapped, version):
+                mapped = _build(mapped or snapshot, version)
+            _state['snapshot'] = mapped
+            return mapped
+    finally:
+        _lock.release()
+
+
+def publish_changes(shoe_ids):
+    """Tell every worker that these shoes changed"""
+    try:
+        if cache_is_shared():
+            cache.add(CATALOG_VERSION_KEY, 0, timeout=0)
+            version = cache.cache.inc(CATALOG_VERSION_KEY)
+            cache.set(f"catalog:changes:{version}", sorted(shoe_ids), timeout=int(CATALOG_MAX_AGE) * 2)
+        else:
+            os.makedirs(CATALOG_SNAPSHOT_DIR, exist_ok=True)
+            line = (','.join(str(shoe_id) for shoe_id in sorted(shoe_ids)) + '\n').encode()
+            fd = os.open(_paths()[2], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)  # One O_APPEND write, so concurrent workers don't interleave
+            finally:
+                os.close(fd)
+    except Exception as e:
+        current_app.logger.warning(f"Catalog change not published, workers rebuild within "
+                                   f"{CATALOG_MAX_AGE:.0f}s: {str(e)}")
+    # This worker picks the change up on its next request
+    _state['checked_at'] = float('-inf')
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_catalog_changes(session, flush_context):
+    changed = session.info.setdefault('catalog_changed', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Shoe):
+            changed.add(obj.id)
+        elif isinstance(obj, ShoeSize):
+            changed.add(obj.shoe_id)
+    changed.discard(None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_catalog_changes(session):
+    changed = session.info.pop('catalog_changed', None)
+    if changed:
+        publish_changes(changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_catalog_changes(session):
+    session.info.pop('catalog_changed', None)
@@ -0,0 +1,315 @@
+"""
+SQLAlchemy engine tuning per database backend.
+
+PostgreSQL (production): each gunicorn worker gets its share of the
+connection budget, connections are pinged before use and recycled before
+the server or a proxy drops them, and every statement runs under a
+timeout so one runaway query can't hold a connection forever.
+
+SQLite (development, single-box deployments): WAL journaling lets readers
+run alongside a writer, synchronous=NORMAL is safe under WAL and much
+cheaper than FULL, memory-mapped I/O speeds up reads, and busy_timeout makes
+a writer wait for the lock instead of failing with "database is locked".
+
+Read replica: with DATABASE_REPLICA_URL set, db.session sends the SELECTs of
+views decorated with @replica_reads to the replica. Writes, locking reads
+(with_for_update), reads after a write in the same transaction and every
+request within READ_YOUR_WRITES_SECONDS of the visitor's last commit stay on
+the primary. Lag is measured with a heartbeat row each worker stamps on the
+primary every REPLICA_HEARTBEAT_SECONDS and the replica receives through
+replication: the lag is how long ago the beat the replica has was written.
+Past REPLICA_MAX_LAG_SECONDS (or when the replica is unreachable) reads fall
+back to the primary.
+
+To try it locally, point DATABASE_REPLICA_URL at a copy of the SQLite file
+(sqlite3 site.db ".backup replica.db", which includes the WAL): reads are
+served from the copy until its heartbeat is REPLICA_MAX_LAG_SECONDS old.
+"""
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app, g, has_app_context, has_request_context, request, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+# Engine Configuration
+DB_MAX_CONNECTIONS = int(os.getenv('DB_MAX_CONNECTIONS', 20))  # Budget shared by all web workers
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))  # Seconds
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))  # Seconds to wait for a free connection
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 15000))
+DB_QUERY_CACHE_SIZE = int(os.getenv('DB_QUERY_CACHE_SIZE', 1200))  # Compiled statements kept per engine
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_BYTES = int(os.getenv('SQLITE_MMAP_BYTES', 256 * 1024 * 1024))
+
+# Read Replica Configuration
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 5))  # 0 = don't measure lag
+REPLICA_LAG_CHECK_SECONDS = float(os.getenv('REPLICA_LAG_CHECK_SECONDS', 2))  # Capped below the max lag
+REPLICA_HEARTBEAT_SECONDS = float(os.getenv('REPLICA_HEARTBEAT_SECONDS', 1))  # Capped below the max lag
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 15))  # Primary-only window after a commit
+
+
+def _backend(database_url):
+    return (database_url or 'sqlite://').split(':', 1)[0].split('+', 1)[0]
+
+
+def web_workers():
+    """Gunicorn worker processes and threads per worker"""
+    workers = int(os.getenv('WEB_CONCURRENCY', 2))
+    threads = int(os.getenv('GUNICORN_THREADS', os.getenv('PYTHON_MAX_THREADS', 1)))
+    return max(workers, 1), max(threads, 1)
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given database URL"""
+    backend = _backend(database_url)
+    options = {'query_cache_size': DB_QUERY_CACHE_SIZE}
+
+    if backend == 'postgresql':
+        workers, threads = web_workers()
+        # Every thread can hold a connection; overflow uses what's left of the budget
+        pool_size = max(threads, 1)
+        max_overflow = max(DB_MAX_CONNECTIONS // workers - pool_size, 0)
+        options.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_pre_ping=True,
+            pool_use_lifo=True,  # Lets surplus connections idle out and get recycled
+            connect_args={
+                'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}',
+                'keepalives': 1,
+                'keepalives_idle': 30,
+                'application_name': os.getenv('RENDER_SERVICE_NAME', 'legit-collections')
+            }
+        )
+    elif backend == 'sqlite':
+        options.update(connect_args={'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000.0})
+
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine):
+    """Per-connection setup that can't be expressed as engine options"""
+    if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+
+
+def pool_stats(engine):
+    """
+    Connection pool usage
+
+    Returns:
+        dict: size, checked_in, checked_out and overflow (where the pool reports them)
+    """
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    for name, attr in (('size', 'size'), ('checked_in', 'checkedin'),
+                       ('checked_out', 'checkedout'), ('overflow', 'overflow')):
+        method = getattr(pool, attr, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+def replica_database_url():
+    """DATABASE_REPLICA_URL with the postgres:// scheme fixed up, or None"""
+    url = os.getenv('DATABASE_REPLICA_URL')
+    if url and url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url or None
+
+
+_replica_state = {'checked_at': float('-inf'), 'lag': None, 'healthy': False, 'heartbeat': None}
+_replica_lock = threading.Lock()
+_heartbeat_lock = threading.Lock()
+
+
+def _lag_check_seconds():
+    # A result older than the allowed lag could keep a lagging replica in use
+    return min(REPLICA_LAG_CHECK_SECONDS, REPLICA_MAX_LAG_SECONDS / 2)
+
+
+def _heartbeat_seconds():
+    # A beat is up to this old when replicated, which counts as lag
+    return min(REPLICA_HEARTBEAT_SECONDS, REPLICA_MAX_LAG_SECONDS / 4)
+
+
+def _beat(primary):
+    """Stamp the heartbeat row on the primary"""
+    from models import ReplicaHeartbeat
+
+    heartbeat = ReplicaHeartbeat.__table__
+    with primary.begin() as conn:
+        now = datetime.utcnow()
+        if not conn.execute(heartbeat.update().where(heartbeat.c.id == 1).values(beat_at=now)).rowcount:
+            conn.execute(heartbeat.insert().values(id=1, beat_at=now))
+
+
+def _run_heartbeat(app, primary):
+    failing = False
+    while True:
+        try:
+            _beat(primary)
+            failing = False
+        except SQLAlchemyError as e:
+            # Another worker may have inserted the row first; logged once per outage
+            if not failing:
+                app.logger.warning(f"Replica heartbeat not written: {str(e)}")
+            failing = True
+        time.sleep(_heartbeat_seconds())
+
+
+def _ensure_heartbeat(primary):
+    # Started on first use so each forked gunicorn worker gets its own thread
+    beater = _replica_state['heartbeat']
+    if beater is not None and beater.is_alive():
+        return
+    with _heartbeat_lock:
+        beater = _replica_state['heartbeat']
+        if beater is None or not beater.is_alive():
+            beater = threading.Thread(target=_run_heartbeat, args=(current_app._get_current_object(), primary),
+                                      name='replica-heartbeat', daemon=True)
+            beater.start()
+            _replica_state['heartbeat'] = beater
+
+
+def _measure_lag(replica):
+    """Seconds since the heartbeat the replica has was written on the primary, or None if unknown"""
+    from models import ReplicaHeartbeat
+
+    heartbeat = ReplicaHeartbeat.__table__
+    with replica.connect() as conn:
+        replicated = conn.execute(
+            heartbeat.select().with_only_columns(heartbeat.c.beat_at).where(heartbeat.c.id == 1)
+        ).scalar()
+
+    if replicated is None:
+        return None
+    return max((datetime.utcnow() - replicated).total_seconds(), 0.0)
+
+
+def replica_healthy(engines):
+    """Whether the replica is within REPLICA_MAX_LAG_SECONDS; re-measured every REPLICA_LAG_CHECK_SECONDS"""
+    if REPLICA_MAX_LAG_SECONDS <= 0:
+        return True
+
+    _ensure_heartbeat(engines[None])
+    now = time.monotonic()
+    if now - _replica_state['checked_at'] < _lag_check_seconds():
+        return _replica_state['healthy']
+    # One thread measures; the others keep using the last result
+    if not _replica_lock.acquire(blocking=False):
+        return _replica_state['healthy']
+    try:
+        _replica_state['checked_at'] = now
+        try:
+            lag = _measure_lag(engines['replica'])
+        except SQLAlchemyError as e:
+            current_app.logger.warning(f"Replica lag check failed: {str(e)}")
+            lag = None
+
+        healthy = lag is not None and lag <= REPLICA_MAX_LAG_SECONDS
+        if healthy != _replica_state['healthy']:
+            if healthy:
+                current_app.logger.info(f"Read replica back in use (lag {lag:.1f}s)")
+            else:
+                current_app.logger.warning(f"Read replica lag {lag if lag is not None else 'unknown'}s, "
+                                           f"reading from the primary")
+        _replica_state.update(lag=lag, healthy=healthy)
+        return healthy
+    finally:
+        _replica_lock.release()
+
+
+def replica_status():
+    """Last measured replica lag in seconds (None if unknown) and health"""
+    return {'lag': _replica_state['lag'], 'healthy': _replica_state['healthy']}
+
+
+def _replica_requested():
+    if not has_request_context() or not g.get('use_replica'):
+        return False
+    written_at = flask_session.get('db_written_at')
+    return not written_at or time.time() - written_at > READ_YOUR_WRITES_SECONDS
+
+
+class RoutingSession(Session):
+    """db.session that can send the reads of @replica_reads views to the replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._read_from_replica(clause):
+            return self._db.engines['replica']
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _read_from_replica(self, clause):
+        if self._flushing or self.info.get('wrote'):
+            return False
+        # Only plain SELECTs; text(), DML and SELECT ... FOR UPDATE stay on the primary
+        if not getattr(clause, 'is_select', False) or getattr(clause, '_for_update_arg', None) is not None:
+            return False
+        if not _replica_requested() or 'replica' not in self._db.engines:
+            return False
+        return replica_healthy(self._db.engines)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_flush(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_write(session):
+    # Keep this visitor on the primary until the replica has caught up with their write
+    if session.info.pop('wrote', False) and has_request_context() and 'replica' in session._db.engines:
+        flask_session['db_written_at'] = time.time()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
+
+
+def replica_reads(view):
+    """Serve the reads of GET requests to this view from the replica when it's safe"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = request.method in ('GET', 'HEAD')
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside this block (e.g. before filling a shared cache)"""
+    if not has_app_context():
+        yield
+        return
+    previous = g.get('use_replica')
+    g.use_replica = False
+    try:
+        yield
+    finally:
+        g.use_replica = previous
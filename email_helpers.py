@@ -1,9 +1,19 @@
 from flask_mail import Mail, Message
-from flask import current_app, render_template_string
+from flask import current_app
+from datetime import datetime, timedelta
+from extensions import db
+import json
 import os
+import re
 
 mail = Mail()
 
+# Outbox Configuration
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))  # Messages sent per SMTP connection
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', 5))
+EMAIL_RETRY_BASE_SECONDS = int(os.getenv('EMAIL_RETRY_BASE_SECONDS', 60))  # Doubles after each failure
+EMAIL_RETRY_MAX_SECONDS = int(os.getenv('EMAIL_RETRY_MAX_SECONDS', 3600))
+
 def init_mail(app):
     """Initialize Flask-Mail with app"""
     app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
@@ -12,193 +22,321 @@ def init_mail(app):
     app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
     app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
     app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', 'Country Hub Collections <noreply@countryhubcollections.com>')
-    
+
     mail.init_app(app)
     return mail
 
-def send_order_confirmation(order):
-    """Send order confirmation email to customer"""
-    try:
-        if not current_app.config.get('MAIL_USERNAME'):
-            current_app.logger.warning("Email not configured, skipping order confirmation email")
-            return False
-        
-        subject = f"Order Confirmation #{order.id} - Country Hub Collections"
-        
-        # Email body (HTML)
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f8f9fa; padding: 30px; }}
-                .order-details {{ background: white; padding: 20px; border-radius: 10px; margin: 20px 0; }}
-                .footer {{ text-align: center; padding: 20px; color: #666; font-size: 12px; }}
-                .btn {{ display: inline-block; padding: 12px 30px; background: #667eea; color: white; text-decoration: none; border-radius: 5px; margin: 10px 0; }}
-                .status-badge {{ display: inline-block; padding: 5px 15px; background: #28a745; color: white; border-radius: 20px; font-size: 14px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🎉 Order Confirmed!</h1>
-                    <p>Thank you for your purchase</p>
-                </div>
-                
-                <div class="content">
-                    <h2>Hi {order.user.name},</h2>
-                    <p>We've received your order and it's being processed. Here are your order details:</p>
-                    
-                    <div class="order-details">
-                        <h3>Order #{order.id}</h3>
-                        <hr>
-                        <p><strong>Product:</strong> {order.shoe.name if order.shoe else 'N/A'}</p>
-                        <p><strong>Size:</strong> {order.size}</p>
-                        <p><strong>Amount:</strong> Ksh{order.amount or (order.shoe.price if order.shoe else 0):.2f}</p>
-                        <p><strong>Payment Method:</strong> {order.payment_method or 'Cash'}</p>
-                        <p><strong>Payment Status:</strong> <span class="status-badge">{order.payment_status}</span></p>
-                        {f'<p><strong>Transaction Reference:</strong> {order.payment_reference or order.payment_code}</p>' if order.payment_reference or order.payment_code else ''}
-                        <p><strong>Order Date:</strong> {order.created_at.strftime('%B %d, %Y at %I:%M %p')}</p>
-                    </div>
-                    
-                    <p><strong>What's Next?</strong></p>
-                    <ul>
-                        <li>We'll verify your payment</li>
-                        <li>Your order will be prepared</li>
-                        <li>You'll receive tracking information</li>
-                        <li>Delivery within 3-5 business days</li>
-                    </ul>
-                    
-                    <div style="text-align: center; margin: 30px 0;">
-                        <a href="https://yoursite.com/orders" class="btn">Track Your Order</a>
-                    </div>
-                    
-                    <p>If you have any questions, feel free to reach out via WhatsApp: <strong>+254 113 690 898</strong></p>
-                </div>
-                
-                <div class="footer">
-                    <p>© 2025 Country Hub Collections. All rights reserved.</p>
-                    <p>
-                        <a href="#">Instagram</a> |
-                        <a href="#">Privacy Policy</a> |
-                        <a href="#">Terms of Service</a>
-                    </p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        msg = Message(
-            subject=subject,
-            recipients=[order.user.email],
-            html=html_body
-        )
-        
-        mail.send(msg)
-        current_app.logger.info(f"Order confirmation email sent to {order.user.email}")
-        return True
-        
-    except Exception as e:
-        current_app.logger.error(f"Error sending order confirmation email: {str(e)}")
+STATUS_MESSAGES = {
+    'Processing': 'Your order is being prepared',
+    'Shipped': 'Your order has been shipped',
+    'Delivered': 'Your order has been delivered',
+    'Cancelled': 'Your order has been cancelled'
+}
+
+# Email kinds handled by the outbox: template name and subject builder
+EMAIL_TEMPLATES = {
+    'order_confirmation': lambda order, ctx: f"Order Confirmation #{order.id} - Country Hub Collections",
+    'payment_confirmation': lambda order, ctx: f"Payment Confirmed - Order #{order.id}",
+    'order_status': lambda order, ctx: f"Order #{order.id} - {STATUS_MESSAGES.get(ctx.get('new_status'), 'Status Update')}",
+    'back_in_stock': lambda order, ctx: f"{ctx.get('shoe_name')} is back in stock - Country Hub Collections",
+    'price_drop': lambda order, ctx: f"Price drop: {ctx.get('shoe_name')} is now Ksh{ctx.get('new_price', 0):.2f}"
+}
+
+_STYLE_BLOCK = re.compile(r'<style[^>]*>(.*?)</style>\s*', re.S | re.I)
+_CSS_RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_HTML_TAG = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>')
+
+# Compiled email templates, built once per process
+_compiled_templates = {}
+
+def inline_css(source):
+    """
+    Move <style> rules onto the matching elements' style attributes
+
+    Email clients drop <style> blocks, so the CSS has to be inline. Only
+    the simple selectors our email templates use (tag names and single
+    classes) are supported. Existing inline styles take precedence.
+    """
+    rules = []
+
+    def collect(match):
+        for selectors, declarations in _CSS_RULE.findall(match.group(1)):
+            declarations = declarations.strip().rstrip(';').strip()
+            for selector in selectors.split(','):
+                rules.append((selector.strip(), declarations))
+        return ''
+
+    source = _STYLE_BLOCK.sub(collect, source)
+
+    def apply(match):
+        tag, attrs, closing = match.group(1), match.group(2) or '', match.group(3)
+        class_attr = re.search(r'class="([^"]*)"', attrs)
+        classes = class_attr.group(1).split() if class_attr else []
+        declarations = [
+            declarations for selector, declarations in rules
+            if selector == tag.lower() or (selector.startswith('.') and selector[1:] in classes)
+        ]
+        if not declarations:
+            return match.group(0)
+
+        style = '; '.join(declarations)
+        style_attr = re.search(r'style="([^"]*)"', attrs)
+        if style_attr:
+            attrs = attrs.replace(style_attr.group(0), f'style="{style}; {style_attr.group(1)}"')
+        else:
+            attrs = f'{attrs} style="{style}"'
+        return f'<{tag}{attrs}{closing}>'
+
+    return _HTML_TAG.sub(apply, source)
+
+def get_email_template(kind):
+    """Return the compiled Jinja template for an email kind, inlining its CSS on first use"""
+    template = _compiled_templates.get(kind)
+    if template is None:
+        env = current_app.jinja_env
+        source, _, _ = env.loader.get_source(env, f'emails/{kind}.html')
+        # from_string() templates have no .html name, so turn autoescaping on explicitly
+        source = '{% autoescape true %}' + inline_css(source) + '{% endautoescape %}'
+        template = env.from_string(source)
+        _compiled_templates[kind] = template
+    return template
+
+def load_orders_for_email(order_ids):
+    """Load orders with the customer and product the email templates use"""
+    from models import Order
+
+    if not order_ids:
+        return []
+    return Order.query.options(db.joinedload(Order.user), db.joinedload(Order.shoe))\
+                      .filter(Order.id.in_(order_ids))\
+                      .all()
+
+def render_email(kind, order, context=None):
+    """
+    Render one email
+
+    Returns:
+        tuple: (subject, html_body)
+    """
+    context = dict(context or {})
+    if kind == 'order_status':
+        context.setdefault('new_status', order.status)
+        context['status_message'] = STATUS_MESSAGES.get(context['new_status'], '')
+    return EMAIL_TEMPLATES[kind](order, context), get_email_template(kind).render(order=order, **context)
+
+def render_emails(kind, orders, context=None):
+    """
+    Render the same email for many orders, e.g. a bulk "order shipped" notice
+
+    Orders should come from load_orders_for_email() so rendering doesn't
+    lazy-load each customer and product.
+
+    Returns:
+        list: (order, subject, html_body) tuples
+    """
+    get_email_template(kind)  # Compile once up front
+    return [(order, *render_email(kind, order, context)) for order in orders]
+
+def queue_email(kind, recipient, order_id=None, payload=None, coalesce_key=None):
+    """
+    Add an email to the outbox; it is sent later by send_queued_emails()
+
+    The row joins the caller's database transaction, so the email only goes
+    out if the caller's changes are committed. An unsent email is only
+    replaced if it can be locked: one that send_queued_emails() is sending
+    right now may still commit as Sent, so a new row is queued instead.
+
+    Args:
+        kind: One of EMAIL_TEMPLATES
+        recipient: Email address
+        order_id: Order the email is about
+        payload: Extra template data (JSON serializable)
+        coalesce_key: Emails with the same key replace an unsent earlier one
+
+    Returns:
+        EmailOutbox: The queued (or updated) outbox row
+    """
+    from models import EmailOutbox
+
+    entry = None
+    if coalesce_key:
+        entry = EmailOutbox.query.filter_by(coalesce_key=coalesce_key, status='Pending')\
+                                 .order_by(EmailOutbox.id.desc())\
+                                 .populate_existing()\
+                                 .with_for_update(skip_locked=True)\
+                                 .first()
+
+    if entry is None:
+        entry = EmailOutbox(kind=kind, coalesce_key=coalesce_key)
+        db.session.add(entry)
+
+    entry.recipient = recipient
+    entry.order_id = order_id
+    entry.payload = json.dumps(payload or {})
+    entry.next_attempt_at = datetime.utcnow()
+    return entry
+
+def _queue_order_email(kind, order, payload=None, coalesce_key=None):
+    """Queue an email about an order to its customer"""
+    if not current_app.config.get('MAIL_USERNAME'):
+        current_app.logger.warning(f"Email not configured, skipping {kind} email")
         return False
 
-def send_payment_confirmation(order):
-    """Send payment confirmation email"""
-    try:
-        if not current_app.config.get('MAIL_USERNAME'):
-            return False
-        
-        subject = f"Payment Confirmed - Order #{order.id}"
-        
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #28a745 0%, #20c997 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f8f9fa; padding: 30px; }}
-                .success-box {{ background: #d4edda; border: 2px solid #28a745; padding: 20px; border-radius: 10px; text-align: center; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>✅ Payment Confirmed!</h1>
-                </div>
-                
-                <div class="content">
-                    <div class="success-box">
-                        <h2 style="color: #28a745;">Payment Received</h2>
-                        <p><strong>Ksh{order.amount or 0:.2f}</strong></p>
-                        <p>Receipt: <code>{order.payment_reference or 'Pending'}</code></p>
-                    </div>
-                    
-                    <p>Hi {order.user.name},</p>
-                    <p>Great news! Your payment has been confirmed and your order is now being prepared for shipment.</p>
-                    
-                    <p><strong>Order Details:</strong></p>
-                    <ul>
-                        <li>Order ID: #{order.id}</li>
-                        <li>Product: {order.shoe.name if order.shoe else 'N/A'}</li>
-                        <li>Size: {order.size}</li>
-                    </ul>
-                    
-                    <p>We'll notify you once your order has been shipped!</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        msg = Message(subject=subject, recipients=[order.user.email], html=html_body)
-        mail.send(msg)
-        return True
-        
-    except Exception as e:
-        current_app.logger.error(f"Error sending payment confirmation: {str(e)}")
+    recipient = order.customer_email
+    if not recipient:
         return False
 
+    queue_email(kind, recipient, order_id=order.id, payload=payload, coalesce_key=coalesce_key)
+    return True
+
+def send_order_confirmation(order):
+    """Queue order confirmation email to customer"""
+    return _queue_order_email('order_confirmation', order)
+
+def send_payment_confirmation(order):
+    """Queue payment confirmation email"""
+    return _queue_order_email('payment_confirmation', order)
+
 def send_order_status_update(order, new_status):
-    """Send order status update email"""
-    try:
-        if not current_app.config.get('MAIL_USERNAME'):
-            return False
-        
-        status_messages = {
-            'Processing': 'Your order is being prepared',
-            'Shipped': 'Your order has been shipped',
-            'Delivered': 'Your order has been delivered',
-            'Cancelled': 'Your order has been cancelled'
+    """Queue order status update email; later updates replace unsent ones"""
+    return _queue_order_email('order_status', order, payload={'new_status': new_status},
+                              coalesce_key=f"order_status:{order.id}")
+
+def queue_order_status_updates(order_ids, new_status):
+    """
+    Queue status update emails for many orders with set-based statements
+
+    Unsent status emails for the same orders are updated in place (one
+    UPDATE); the rest are inserted in one batch. As in queue_email(), rows
+    being sent right now are skipped and get a new email instead.
+
+    Returns:
+        int: Number of emails queued or updated
+    """
+    from models import EmailOutbox, Order, User
+
+    if not order_ids or not current_app.config.get('MAIL_USERNAME'):
+        return 0
+
+    recipients = db.session.execute(
+        db.select(Order.id, db.func.coalesce(User.email, Order.guest_email))
+          .outerjoin(User, Order.user_id == User.id)
+          .where(Order.id.in_(order_ids))
+    ).all()
+    recipients = {order_id: email for order_id, email in recipients if email}
+    if not recipients:
+        return 0
+
+    now = datetime.utcnow()
+    payload = json.dumps({'new_status': new_status})
+    keys = {f"order_status:{order_id}": order_id for order_id in recipients}
+
+    # Only rows locked here are certain to still be Pending when the UPDATE runs
+    locked = db.session.execute(
+        db.select(EmailOutbox.id, EmailOutbox.coalesce_key)
+          .where(EmailOutbox.coalesce_key.in_(keys), EmailOutbox.status == 'Pending')
+          .with_for_update(skip_locked=True)
+    ).all()
+    pending_keys = {key for _, key in locked}
+    if locked:
+        db.session.execute(
+            db.update(EmailOutbox)
+              .where(EmailOutbox.id.in_([entry_id for entry_id, _ in locked]))
+              .values(payload=payload, next_attempt_at=now)
+              .execution_options(synchronize_session=False)
+        )
+
+    new_rows = [
+        {
+            'kind': 'order_status',
+            'recipient': recipients[order_id],
+            'order_id': order_id,
+            'payload': payload,
+            'coalesce_key': key,
+            'status': 'Pending',
+            'attempts': 0,
+            'next_attempt_at': now,
+            'created_at': now
         }
-        
-        subject = f"Order #{order.id} - {status_messages.get(new_status, 'Status Update')}"
-        
-        html_body = f"""
-        <!DOCTYPE html>
-        <html>
-        <body style="font-family: Arial, sans-serif; padding: 20px; background: #f8f9fa;">
-            <div style="max-width: 600px; margin: 0 auto; background: white; padding: 30px; border-radius: 10px;">
-                <h2>Order Status Update</h2>
-                <p>Hi {order.user.name},</p>
-                <p>Your order #{order.id} status has been updated to: <strong>{new_status}</strong></p>
-                <p>{status_messages.get(new_status, '')}</p>
-                <p>Best regards,<br>Country Hub Collections Team</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        msg = Message(subject=subject, recipients=[order.user.email], html=html_body)
-        mail.send(msg)
-        return True
-        
+        for key, order_id in keys.items() if key not in pending_keys
+    ]
+    if new_rows:
+        db.session.execute(db.insert(EmailOutbox), new_rows)
+
+    return len(recipients)
+
+def _retry_later(entry, error):
+    """Record a failed attempt and schedule the next one with exponential backoff"""
+    entry.attempts = (entry.attempts or 0) + 1
+    entry.last_error = str(error)[:500]
+    if entry.attempts >= EMAIL_MAX_ATTEMPTS:
+        entry.status = 'Failed'
+    else:
+        delay = min(EMAIL_RETRY_BASE_SECONDS * 2 ** (entry.attempts - 1), EMAIL_RETRY_MAX_SECONDS)
+        entry.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+def send_queued_emails(batch_size=None):
+    """
+    Send due outbox emails over a single SMTP connection
+
+    Returns:
+        dict: Counts of sent, retried and failed messages
+    """
+    from models import EmailOutbox
+
+    batch_size = batch_size or EMAIL_BATCH_SIZE
+    summary = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    entries = EmailOutbox.query.filter(
+        EmailOutbox.status == 'Pending',
+        EmailOutbox.next_attempt_at <= datetime.utcnow()
+    ).order_by(EmailOutbox.id)\
+     .limit(batch_size)\
+     .with_for_update(skip_locked=True)\
+     .all()
+
+    if not entries:
+        return summary
+
+    orders = {order.id: order for order in load_orders_for_email({entry.order_id for entry in entries if entry.order_id})}
+
+    messages = []
+    for entry in entries:
+        try:
+            # Wishlist alerts aren't about an order
+            order = orders[entry.order_id] if entry.order_id else None
+            subject, html_body = render_email(entry.kind, order, json.loads(entry.payload or '{}'))
+            messages.append((entry, Message(subject=subject, recipients=[entry.recipient], html=html_body)))
+        except Exception as e:
+            current_app.logger.error(f"Error building {entry.kind} email #{entry.id}: {str(e)}")
+            _retry_later(entry, e)
+
+    attempted = set()
+    try:
+        with mail.connect() as connection:
+            for entry, msg in messages:
+                attempted.add(entry.id)
+                try:
+                    connection.send(msg)
+                    entry.status = 'Sent'
+                    entry.sent_at = datetime.utcnow()
+                    summary['sent'] += 1
+                except Exception as e:
+                    current_app.logger.error(f"Error sending {entry.kind} email #{entry.id}: {str(e)}")
+                    _retry_later(entry, e)
     except Exception as e:
-        current_app.logger.error(f"Error sending status update: {str(e)}")
-        return False
+        # The SMTP connection failed; retry everything that wasn't attempted
+        current_app.logger.error(f"SMTP connection error: {str(e)}")
+        for entry, msg in messages:
+            if entry.id not in attempted:
+                _retry_later(entry, e)
+
+    for entry in entries:
+        if entry.status == 'Failed':
+            summary['failed'] += 1
+        elif entry.status == 'Pending':
+            summary['retried'] += 1
 
+    db.session.commit()
+    current_app.logger.info(f"Email outbox: {summary['sent']} sent, {summary['retried']} retrying, {summary['failed']} failed")
+    return summary
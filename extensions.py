@@ -1,3 +1,12 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_caching import Cache
+from database_helpers import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})  # Reads may go to DATABASE_REPLICA_URL
+cache = Cache()
+
+
+def cache_is_shared():
+    """Whether every worker sees the same cache (Redis) rather than its own process's"""
+    return current_app.config.get('CACHE_TYPE') not in ('SimpleCache', 'NullCache')
@@ -6,18 +6,26 @@ This script ensures the database is properly set up with all required fields.
 
 import os
 import sys
-from app import create_app, db
+from flask_migrate import Migrate, upgrade, stamp
+from app import app, db
 from models import User
 
 def init_database():
     """Initialize the database with proper schema and default admin."""
-    app = create_app()
+    Migrate(app, db)
     
     with app.app_context():
         try:
-            # Create all tables
-            db.create_all()
-            print("✅ Database tables created successfully")
+            if not db.inspect(db.engine).get_table_names():
+                # Empty database: build it from the models and mark it as current,
+                # rather than replaying every migration from the first one
+                db.create_all()
+                stamp()
+                print("✅ Database tables created successfully")
+            else:
+                # Bring the schema up to date (same as `flask db upgrade`)
+                upgrade()
+                print("✅ Database migrations applied successfully")
             
             # Check if admin exists
             admin = User.query.filter_by(is_admin=True).first()
@@ -0,0 +1,394 @@
+"""
+Prometheus-style metrics.
+
+A dependency-free subset of the Prometheus client: counters and histograms
+with labels, rendered in the text exposition format by /metrics.
+
+Gunicorn runs several worker processes and a scrape only reaches one of
+them. Each process therefore writes a snapshot of its metrics to
+METRICS_DIR/metrics-<pid>-<start time>.json every few seconds, and /metrics
+adds up the snapshots of all processes. The start time keeps a new worker
+that reuses a PID from overwriting an exited one's file. At each scrape the
+snapshots of exited workers are added into METRICS_DIR/metrics-retired.json
+and deleted, so totals never go backwards and the directory doesn't grow
+with every worker restart.
+"""
+import atexit
+import fcntl
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/legit_metrics')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+_process = {'pid': None, 'id': None}
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        _registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+
+class Histogram:
+    """Cumulative histogram with optional labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        _registry[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labelnames)
+        with _lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        """Context manager that observes the duration of its block"""
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        return [[list(key), list(series)] for key, series in self.values.items()]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+# Metrics
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                            ['endpoint', 'method', 'status'])
+CACHE_REQUESTS = Counter('cache_requests_total', 'Flask-Caching lookups by result', ['result'])
+DB_POOL_WAIT = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled DB connection',
+                         buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+DB_POOL_TIMEOUTS = Counter('db_pool_checkout_timeouts_total', 'DB connection checkouts that timed out')
+GATEWAY_LATENCY = Histogram('gateway_request_duration_seconds', 'Payment gateway and storage call latency',
+                            ['gateway', 'operation'])
+GATEWAY_ERRORS = Counter('gateway_errors_total', 'Failed payment gateway and storage calls',
+                         ['gateway', 'operation'])
+STOCK_CONFLICTS = Counter('stock_conflicts_total', 'Cart or checkout requests that hit insufficient stock',
+                          ['stage'])
+PRODUCT_EVENTS = Counter('product_events_total', 'Product view, cart and wishlist events by outcome',
+                         ['kind', 'result'])
+SEARCH_CACHE_REQUESTS = Counter('search_cache_requests_total', 'Search result cache lookups by result', ['result'])
+SHOE_CACHE_REQUESTS = Counter('shoe_cache_requests_total', 'Shoe entity cache lookups by result', ['result'])
+
+
+def track_gateway(gateway, operation):
+    """
+    Decorator recording latency and errors of an external call
+
+    A call counts as failed if it raises, returns None or returns a dict
+    with success=False (the convention of the gateway helpers).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = result is None or (isinstance(result, dict) and result.get('success') is False)
+                return result
+            finally:
+                GATEWAY_LATENCY.observe(time.perf_counter() - start, gateway=gateway, operation=operation)
+                if failed:
+                    GATEWAY_ERRORS.inc(gateway=gateway, operation=operation)
+        return wrapper
+    return decorator
+
+
+def _process_start(pid):
+    """Start time of a running process in clock ticks since boot, or None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The command name may contain spaces; the fields after it don't
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _process_id():
+    """PID plus start time, unique among the processes writing METRICS_DIR"""
+    pid = os.getpid()
+    if _process['pid'] != pid:  # Forked workers inherit the parent's module state
+        _process.update(pid=pid, id=f"{pid}-{_process_start(pid) or time.time_ns()}")
+    return _process['id']
+
+
+def _is_running(process_id):
+    pid, _, start = process_id.partition('-')
+    current = _process_start(pid)
+    if current is not None and start:
+        return current == start
+    try:
+        os.kill(int(pid), 0)  # No /proc: the PID exists, which may be a new process
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def _snapshot_path(process_id=None):
+    return os.path.join(METRICS_DIR, f"metrics-{process_id or _process_id()}.json")
+
+
+def _retired_path():
+    return os.path.join(METRICS_DIR, 'metrics-retired.json')
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def flush(force=False):
+    """Write this process's metrics to its snapshot file (at most every METRICS_FLUSH_SECONDS)"""
+    global _last_flush
+
+    now = time.monotonic()
+    if not force and now - _last_flush < METRICS_FLUSH_SECONDS:
+        return
+    _last_flush = now
+
+    with _lock:
+        data = {name: metric.snapshot() for name, metric in _registry.items()}
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_json(_snapshot_path(), data)
+    except OSError:
+        pass
+
+
+atexit.register(flush, force=True)
+
+
+def _add(totals, data):
+    """Add a snapshot ({name: [[labels, value], ...]}) into totals ({name: {labels: value}})"""
+    for name, series_list in data.items():
+        series_totals = totals.setdefault(name, {})
+        for labels, value in series_list:
+            key = tuple(labels)
+            current = series_totals.get(key)
+            if current is None:
+                series_totals[key] = value
+            elif isinstance(value, list):  # Histogram buckets, count and sum
+                series_totals[key] = [a + b for a, b in zip(current, value)]
+            else:
+                series_totals[key] = current + value
+
+
+def _retire(snapshots):
+    """
+    Fold the snapshots of exited workers into the retired totals
+
+    Args:
+        snapshots: {process_id: snapshot} of every worker file
+    """
+    retired = _read_json(_retired_path()) or {'processes': [], 'metrics': {}}
+    # A file already folded in but not yet deleted (a crash in between) is only deleted
+    folded = set(retired['processes'])
+    exited = [process_id for process_id in snapshots if process_id != _process_id() and not _is_running(process_id)]
+    if not exited:
+        return
+
+    totals = {}
+    _add(totals, retired['metrics'])
+    for process_id in exited:
+        if process_id not in folded:
+            _add(totals, snapshots[process_id])
+    _write_json(_retired_path(), {
+        'processes': sorted(exited),
+        'metrics': {name: [[list(key), value] for key, value in series.items()] for name, series in totals.items()},
+    })
+    for process_id in exited:
+        snapshots.pop(process_id)
+        try:
+            os.remove(_snapshot_path(process_id))
+        except FileNotFoundError:
+            pass
+
+
+def _aggregate():
+    """Sum the retired totals and the snapshots of every running worker"""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    # One scrape at a time folds exited workers, so none is counted twice or missed
+    with open(os.path.join(METRICS_DIR, 'metrics.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        snapshots = {}
+        for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+            if path == _retired_path():
+                continue
+            data = _read_json(path)
+            if data is not None:
+                snapshots[os.path.basename(path)[len('metrics-'):-len('.json')]] = data
+        _retire(snapshots)
+        retired = _read_json(_retired_path())
+
+    totals = {}
+    if retired:
+        _add(totals, retired['metrics'])
+    for data in snapshots.values():
+        _add(totals, data)
+    return totals
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render_metrics(gauges=None):
+    """
+    Metrics of all workers in the Prometheus text exposition format
+
+    Args:
+        gauges: Extra point-in-time values computed at scrape time, as
+            {name: (documentation, [(labels_dict, value), ...])}
+    """
+    flush(force=True)
+    totals = _aggregate()
+    lines = []
+
+    for name, metric in _registry.items():
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type}")
+        for key, value in sorted(totals.get(name, {}).items()):
+            if metric.type == 'counter':
+                lines.append(f"{name}{_format_labels(metric.labelnames, key)} {value}")
+                continue
+            for bound, count in zip(metric.buckets, value):
+                lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, [('le', '+Inf')])} {value[-2]}")
+            lines.append(f"{name}_sum{_format_labels(metric.labelnames, key)} {value[-1]}")
+            lines.append(f"{name}_count{_format_labels(metric.labelnames, key)} {value[-2]}")
+
+    for name, (documentation, samples) in (gauges or {}).items():
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {value}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def _instrument_cache(cache):
+    """Count hits and misses on the cache backend"""
+    backend = cache.cache
+    original_get = backend.get
+
+    def get(key):
+        value = original_get(key)
+        CACHE_REQUESTS.inc(result='miss' if value is None else 'hit')
+        return value
+
+    backend.get = get
+
+
+def _instrument_pool(engine):
+    """Time connection checkouts from the engine's pool"""
+    from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+    pool = engine.pool
+    # _do_get is where QueuePool blocks waiting for a free connection
+    original_do_get = pool._do_get
+
+    def _do_get():
+        start = time.perf_counter()
+        try:
+            return original_do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_WAIT.observe(time.perf_counter() - start)
+
+    pool._do_get = _do_get
+
+
+def init_metrics(app, db, cache):
+    """Install request, cache and pool instrumentation"""
+    from flask import g, request
+
+    with app.app_context():
+        _instrument_cache(cache)
+        _instrument_pool(db.engine)
+
+    if not os.getenv('METRICS_TOKEN'):
+        app.logger.warning("METRICS_TOKEN is not set, /metrics refuses every request")
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.get('metrics_start')
+        if start is not None and request.endpoint != 'metrics':
+            REQUEST_LATENCY.observe(time.perf_counter() - start,
+                                    endpoint=request.endpoint or 'unmatched',
+                                    method=request.method,
+                                    status=response.status_code)
+        flush()
+        return response
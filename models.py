@@ -1,13 +1,11 @@
 from flask_login import UserMixin
 from extensions import db
-from flask_bcrypt import Bcrypt
 from datetime import datetime
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy import select, func
+from password_helpers import hash_password, check_password
 # from flask_session import SqlAlchemySessionInterface
 
-bcrypt = Bcrypt()
-
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -28,10 +26,10 @@ class User(UserMixin, db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hash_password(password)
 
     def verify_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        return check_password(self.password_hash, password)
     
     def is_super_admin(self):
         """Check if user is a super admin"""
@@ -174,7 +172,7 @@ class Wishlist(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id'), nullable=False)
+    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id'), nullable=False, index=True)  # Watchers of a shoe
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -216,6 +214,104 @@ class Review(db.Model):
     # User can only review each product once
     __table_args__ = (db.UniqueConstraint('user_id', 'shoe_id', name='unique_user_shoe_review'),)
 
+class OrderStatusAudit(db.Model):
+    __tablename__ = 'order_status_audit'
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
+    old_status = db.Column(db.String(20))
+    new_status = db.Column(db.String(20), nullable=False)
+    changed_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Admin who made the change
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class EmailOutbox(db.Model):
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # order_confirmation, payment_confirmation, order_status
+    recipient = db.Column(db.String(120), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=True)
+    payload = db.Column(db.Text)  # JSON template data
+    coalesce_key = db.Column(db.String(100), index=True)  # Newer emails with the same key replace unsent ones
+    status = db.Column(db.String(20), default='Pending')  # Pending, Sent, Failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    # Relationships
+    order = db.relationship('Order')
+
+    __table_args__ = (db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),)
+
+class CartItem(db.Model):
+    __tablename__ = 'cart_items'
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_key = db.Column(db.String(64), nullable=False)  # 'user:<id>' or 'guest:<token>'
+    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id', ondelete='CASCADE'), nullable=False)
+    size = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+    # One line per product and size; adding again bumps the quantity
+    __table_args__ = (db.UniqueConstraint('owner_key', 'shoe_id', 'size', name='unique_cart_line'),)
+
+class StockEvent(db.Model):
+    __tablename__ = 'stock_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # back_in_stock, price_drop
+    payload = db.Column(db.Text)  # JSON template data
+    status = db.Column(db.String(20), default='Pending', index=True)  # Pending, Done
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+class WishlistAlert(db.Model):
+    __tablename__ = 'wishlist_alerts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Dedupe lookups: has this user been alerted about this shoe recently?
+    __table_args__ = (db.Index('ix_wishlist_alerts_user_shoe_kind', 'user_id', 'shoe_id', 'kind', 'created_at'),)
+
+class ShoeRecommendation(db.Model):
+    __tablename__ = 'shoe_recommendations'
+
+    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 0 = most similar
+    recommended_id = db.Column(db.Integer, db.ForeignKey('shoes.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)  # Cosine similarity of buyers and wishlisters
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ProductEvent(db.Model):
+    __tablename__ = 'product_events'
+
+    # Append-only; no foreign key so events of since-deleted shoes still insert
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    shoe_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # view, cart, wishlist
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class ShoePopularity(db.Model):
+    __tablename__ = 'shoe_popularity'
+
+    shoe_id = db.Column(db.Integer, db.ForeignKey('shoes.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)  # Time-decayed weighted event count
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)  # Single row, id 1
+    beat_at = db.Column(db.DateTime, nullable=False)  # Written on the primary, read back from the replica
+
 class Session(db.Model):
     __tablename__ = 'sessions'
     id = db.Column(db.String(255), primary_key=True)
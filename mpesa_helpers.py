@@ -3,6 +3,7 @@ import base64
 import os
 from datetime import datetime
 from flask import current_app
+from metrics_helpers import track_gateway
 
 # M-Pesa Daraja API Configuration
 MPESA_ENVIRONMENT = os.getenv('MPESA_ENVIRONMENT', 'sandbox')  # sandbox or production
@@ -17,6 +18,7 @@ if MPESA_ENVIRONMENT == 'production':
 else:
     BASE_URL = 'https://sandbox.safaricom.co.ke'
 
+@track_gateway('mpesa', 'access_token')
 def get_mpesa_access_token():
     """
     Generate OAuth access token for M-Pesa API
@@ -61,6 +63,7 @@ def generate_password():
     encoded = base64.b64encode(data_to_encode.encode()).decode()
     return encoded, timestamp
 
+@track_gateway('mpesa', 'stk_push')
 def initiate_stk_push(phone_number, amount, account_reference, transaction_desc, callback_url):
     """
     Initiate STK Push (Lipa na M-Pesa Online)
@@ -145,6 +148,7 @@ def initiate_stk_push(phone_number, amount, account_reference, transaction_desc,
         current_app.logger.error(f"Error initiating STK Push: {str(e)}")
         return {'success': False, 'error': str(e)}
 
+@track_gateway('mpesa', 'stk_query')
 def query_stk_status(checkout_request_id):
     """
     Query the status of an STK Push transaction
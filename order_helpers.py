@@ -0,0 +1,70 @@
+from flask import current_app
+from datetime import datetime
+from extensions import db
+from models import Order, Shoe, OrderStatusAudit
+import os
+
+VALID_ORDER_STATUSES = ['Pending', 'Processing', 'Shipped', 'Delivered', 'Cancelled']
+BULK_ORDER_LIMIT = int(os.getenv('BULK_ORDER_LIMIT', 1000))  # Orders per bulk action
+
+def bulk_update_order_status(order_ids, new_status, admin):
+    """
+    Move many orders to a new status in one set-based UPDATE
+
+    Orders already in the target status are left alone, and limited admins
+    can only change orders for their own products. Every change gets an
+    order_status_audit row and a queued customer email; the caller commits.
+
+    Args:
+        order_ids: Order IDs selected by the admin
+        new_status: One of VALID_ORDER_STATUSES
+        admin: User making the change
+
+    Returns:
+        list: IDs of the orders that were changed
+    """
+    if new_status not in VALID_ORDER_STATUSES:
+        raise ValueError(f"Invalid order status: {new_status}")
+    if len(order_ids) > BULK_ORDER_LIMIT:
+        raise ValueError(f"Too many orders selected (maximum {BULK_ORDER_LIMIT})")
+
+    conditions = [Order.id.in_(order_ids), Order.status != new_status]
+    if admin.is_limited_admin():
+        own_shoes = db.select(Shoe.id).where(Shoe.created_by == admin.id)
+        conditions.append(Order.shoe_id.in_(own_shoes))
+
+    # Locked until the caller commits, so the audited old status is the one being replaced
+    previous = db.session.execute(
+        db.select(Order.id, Order.status).where(*conditions).order_by(Order.id).with_for_update()
+    ).all()
+    if not previous:
+        return []
+
+    changed_ids = [order_id for order_id, _ in previous]
+    now = datetime.utcnow()
+
+    db.session.execute(
+        db.update(Order)
+          .where(Order.id.in_(changed_ids))
+          .values(status=new_status, updated_at=now)
+          .execution_options(synchronize_session=False)
+    )
+
+    db.session.execute(db.insert(OrderStatusAudit), [
+        {
+            'order_id': order_id,
+            'old_status': old_status,
+            'new_status': new_status,
+            'changed_by': admin.id,
+            'created_at': now
+        }
+        for order_id, old_status in previous
+    ])
+
+    try:
+        from email_helpers import queue_order_status_updates
+        queue_order_status_updates(changed_ids, new_status)
+    except ImportError:
+        current_app.logger.warning("Email not available, skipping status update emails")
+
+    return changed_ids
@@ -0,0 +1,127 @@
+"""
+Password hashing off the request thread.
+
+bcrypt is deliberately slow, and running it inline let login bursts pin the
+web workers' CPU and starve catalog requests. Hashes are now computed in a
+small process pool with a bounded backlog: when the pool is saturated we
+refuse new credential checks (PasswordHasherBusy) instead of queueing them
+without limit. Login attempts are also rate-limited per email.
+
+The bcrypt cost comes from BCRYPT_LOG_ROUNDS; hashes made with a different
+cost are upgraded the next time the user logs in (see needs_rehash()).
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+# Hashing Configuration
+BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))
+PASSWORD_POOL_WORKERS = int(os.getenv('PASSWORD_POOL_WORKERS', min(2, os.cpu_count() or 1)))  # 0 = hash inline
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv('PASSWORD_POOL_MAX_QUEUE', 16))  # Waiting checks before refusing
+PASSWORD_TIMEOUT_SECONDS = float(os.getenv('PASSWORD_TIMEOUT_SECONDS', 10))
+
+# Login Rate Limiting
+LOGIN_ATTEMPTS_PER_EMAIL = int(os.getenv('LOGIN_ATTEMPTS_PER_EMAIL', 5))
+LOGIN_ATTEMPT_WINDOW_SECONDS = int(os.getenv('LOGIN_ATTEMPT_WINDOW_SECONDS', 300))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password checks are already running or queued"""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password, password_hash):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # Malformed hash
+        return False
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(PASSWORD_POOL_WORKERS, 1) + PASSWORD_POOL_MAX_QUEUE)
+
+
+def _get_executor():
+    """Process pool for this worker process, created lazily so it isn't shared across a fork"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def _run(func, *args):
+    """Run a hashing function in the pool, refusing work once the backlog is full"""
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        if PASSWORD_POOL_WORKERS <= 0:
+            return func(*args)
+        try:
+            return _get_executor().submit(func, *args).result(timeout=PASSWORD_TIMEOUT_SECONDS)
+        except BrokenProcessPool:
+            # A pool worker died; start a fresh pool next time and do this one inline
+            _reset_executor()
+            return func(*args)
+    finally:
+        _slots.release()
+
+
+def hash_password(password):
+    """Hash a password with the configured bcrypt cost"""
+    return _run(_hash, password, BCRYPT_LOG_ROUNDS)
+
+
+def check_password(password_hash, password):
+    """Check a password against a stored bcrypt hash"""
+    if not password_hash:
+        return False
+    return _run(_check, password, password_hash)
+
+
+def needs_rehash(password_hash):
+    """True if the hash was made with a different cost than BCRYPT_LOG_ROUNDS"""
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_LOG_ROUNDS
+    except (AttributeError, IndexError, ValueError):
+        return True
+
+
+def _attempts_key(email):
+    return f"login_attempts:{(email or '').strip().lower()}"
+
+
+def login_rate_limited(email):
+    """
+    Count a login attempt for an email
+
+    Returns:
+        bool: True if the email has used up its attempts for the current window
+    """
+    from extensions import cache
+
+    key = _attempts_key(email)
+    cache.add(key, 0, timeout=LOGIN_ATTEMPT_WINDOW_SECONDS)
+    attempts = cache.cache.inc(key) or 0
+    return attempts > LOGIN_ATTEMPTS_PER_EMAIL
+
+
+def reset_login_attempts(email):
+    from extensions import cache
+
+    cache.delete(_attempts_key(email))
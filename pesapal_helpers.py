@@ -3,6 +3,7 @@ import json
 import os
 from datetime import datetime, timedelta
 from flask import current_app
+from metrics_helpers import track_gateway
 
 # Pesapal API Configuration
 PESAPAL_CONSUMER_KEY = os.getenv('PESAPAL_CONSUMER_KEY')
@@ -21,6 +22,7 @@ _token_cache = {
     'expires_at': None
 }
 
+@track_gateway('pesapal', 'access_token')
 def get_access_token():
     """Get OAuth access token from Pesapal"""
     global _token_cache
@@ -60,6 +62,7 @@ def get_access_token():
         current_app.logger.error(f"Error getting Pesapal access token: {str(e)}")
         return None
 
+@track_gateway('pesapal', 'register_ipn')
 def register_ipn_url(ipn_url):
     """Register IPN (Instant Payment Notification) URL with Pesapal"""
     try:
@@ -93,6 +96,7 @@ def register_ipn_url(ipn_url):
         current_app.logger.error(f"Error registering IPN URL: {str(e)}")
         return None
 
+@track_gateway('pesapal', 'submit_order')
 def initiate_payment(order_id, amount, description, callback_url, notification_id, customer_email, customer_phone):
     """
     Initiate a payment transaction with Pesapal
@@ -173,6 +177,7 @@ def initiate_payment(order_id, amount, description, callback_url, notification_i
         current_app.logger.error(f"Error initiating payment: {str(e)}")
         return {'success': False, 'error': str(e)}
 
+@track_gateway('pesapal', 'transaction_status')
 def get_transaction_status(order_tracking_id):
     """
     Check the status of a transaction
@@ -0,0 +1,162 @@
+"""
+Product events and popularity scores.
+
+Product views, add-to-carts and wishlist adds are recorded in a per-worker
+ring buffer, never written on the request path. A background thread in each
+worker writes them to product_events in batches of EVENT_FLUSH_SIZE, at
+least every EVENT_FLUSH_SECONDS and when the worker exits. If the database
+falls behind, the buffer drops its oldest events instead of growing.
+
+A periodic job (flask --app app compute-popularity, e.g. hourly from cron)
+sums the events of the last POPULARITY_WINDOW_DAYS per shoe, each weighted by
+kind and halved every POPULARITY_HALF_LIFE_HOURS, stores the scores in
+shoe_popularity and deletes older events. The catalog snapshot carries the
+scores for the "popular" sort and search ranking.
+"""
+import atexit
+import os
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import ProductEvent, Shoe, ShoePopularity
+from metrics_helpers import PRODUCT_EVENTS
+
+# Event Configuration
+EVENT_BUFFER_SIZE = int(os.getenv('EVENT_BUFFER_SIZE', 10000))  # Events held per worker; the oldest drop first
+EVENT_FLUSH_SIZE = int(os.getenv('EVENT_FLUSH_SIZE', 500))  # Rows per INSERT
+EVENT_FLUSH_SECONDS = float(os.getenv('EVENT_FLUSH_SECONDS', 10))
+POPULARITY_HALF_LIFE_HOURS = float(os.getenv('POPULARITY_HALF_LIFE_HOURS', 72))
+POPULARITY_WINDOW_DAYS = int(os.getenv('POPULARITY_WINDOW_DAYS', 30))  # Older events are deleted
+
+EVENT_WEIGHTS = {'view': 1.0, 'wishlist': 3.0, 'cart': 5.0}
+
+_buffer = deque(maxlen=EVENT_BUFFER_SIZE)
+_wake = threading.Event()
+_flush_lock = threading.Lock()
+_state = {'app': None, 'flusher': None}
+_flusher_lock = threading.Lock()
+
+
+def init_events(app):
+    """Write buffered events from this app's workers"""
+    _state['app'] = app
+    atexit.register(flush_events)
+
+
+def record_event(shoe_id, kind):
+    """Buffer a product event (view, cart or wishlist)"""
+    if len(_buffer) == _buffer.maxlen:
+        PRODUCT_EVENTS.inc(kind=_buffer[0][1], result='dropped')
+    _buffer.append((shoe_id, kind, datetime.utcnow()))
+    if len(_buffer) >= EVENT_FLUSH_SIZE:
+        _wake.set()
+    _ensure_flusher()
+
+
+def _ensure_flusher():
+    # Started on first use so each forked gunicorn worker gets its own thread
+    flusher = _state['flusher']
+    if flusher is not None and flusher.is_alive():
+        return
+    with _flusher_lock:
+        flusher = _state['flusher']
+        if flusher is None or not flusher.is_alive():
+            flusher = threading.Thread(target=_run_flusher, name='event-flusher', daemon=True)
+            flusher.start()
+            _state['flusher'] = flusher
+
+
+def _run_flusher():
+    while True:
+        _wake.wait(EVENT_FLUSH_SECONDS)
+        _wake.clear()
+        flush_events()
+
+
+def flush_events():
+    """Write the buffered events in batches; returns how many were stored"""
+    app = _state['app']
+    if app is None:
+        return 0
+
+    stored = 0
+    with _flush_lock:
+        while _buffer:
+            batch = []
+            try:
+                while len(batch) < EVENT_FLUSH_SIZE:
+                    batch.append(_buffer.popleft())
+            except IndexError:
+                pass
+            rows = [{'shoe_id': shoe_id, 'kind': kind, 'created_at': created_at}
+                    for shoe_id, kind, created_at in batch]
+            try:
+                with app.app_context():
+                    # Own connection and transaction, independent of any request's session
+                    with db.engine.begin() as conn:
+                        conn.execute(ProductEvent.__table__.insert(), rows)
+            except SQLAlchemyError as e:
+                app.logger.warning(f"Dropped {len(rows)} product events: {str(e)}")
+                for _, kind, _ in batch:
+                    PRODUCT_EVENTS.inc(kind=kind, result='dropped')
+                break
+            for _, kind, _ in batch:
+                PRODUCT_EVENTS.inc(kind=kind, result='stored')
+            stored += len(rows)
+    return stored
+
+
+def compute_popularity(now=None):
+    """
+    Recompute every shoe's decayed popularity score from the event window
+
+    Events are counted per shoe, kind and day in SQL; each day's count decays
+    from midday. Shoes whose score changed are republished to the catalog.
+
+    Returns:
+        dict: shoes (with a score), events (counted) and deleted (expired events)
+    """
+    from catalog_helpers import publish_changes
+
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=POPULARITY_WINDOW_DAYS)
+    day = db.func.date(ProductEvent.created_at)
+
+    shoe_ids = set(db.session.scalars(db.select(Shoe.id)))
+    counts = db.session.execute(
+        db.select(ProductEvent.shoe_id, ProductEvent.kind, day, db.func.count())
+          .where(ProductEvent.created_at >= since)
+          .group_by(ProductEvent.shoe_id, ProductEvent.kind, day)
+    )
+    scores = {}
+    events = 0
+    for shoe_id, kind, event_day, count in counts:
+        events += count
+        if shoe_id not in shoe_ids:
+            continue
+        if isinstance(event_day, str):
+            event_day = date.fromisoformat(event_day)  # SQLite returns text
+        midday = datetime.combine(event_day, datetime.min.time()) + timedelta(hours=12)
+        age_hours = max((now - midday).total_seconds() / 3600, 0.0)
+        decay = 0.5 ** (age_hours / POPULARITY_HALF_LIFE_HOURS)
+        scores[shoe_id] = scores.get(shoe_id, 0.0) + EVENT_WEIGHTS.get(kind, 0.0) * count * decay
+
+    previous = dict(db.session.execute(db.select(ShoePopularity.shoe_id, ShoePopularity.score)).all())
+    changed = {shoe_id for shoe_id in shoe_ids & (set(scores) | set(previous))
+               if abs(scores.get(shoe_id, 0.0) - previous.get(shoe_id, 0.0)) > 1e-9}
+
+    db.session.execute(db.delete(ShoePopularity))
+    if scores:
+        db.session.execute(db.insert(ShoePopularity),
+                           [{'shoe_id': shoe_id, 'score': score, 'computed_at': now}
+                            for shoe_id, score in scores.items()])
+    deleted = db.session.execute(db.delete(ProductEvent).where(ProductEvent.created_at < since)).rowcount
+    db.session.commit()
+
+    if changed:
+        publish_changes(changed)
+    current_app.logger.info(f"Popularity of {len(scores)} shoes from {events} events ({len(changed)} changed)")
+    return {'shoes': len(scores), 'events': events, 'deleted': deleted}
@@ -0,0 +1,232 @@
+"""
+Per-request SQL profiling.
+
+SQLAlchemy engine events count every statement a request runs and time it,
+keeping the slowest few. After the request the totals are:
+
+- sent as a Server-Timing header (visible in the browser dev tools)
+- logged as one JSON line for slow requests (or all, with PROFILE_LOG_ALL)
+- kept in a small in-process history shown on /admin/debug/profiling
+
+Requests slower than PROFILE_SAMPLE_OVER_MS can also be sampled by a
+background thread that snapshots the request thread's stack every few
+milliseconds. The samples are stored as collapsed stacks ("a;b;c 12"),
+which flamegraph.pl and speedscope read directly.
+
+History is per worker process.
+"""
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Profiling Configuration
+SQL_PROFILING = os.getenv('SQL_PROFILING', 'True') == 'True'
+PROFILE_SERVER_TIMING = os.getenv('PROFILE_SERVER_TIMING', 'admin')  # always, admin or off
+PROFILE_SLOW_QUERY_MS = float(os.getenv('PROFILE_SLOW_QUERY_MS', 100))
+PROFILE_SLOW_REQUEST_MS = float(os.getenv('PROFILE_SLOW_REQUEST_MS', 500))
+PROFILE_LOG_ALL = os.getenv('PROFILE_LOG_ALL', 'False') == 'True'
+PROFILE_TOP_QUERIES = int(os.getenv('PROFILE_TOP_QUERIES', 5))
+PROFILE_HISTORY = int(os.getenv('PROFILE_HISTORY', 200))  # Requests kept for the debug page
+PROFILE_SAMPLE_OVER_MS = float(os.getenv('PROFILE_SAMPLE_OVER_MS', 0))  # 0 = sampling profiler off
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 5))
+
+_history = deque(maxlen=PROFILE_HISTORY)
+_profiles = deque(maxlen=20)
+_request_ids = itertools.count(1)
+_listeners_installed = False
+
+
+class RequestStats:
+    """SQL activity of one request"""
+
+    __slots__ = ('queries', 'db_ms', 'slowest')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.slowest = []  # (duration_ms, statement), longest first
+
+    def record(self, statement, duration_ms):
+        self.queries += 1
+        self.db_ms += duration_ms
+        if len(self.slowest) < PROFILE_TOP_QUERIES or duration_ms > self.slowest[-1][0]:
+            self.slowest.append((duration_ms, ' '.join(statement.split())[:500]))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[PROFILE_TOP_QUERIES:]
+
+
+class StackSampler:
+    """One background thread that samples the stacks of registered request threads"""
+
+    def __init__(self, interval_ms):
+        self.interval = interval_ms / 1000.0
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def start(self, thread_id):
+        with self._lock:
+            self._threads[thread_id] = Counter()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._worker.start()
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._threads.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, stacks in self._threads.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    """Render a frame's stack root-first as 'file:function;file:function'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+_sampler = StackSampler(PROFILE_SAMPLE_INTERVAL_MS) if PROFILE_SAMPLE_OVER_MS > 0 else None
+
+
+def _current_stats():
+    try:
+        return g.get('sql_stats')
+    except RuntimeError:
+        # Outside a request (CLI commands, background threads)
+        return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    duration_ms = (time.perf_counter() - starts.pop()) * 1000
+
+    stats = _current_stats()
+    if stats is not None:
+        stats.record(statement, duration_ms)
+        if duration_ms >= PROFILE_SLOW_QUERY_MS:
+            from flask import current_app
+            current_app.logger.warning(json.dumps({
+                'event': 'slow_query',
+                'path': request.path,
+                'duration_ms': round(duration_ms, 2),
+                'statement': ' '.join(statement.split())[:1000]
+            }))
+
+
+def _show_server_timing():
+    if PROFILE_SERVER_TIMING == 'always':
+        return True
+    if PROFILE_SERVER_TIMING == 'admin':
+        from flask_login import current_user
+        return current_user.is_authenticated and current_user.is_admin
+    return False
+
+
+def init_profiling(app):
+    """Install the engine listeners and request hooks"""
+    global _listeners_installed
+
+    if not SQL_PROFILING:
+        return
+
+    if not _listeners_installed:
+        # Listening on the Engine class covers every engine, including replicas
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _listeners_installed = True
+
+    @app.before_request
+    def start_request_profile():
+        g.sql_stats = RequestStats()
+        g.request_start = time.perf_counter()
+        if _sampler is not None:
+            _sampler.start(threading.get_ident())
+
+    @app.after_request
+    def finish_request_profile(response):
+        stats = g.get('sql_stats')
+        if stats is None:
+            return response
+
+        total_ms = (time.perf_counter() - g.request_start) * 1000
+        stacks = _sampler.stop(threading.get_ident()) if _sampler is not None else None
+
+        entry = {
+            'id': next(_request_ids),
+            'time': datetime.utcnow().isoformat(timespec='seconds'),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(total_ms, 2),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_ms, 2),
+            'slowest': [{'duration_ms': round(ms, 2), 'statement': sql} for ms, sql in stats.slowest]
+        }
+
+        if stacks and total_ms >= PROFILE_SAMPLE_OVER_MS:
+            entry['profile'] = True
+            _profiles.append((entry['id'], entry['path'], stacks))
+
+        # The debug page shouldn't crowd out the requests it's there to show
+        if request.endpoint not in ('profiling_debug', 'profiling_stacks'):
+            _history.append(entry)
+
+        if PROFILE_LOG_ALL or total_ms >= PROFILE_SLOW_REQUEST_MS:
+            app.logger.info(json.dumps(dict(entry, event='request')))
+
+        try:
+            if _show_server_timing():
+                response.headers['Server-Timing'] = (
+                    f'db;dur={stats.db_ms:.2f};desc="{stats.queries} queries", '
+                    f'app;dur={total_ms - stats.db_ms:.2f}'
+                )
+        except Exception:
+            pass
+
+        return response
+
+    @app.teardown_request
+    def stop_request_sampling(exc):
+        if _sampler is not None:
+            _sampler.stop(threading.get_ident())
+
+
+def recent_requests():
+    """Profiled requests, newest first"""
+    return list(reversed(_history))
+
+
+def collapsed_stacks(request_id):
+    """Collapsed stack samples for a profiled request, or None"""
+    for profile_id, path, stacks in _profiles:
+        if profile_id == request_id:
+            return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+    return None
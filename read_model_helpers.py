@@ -0,0 +1,197 @@
+"""
+Read models for listing pages.
+
+Listings only display a handful of columns, so they select exactly those and
+build small __slots__ objects instead of ORM entities: no identity map, no
+change tracking, no relationship collections and no lazy loads per row. Each
+function costs a fixed number of queries however many rows it returns.
+
+The objects keep the attribute names of the models they stand in for
+(order.user.name, item.shoe.sizes, shoe.total_stock), so templates render
+them unchanged. They are read-only snapshots; anything that writes loads the
+model itself.
+
+The catalog snapshot (catalog_helpers) stores and serves CatalogShoe rows
+for the storefront listings and search.
+"""
+from datetime import datetime
+from extensions import db
+from models import Order, Shoe, ShoePopularity, ShoeSize, User, Wishlist
+
+
+class CatalogSize:
+    """Read-only ShoeSize"""
+
+    __slots__ = ('id', 'size', 'quantity')
+
+    def __init__(self, id, size, quantity):
+        self.id = id
+        self.size = size
+        self.quantity = quantity
+
+
+class CatalogShoe:
+    """Read-only Shoe with its sizes, as listed on the storefront"""
+
+    __slots__ = ('id', 'name', 'price', 'description', 'image_url', 'category',
+                 'created_by', 'created_at', 'sizes', 'total_stock', 'popularity')
+
+    def __init__(self, id, name, price, description, image_url, category, created_by, created_at, sizes,
+                 popularity=0.0):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.description = description
+        self.image_url = image_url
+        self.category = category
+        self.created_by = created_by
+        self.created_at = created_at
+        self.sizes = tuple(sizes)
+        self.total_stock = sum(size.quantity or 0 for size in self.sizes)
+        self.popularity = popularity
+
+    @property
+    def search_text(self):
+        return '\n'.join(filter(None, (self.name, self.description, self.category))).lower()
+
+    def to_record(self):
+        return [self.id, self.name, self.price, self.description, self.image_url, self.category,
+                self.created_by, self.created_at.isoformat() if self.created_at else None,
+                [[size.id, size.size, size.quantity] for size in self.sizes], self.popularity]
+
+    @classmethod
+    def from_record(cls, record):
+        *fields, created_at, sizes, popularity = record
+        return cls(*fields, datetime.fromisoformat(created_at) if created_at else None,
+                   [CatalogSize(*size) for size in sizes], popularity)
+
+
+class OrderCustomer:
+    """Read-only User, as shown next to an order"""
+
+    __slots__ = ('id', 'name', 'email', 'address')
+
+    def __init__(self, id, name, email, address):
+        self.id = id
+        self.name = name
+        self.email = email
+        self.address = address
+
+
+class OrderShoe:
+    """Read-only Shoe, as shown next to an order"""
+
+    __slots__ = ('id', 'name', 'price')
+
+    def __init__(self, id, name, price):
+        self.id = id
+        self.name = name
+        self.price = price
+
+
+ORDER_FIELDS = ('id', 'user_id', 'shoe_id', 'size', 'guest_name', 'guest_email', 'guest_phone',
+                'delivery_address', 'delivery_city', 'delivery_instructions', 'payment_method',
+                'payment_status', 'payment_transaction_id', 'payment_reference', 'amount',
+                'payment_code', 'phone_number', 'status', 'created_at', 'updated_at')
+
+
+class OrderRow:
+    """Read-only Order with its customer and shoe (None for guests and deleted shoes)"""
+
+    __slots__ = ORDER_FIELDS + ('user', 'shoe')
+
+    def __init__(self, values, user, shoe):
+        for field, value in zip(ORDER_FIELDS, values):
+            setattr(self, field, value)
+        self.user = user
+        self.shoe = shoe
+
+    @property
+    def customer_name(self):
+        return self.user.name if self.user else (self.guest_name or 'Guest')
+
+    @property
+    def customer_email(self):
+        return self.user.email if self.user else self.guest_email
+
+
+class WishlistRow:
+    """Read-only Wishlist entry with its shoe"""
+
+    __slots__ = ('id', 'created_at', 'shoe')
+
+    def __init__(self, id, created_at, shoe):
+        self.id = id
+        self.created_at = created_at
+        self.shoe = shoe
+
+
+_SHOE_COLUMNS = (Shoe.id, Shoe.name, Shoe.price, Shoe.description, Shoe.image_url, Shoe.category,
+                 Shoe.created_by, Shoe.created_at, ShoePopularity.score)
+
+
+def _sizes_by_shoe(shoe_ids=None):
+    """{shoe_id: [CatalogSize]} for all shoes or a select of shoe IDs"""
+    sizes = db.select(ShoeSize.id, ShoeSize.shoe_id, ShoeSize.size, ShoeSize.quantity).order_by(ShoeSize.id)
+    if shoe_ids is not None:
+        sizes = sizes.where(ShoeSize.shoe_id.in_(shoe_ids))
+    sizes_by_shoe = {}
+    for size_id, shoe_id, size, quantity in db.session.execute(sizes):
+        sizes_by_shoe.setdefault(shoe_id, []).append(CatalogSize(size_id, size, quantity))
+    return sizes_by_shoe
+
+
+def _shoe(row, sizes_by_shoe):
+    """CatalogShoe from a row of _SHOE_COLUMNS values"""
+    *fields, popularity = row
+    return CatalogShoe(*fields, sizes=sizes_by_shoe.get(row[0], ()), popularity=popularity or 0.0)
+
+
+def shoe_rows(*criteria):
+    """CatalogShoe rows for all shoes, or those matching the criteria, by ID (two queries)"""
+    shoes = db.select(*_SHOE_COLUMNS)\
+              .outerjoin(ShoePopularity, ShoePopularity.shoe_id == Shoe.id)\
+              .where(*criteria)\
+              .order_by(Shoe.id)
+    sizes_by_shoe = _sizes_by_shoe(db.select(Shoe.id).where(*criteria) if criteria else None)
+    return [_shoe(row, sizes_by_shoe) for row in db.session.execute(shoes)]
+
+
+def order_rows(*criteria):
+    """OrderRow rows for all orders, or those matching the criteria, newest first (one query)"""
+    orders = db.select(*(getattr(Order, field) for field in ORDER_FIELDS),
+                       User.id, User.name, User.email, User.address, Shoe.id, Shoe.name, Shoe.price)\
+               .outerjoin(User, User.id == Order.user_id)\
+               .outerjoin(Shoe, Shoe.id == Order.shoe_id)\
+               .where(*criteria)\
+               .order_by(Order.created_at.desc())
+
+    customers = {}  # One OrderCustomer per user, however many orders they have
+    shoes = {}
+    rows = []
+    width = len(ORDER_FIELDS)
+    for row in db.session.execute(orders):
+        user_id, shoe_id = row[width], row[width + 4]
+        user = None
+        if user_id is not None:
+            user = customers.get(user_id)
+            if user is None:
+                user = customers[user_id] = OrderCustomer(*row[width:width + 4])
+        shoe = None
+        if shoe_id is not None:
+            shoe = shoes.get(shoe_id)
+            if shoe is None:
+                shoe = shoes[shoe_id] = OrderShoe(*row[width + 4:])
+        rows.append(OrderRow(row[:width], user, shoe))
+    return rows
+
+
+def wishlist_rows(user_id):
+    """WishlistRow rows of a user's wishlist, oldest first (two queries)"""
+    entries = db.select(Wishlist.id, Wishlist.created_at, *_SHOE_COLUMNS)\
+                .join(Shoe, Shoe.id == Wishlist.shoe_id)\
+                .outerjoin(ShoePopularity, ShoePopularity.shoe_id == Shoe.id)\
+                .where(Wishlist.user_id == user_id)\
+                .order_by(Wishlist.id)
+    sizes_by_shoe = _sizes_by_shoe(db.select(Wishlist.shoe_id).where(Wishlist.user_id == user_id))
+    return [WishlistRow(row[0], row[1], _shoe(row[2:], sizes_by_shoe)) for row in db.session.execute(entries)]
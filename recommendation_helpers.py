@@ -0,0 +1,205 @@
+"""
+Item-to-item recommendations ("customers who bought this also bought").
+
+An offline job (flask --app app build-recommendations, e.g. nightly from
+cron) builds a customer x shoe matrix from orders (weight 1) and wishlists
+(RECOMMENDATION_WISHLIST_WEIGHT), computes the cosine similarity of every
+pair of shoe columns with one sparse matrix product and stores the
+RECOMMENDATION_TOP_K nearest neighbours of each shoe in shoe_recommendations.
+
+Web workers hold the whole table in memory (K rows per shoe), reloading it
+every RECOMMENDATION_REFRESH_SECONDS, and take the shoes themselves from the
+catalog snapshot, so serving recommendations runs no query. Slots left over
+are filled from the catalog's pre-shuffled pool of in-stock shoes.
+"""
+import importlib.util
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from extensions import db
+from models import Order, Shoe, ShoeRecommendation, Wishlist
+from catalog_helpers import get_catalog
+
+# SciPy is only needed by the offline job; the web workers never import it
+SCIPY_AVAILABLE = importlib.util.find_spec('scipy') is not None
+
+# Recommendation Configuration
+RECOMMENDATION_TOP_K = int(os.getenv('RECOMMENDATION_TOP_K', 8))  # Neighbours stored per shoe
+RECOMMENDATION_WISHLIST_WEIGHT = float(os.getenv('RECOMMENDATION_WISHLIST_WEIGHT', 0.5))  # A purchase counts 1
+RECOMMENDATION_REFRESH_SECONDS = float(os.getenv('RECOMMENDATION_REFRESH_SECONDS', 600))
+
+EXCLUDED_PAYMENT_STATUSES = ('Failed', 'Cancelled')
+
+
+def _interactions():
+    """{(customer, shoe_id): weight} from orders and wishlists, strongest signal kept"""
+    shoe_ids = set(db.session.scalars(db.select(Shoe.id)))
+    weights = {}
+
+    orders = db.session.execute(
+        db.select(Order.user_id, Order.guest_email, Order.shoe_id)
+          .where(Order.shoe_id.isnot(None), Order.payment_status.notin_(EXCLUDED_PAYMENT_STATUSES))
+    )
+    for user_id, guest_email, shoe_id in orders:
+        # Guests are recognised by email across orders
+        customer = f"u{user_id}" if user_id else (f"g{guest_email.strip().lower()}" if guest_email else None)
+        if customer and shoe_id in shoe_ids:
+            weights[(customer, shoe_id)] = 1.0
+
+    for user_id, shoe_id in db.session.execute(db.select(Wishlist.user_id, Wishlist.shoe_id)):
+        if shoe_id in shoe_ids:
+            key = (f"u{user_id}", shoe_id)
+            weights[key] = max(weights.get(key, 0.0), RECOMMENDATION_WISHLIST_WEIGHT)
+
+    return weights
+
+
+def _neighbours_sparse(weights, top_k):
+    """Top-k cosine neighbours per shoe from one sparse product (SciPy)"""
+    import numpy as np
+    from scipy import sparse
+
+    customers = {customer: i for i, customer in enumerate(sorted({c for c, _ in weights}))}
+    shoes = sorted({shoe_id for _, shoe_id in weights})
+    columns = {shoe_id: i for i, shoe_id in enumerate(shoes)}
+
+    matrix = sparse.csr_matrix(
+        (np.fromiter(weights.values(), dtype=np.float64, count=len(weights)),
+         (np.fromiter((customers[c] for c, _ in weights), dtype=np.int64, count=len(weights)),
+          np.fromiter((columns[s] for _, s in weights), dtype=np.int64, count=len(weights)))),
+        shape=(len(customers), len(shoes))
+    )
+    co = (matrix.T @ matrix).tocsr()  # shoe x shoe dot products
+    norms = np.sqrt(co.diagonal())
+    inverse = sparse.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0))
+    similarity = (inverse @ co @ inverse).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+
+    ids = np.asarray(shoes)
+    neighbours = {}
+    for row, shoe_id in enumerate(shoes):
+        start, end = similarity.indptr[row], similarity.indptr[row + 1]
+        if start == end:
+            continue
+        scores = similarity.data[start:end]
+        others = ids[similarity.indices[start:end]]
+        best = np.lexsort((others, -scores))[:top_k]  # Highest score, then lowest ID
+        neighbours[shoe_id] = [(int(others[i]), float(scores[i])) for i in best]
+    return neighbours
+
+
+def _neighbours_python(weights, top_k):
+    """Same as _neighbours_sparse with dicts, for when SciPy isn't installed"""
+    baskets = defaultdict(list)
+    for (customer, shoe_id), weight in weights.items():
+        baskets[customer].append((shoe_id, weight))
+
+    co = defaultdict(lambda: defaultdict(float))
+    squares = defaultdict(float)
+    for basket in baskets.values():
+        for shoe_id, weight in basket:
+            squares[shoe_id] += weight * weight
+            for other_id, other_weight in basket:
+                if other_id != shoe_id:
+                    co[shoe_id][other_id] += weight * other_weight
+
+    neighbours = {}
+    for shoe_id, row in co.items():
+        scored = [(other_id, dot / (squares[shoe_id] * squares[other_id]) ** 0.5) for other_id, dot in row.items()]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        neighbours[shoe_id] = scored[:top_k]
+    return neighbours
+
+
+def build_recommendations(top_k=None):
+    """
+    Recompute and store every shoe's nearest neighbours
+
+    Returns:
+        dict: customers, shoes (with neighbours) and recommendations (rows stored)
+    """
+    top_k = top_k or RECOMMENDATION_TOP_K
+    weights = _interactions()
+    if SCIPY_AVAILABLE:
+        neighbours = _neighbours_sparse(weights, top_k)
+    else:
+        neighbours = _neighbours_python(weights, top_k)
+
+    computed_at = datetime.utcnow()
+    rows = [
+        {'shoe_id': shoe_id, 'rank': rank, 'recommended_id': other_id, 'score': score, 'computed_at': computed_at}
+        for shoe_id, scored in neighbours.items()
+        for rank, (other_id, score) in enumerate(scored)
+    ]
+    # Replace the table in one transaction; readers see the old or the new set
+    db.session.execute(db.delete(ShoeRecommendation))
+    if rows:
+        db.session.execute(db.insert(ShoeRecommendation), rows)
+    db.session.commit()
+
+    current_app.logger.info(f"Stored {len(rows)} recommendations for {len(neighbours)} shoes")
+    return {'customers': len({customer for customer, _ in weights}), 'shoes': len(neighbours),
+            'recommendations': len(rows)}
+
+
+_state = {'neighbours': {}, 'loaded_at': float('-inf')}
+_lock = threading.Lock()
+
+
+def _neighbours():
+    """{shoe_id: [(recommended_id, score)]}, reloaded every RECOMMENDATION_REFRESH_SECONDS"""
+    if time.monotonic() - _state['loaded_at'] < RECOMMENDATION_REFRESH_SECONDS:
+        return _state['neighbours']
+    # One thread reloads; the others keep using the current table
+    if not _lock.acquire(blocking=False):
+        return _state['neighbours']
+    try:
+        neighbours = defaultdict(list)
+        try:
+            rows = db.session.execute(
+                db.select(ShoeRecommendation.shoe_id, ShoeRecommendation.recommended_id, ShoeRecommendation.score)
+                  .order_by(ShoeRecommendation.shoe_id, ShoeRecommendation.rank)
+            )
+            for shoe_id, recommended_id, score in rows:
+                neighbours[shoe_id].append((recommended_id, score))
+            _state['neighbours'] = dict(neighbours)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.warning(f"Could not load recommendations: {str(e)}")
+        _state['loaded_at'] = time.monotonic()
+        return _state['neighbours']
+    finally:
+        _lock.release()
+
+
+def recommended_for(shoe_ids, k, exclude=()):
+    """
+    Up to k catalog shoes to show next to the given ones, best first
+
+    Neighbours of several shoes (a listing page) are ranked by their summed
+    scores. The shoes themselves and those in exclude are never returned.
+    """
+    skip = set(shoe_ids) | set(exclude)
+    neighbours = _neighbours()
+    scores = defaultdict(float)
+    for shoe_id in shoe_ids:
+        for other_id, score in neighbours.get(shoe_id, ()):
+            if other_id not in skip:
+                scores[other_id] += score
+
+    catalog = get_catalog()
+    picked = []
+    for other_id in sorted(scores, key=lambda other_id: (-scores[other_id], other_id)):
+        row = catalog.get(other_id)
+        if row is not None and row.total_stock > 0:
+            picked.append(row)
+            skip.add(other_id)
+            if len(picked) == k:
+                return picked
+
+    return picked + catalog.sample(k - len(picked), exclude=skip)
@@ -0,0 +1,262 @@
+"""
+Reconciliation of stale gateway payments.
+
+Orders paid through M-Pesa STK Push or Pesapal are normally settled by the
+gateway callback/IPN. When that notification never arrives the orders stay
+Pending forever, so this module polls the gateways for them in batches and
+settles (Completed) or expires (Failed/Cancelled) them.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from extensions import db
+from models import Order
+
+try:
+    from email_helpers import send_payment_confirmation
+    EMAIL_AVAILABLE = True
+except ImportError:
+    EMAIL_AVAILABLE = False
+
+# Reconciliation Configuration
+RECONCILE_AFTER_MINUTES = int(os.getenv('RECONCILE_AFTER_MINUTES', 10))  # Give callbacks time to arrive
+RECONCILE_EXPIRE_AFTER_MINUTES = int(os.getenv('RECONCILE_EXPIRE_AFTER_MINUTES', 24 * 60))
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', 50))
+RECONCILE_MAX_WORKERS = int(os.getenv('RECONCILE_MAX_WORKERS', 4))
+RECONCILE_RATE_PER_SECOND = float(os.getenv('RECONCILE_RATE_PER_SECOND', 2))  # Gateway calls per second
+
+GATEWAY_METHODS = ('mpesa_stk', 'pesapal')
+
+# Gateway outcomes
+PAID = 'paid'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 1/rate seconds apart"""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            slot = max(time.monotonic(), self._next_slot)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def query_gateway(payment_method, transaction_id):
+    """
+    Ask the payment gateway for the outcome of a transaction
+
+    Args:
+        payment_method: 'mpesa_stk' or 'pesapal'
+        transaction_id: CheckoutRequestID (M-Pesa) or OrderTrackingId (Pesapal)
+
+    Returns:
+        tuple: (outcome, details) - outcome is PAID, FAILED or UNKNOWN
+    """
+    if payment_method == 'mpesa_stk':
+        from mpesa_helpers import query_stk_status, is_mpesa_payment_successful
+
+        result = query_stk_status(transaction_id)
+        # The query endpoint errors while the customer has not yet responded
+        if not result.get('success') or result.get('result_code') is None:
+            return UNKNOWN, result
+        if is_mpesa_payment_successful(result.get('result_code')):
+            return PAID, result
+        return FAILED, result
+
+    if payment_method == 'pesapal':
+        from pesapal_helpers import get_transaction_status, is_payment_successful
+
+        result = get_transaction_status(transaction_id)
+        if not result.get('success'):
+            return UNKNOWN, result
+        status_code = result.get('payment_status_code')
+        if is_payment_successful(status_code):
+            return PAID, result
+        # 2 = FAILED, 3 = REVERSED; 0 (INVALID) means nothing was paid yet
+        if status_code in (2, 3):
+            return FAILED, result
+        return UNKNOWN, result
+
+    return UNKNOWN, {'success': False, 'error': f'Unsupported payment method: {payment_method}'}
+
+
+def reduce_stock(order):
+    """Take one unit of the ordered size out of stock"""
+    if order.size != 'Size not specified' and order.shoe:
+        size_inv = next((s for s in order.shoe.sizes if s.size == order.size), None)
+        if size_inv and size_inv.quantity > 0:
+            size_inv.quantity -= 1
+
+
+def lock_pending(orders):
+    """
+    Re-read orders under a row lock, keeping those that are still Pending
+
+    The gateway queries take seconds, so a callback may have settled an order
+    since it was loaded. The status is checked in the locked SELECT, which
+    waits for such a callback's transaction and then sees its outcome.
+    """
+    if not orders:
+        return []
+    return Order.query.filter(Order.id.in_([order.id for order in orders]), Order.payment_status == 'Pending')\
+                      .order_by(Order.id).populate_existing().with_for_update().all()
+
+
+def settle_orders(orders, details):
+    """
+    Mark orders as paid and reduce stock, mirroring the gateway callbacks
+
+    Returns:
+        int: Orders settled (those no longer Pending are left alone)
+    """
+    orders = lock_pending(orders)
+    for order in orders:
+        order.payment_status = 'Completed'
+        order.status = 'Processing'
+        if details.get('confirmation_code'):
+            order.payment_transaction_id = details.get('confirmation_code')
+        reduce_stock(order)
+        if EMAIL_AVAILABLE:
+            send_payment_confirmation(order)
+    return len(orders)
+
+
+def expire_orders(orders):
+    """
+    Mark orders whose payment failed or never completed as cancelled
+
+    Returns:
+        int: Orders expired (those no longer Pending are left alone)
+    """
+    orders = lock_pending(orders)
+    for order in orders:
+        order.payment_status = 'Failed'
+        if order.status == 'Pending':
+            order.status = 'Cancelled'
+    return len(orders)
+
+
+def _commit(app):
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Reconcile commit failed: {str(e)}")
+        raise
+
+
+def _query_in_context(app, limiter, payment_method, transaction_id):
+    """Worker thread entry point; gateway helpers need an app context for logging"""
+    with app.app_context():
+        limiter.wait()
+        try:
+            return query_gateway(payment_method, transaction_id)
+        except Exception as e:
+            current_app.logger.error(f"Reconcile query failed for {transaction_id}: {str(e)}")
+            return UNKNOWN, {'success': False, 'error': str(e)}
+
+
+def reconcile_pending_payments(older_than_minutes=None, expire_after_minutes=None,
+                               batch_size=None, max_workers=None, rate_per_second=None,
+                               max_batches=None):
+    """
+    Settle or expire gateway orders that are still Pending
+
+    Scans pending M-Pesa STK / Pesapal orders older than `older_than_minutes`
+    in id-ordered batches, queries each distinct transaction once (concurrently,
+    under a shared rate limit) and applies the outcome to every order that
+    shares the transaction. Orders the gateway cannot account for are expired
+    once they are older than `expire_after_minutes`.
+
+    Stock is only taken when a gateway payment completes, so expiring an
+    order has no stock to give back. Each outcome is applied to the orders
+    still Pending under a row lock and committed on its own, so a callback
+    that got there first wins and locks are never held across gateway calls.
+
+    Returns:
+        dict: Counts of checked transactions and settled/expired/skipped orders
+    """
+    older_than_minutes = RECONCILE_AFTER_MINUTES if older_than_minutes is None else older_than_minutes
+    expire_after_minutes = RECONCILE_EXPIRE_AFTER_MINUTES if expire_after_minutes is None else expire_after_minutes
+    batch_size = batch_size or RECONCILE_BATCH_SIZE
+    max_workers = max_workers or RECONCILE_MAX_WORKERS
+    rate_per_second = RECONCILE_RATE_PER_SECOND if rate_per_second is None else rate_per_second
+
+    app = current_app._get_current_object()
+    limiter = RateLimiter(rate_per_second)
+    now = datetime.utcnow()
+    stale_cutoff = now - timedelta(minutes=older_than_minutes)
+    expire_cutoff = now - timedelta(minutes=expire_after_minutes)
+
+    summary = {'transactions': 0, 'settled': 0, 'expired': 0, 'skipped': 0}
+    last_id = 0
+    batches = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while max_batches is None or batches < max_batches:
+            batch = Order.query.filter(
+                Order.payment_status == 'Pending',
+                Order.payment_method.in_(GATEWAY_METHODS),
+                Order.created_at < stale_cutoff,
+                Order.id > last_id
+            ).order_by(Order.id).limit(batch_size).all()
+
+            if not batch:
+                break
+
+            batches += 1
+            last_id = batch[-1].id
+
+            # Orders placed in one checkout share a single gateway transaction
+            groups = {}
+            for order in batch:
+                groups.setdefault((order.payment_method, order.payment_transaction_id), []).append(order)
+
+            # Orders whose payment was never initiated can't be queried
+            unqueried = []
+            for key in [key for key in groups if key[1] is None]:
+                unqueried.extend(groups.pop(key))
+
+            expiring = [order for order in unqueried if order.created_at < expire_cutoff]
+            expired = expire_orders(expiring)
+            summary['expired'] += expired
+            summary['skipped'] += len(unqueried) - expired
+            _commit(app)
+
+            futures = {
+                key: executor.submit(_query_in_context, app, limiter, key[0], key[1])
+                for key in groups
+            }
+
+            for key, future in futures.items():
+                outcome, details = future.result()
+                orders = groups[key]
+                summary['transactions'] += 1
+
+                if outcome == PAID:
+                    settled = settle_orders(orders, details)
+                    summary['settled'] += settled
+                    summary['skipped'] += len(orders) - settled
+                    app.logger.info(f"Reconciled payment {key[1]}: completed")
+                elif outcome == FAILED or min(o.created_at for o in orders) < expire_cutoff:
+                    expired = expire_orders(orders)
+                    summary['expired'] += expired
+                    summary['skipped'] += len(orders) - expired
+                    app.logger.info(f"Reconciled payment {key[1]}: expired ({outcome})")
+                else:
+                    summary['skipped'] += len(orders)
+                _commit(app)
+
+    return summary
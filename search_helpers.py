@@ -0,0 +1,256 @@
+"""
+Typo-tolerant product search.
+
+Search is answered from the catalog snapshot: first as a substring match,
+like the old ILIKE query. When that finds nothing ("jordon", "addidas"),
+each query word is matched against the catalog's vocabulary through a
+trigram index, scored like PostgreSQL's pg_trgm similarity (shared trigrams
+over all trigrams of both words, words padded with blanks). Shoes containing
+a close enough word rank by their summed similarity, and the closest words
+make up the "did you mean" suggestion.
+
+The index maps each trigram to the vocabulary words containing it, so a
+lookup costs the postings of the query's few trigrams however many shoes
+there are. It is built per worker the first time a snapshot needs it.
+
+Results are cached per worker under the normalized query (case-folded,
+whitespace collapsed, plurals stemmed), which is also what gets searched, so
+"Jordans" and "jordan" share an entry. Words that are in the catalog's
+vocabulary are searched as typed: "vans" stemmed to "van" would also match
+"vanilla". An entry is the ordered shoe IDs as a
+compact array, turned back into snapshot rows page by page. When the catalog
+changes, only entries that contain a changed shoe or that the changed shoe
+now matches are dropped. The cache evicts least recently used entries to
+stay under SEARCH_CACHE_BYTES.
+"""
+import os
+import re
+import sys
+import threading
+import weakref
+from array import array
+from collections import OrderedDict, defaultdict
+from metrics_helpers import SEARCH_CACHE_REQUESTS
+
+# Fuzzy Search Configuration
+FUZZY_MIN_SIMILARITY = float(os.getenv('FUZZY_MIN_SIMILARITY', 0.3))  # pg_trgm's default threshold
+FUZZY_MAX_CANDIDATES = int(os.getenv('FUZZY_MAX_CANDIDATES', 5))  # Vocabulary words tried per query word
+SEARCH_CACHE_BYTES = int(os.getenv('SEARCH_CACHE_BYTES', 4 * 1024 * 1024))  # Per worker; 0 disables the cache
+
+_ENTRY_OVERHEAD = 200  # Approximate bytes of bookkeeping per cached query
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+_indexes = weakref.WeakKeyDictionary()  # Snapshot -> TrigramIndex
+_lock = threading.Lock()
+
+
+def trigrams(word):
+    """pg_trgm-style trigrams of a lowercase word"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Vocabulary of a catalog snapshot with a trigram -> word inverted index"""
+
+    def __init__(self, snapshot):
+        postings = defaultdict(list)  # word -> positions containing it
+        for position in range(snapshot.count):
+            for word in set(_WORD.findall(snapshot.search_text(position))):
+                postings[word].append(position)
+
+        self.words = list(postings)
+        self.postings = [postings[word] for word in self.words]
+        self.word_ids = {word: word_id for word_id, word in enumerate(self.words)}
+        self.trigram_counts = []
+        self.trigram_words = defaultdict(list)
+        for word_id, word in enumerate(self.words):
+            grams = trigrams(word)
+            self.trigram_counts.append(len(grams))
+            for gram in grams:
+                self.trigram_words[gram].append(word_id)
+
+    def similar(self, term):
+        """[(word_id, similarity)] of the closest vocabulary words, best first"""
+        word_id = self.word_ids.get(term)
+        if word_id is not None:
+            return [(word_id, 1.0)]
+
+        grams = trigrams(term)
+        shared = defaultdict(int)
+        for gram in grams:
+            for word_id in self.trigram_words.get(gram, ()):
+                shared[word_id] += 1
+
+        matches = []
+        for word_id, count in shared.items():
+            similarity = count / (len(grams) + self.trigram_counts[word_id] - count)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                matches.append((word_id, similarity))
+        # Ties go to the word more shoes use
+        matches.sort(key=lambda match: (-match[1], -len(self.postings[match[0]]), self.words[match[0]]))
+        return matches[:FUZZY_MAX_CANDIDATES]
+
+
+def _index_for(snapshot):
+    index = _indexes.get(snapshot)
+    if index is None:
+        with _lock:
+            index = _indexes.get(snapshot)
+            if index is None:
+                index = _indexes[snapshot] = TrigramIndex(snapshot)
+    return index
+
+
+def fuzzy_search(snapshot, query):
+    """
+    Shoes matching the query's words approximately
+
+    Returns:
+        tuple: (positions, best match first; "did you mean" query, or None
+            if no word needed correcting)
+    """
+    terms = _WORD.findall((query or '').lower())
+    if not terms:
+        return [], None
+
+    index = _index_for(snapshot)
+    scores = defaultdict(float)
+    corrected = []
+    for term in terms:
+        matches = index.similar(term)
+        corrected.append(index.words[matches[0][0]] if matches else term)
+        best = {}
+        for word_id, similarity in matches:
+            for position in index.postings[word_id]:
+                if similarity > best.get(position, 0.0):
+                    best[position] = similarity
+        for position, similarity in best.items():
+            scores[position] += similarity
+
+    # Most similar first, then most popular, then newest
+    positions = sorted(scores, key=lambda position: (-scores[position], -float(snapshot.popularity[position]),
+                                                     -int(snapshot.ids[position])))
+    suggestion = ' '.join(corrected)
+    return positions, (suggestion if suggestion != ' '.join(terms) else None)
+
+
+def _stem(word, vocabulary=()):
+    """Strip plural endings, leaving a prefix of the word (so substring search still finds it)"""
+    if word in vocabulary:
+        return word
+    if len(word) > 4 and word.endswith(('ches', 'shes', 'sses', 'xes', 'zes')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is', 'as')):
+        return word[:-1]
+    return word
+
+
+def normalize_query(query, vocabulary=()):
+    """Case-folded, whitespace-collapsed query with plurals stemmed, except words in the vocabulary"""
+    return ' '.join(_stem(word, vocabulary) for word in (query or '').casefold().split())
+
+
+class SearchCache:
+    """LRU of normalized query -> result shoe IDs, bounded by approximate memory size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # query -> (shoe IDs, sort order, suggestion, bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = None  # Catalog version the entries are valid for
+        self._lock = threading.Lock()
+
+    def get(self, snapshot, query):
+        with self._lock:
+            if self.version != snapshot.version:
+                self._catch_up(snapshot)
+            entry = self.entries.get(query)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(query)
+                self.hits += 1
+        SEARCH_CACHE_REQUESTS.inc(result='miss' if entry is None else 'hit')
+        return entry
+
+    def put(self, snapshot, query, shoe_ids, sort_by, suggestion):
+        size = shoe_ids.itemsize * len(shoe_ids) + sys.getsizeof(query) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self.version != snapshot.version:
+                return  # The catalog moved on while this query ran
+            previous = self.entries.pop(query, None)
+            if previous is not None:
+                self.bytes -= previous[3]
+            self.entries[query] = (shoe_ids, sort_by, suggestion, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted[3]
+
+    def _catch_up(self, snapshot):
+        """Drop the entries a catalog change can affect (all of them if the change isn't known)"""
+        changed_since = snapshot.changed_since
+        if changed_since is None or changed_since[0] != self.version or snapshot.version < self.version:
+            self.entries.clear()
+            self.bytes = 0
+        else:
+            changed = set(changed_since[1])
+            positions = snapshot.positions_of(sorted(changed))
+            texts = [snapshot.search_text(int(position)) for position in positions]
+            for query, (shoe_ids, sort_by, suggestion, size) in list(self.entries.items()):
+                # Similarity-ranked results depend on the whole vocabulary
+                if (sort_by is None or not changed.isdisjoint(shoe_ids)
+                        or any(query in text for text in texts)):
+                    del self.entries[query]
+                    self.bytes -= size
+        self.version = snapshot.version
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None}
+
+
+_cache = SearchCache(SEARCH_CACHE_BYTES)
+
+
+def search_cache_stats():
+    """Entries, bytes, hits, misses and hit rate of this worker's search cache"""
+    return _cache.stats()
+
+
+def _run_search(snapshot, query):
+    positions = snapshot.search(query)
+    if len(positions) or not query:
+        return snapshot.sort(positions, 'popular'), 'popular', None
+    positions, suggestion = fuzzy_search(snapshot, query)
+    return positions, None, suggestion
+
+
+def search_catalog(snapshot, query):
+    """
+    Search results for the storefront
+
+    Returns:
+        tuple: (positions, sort order they are in or None when ranked by
+            similarity, "did you mean" query or None)
+    """
+    query = normalize_query(query, _index_for(snapshot).word_ids)
+    if SEARCH_CACHE_BYTES <= 0:
+        return _run_search(snapshot, query)
+
+    entry = _cache.get(snapshot, query)
+    if entry is not None:
+        shoe_ids, sort_by, suggestion, _ = entry
+        return snapshot.positions_of(shoe_ids), sort_by, suggestion
+
+    positions, sort_by, suggestion = _run_search(snapshot, query)
+    _cache.put(snapshot, query, array('q', (int(snapshot.ids[position]) for position in positions)),
+               sort_by, suggestion)
+    return positions, sort_by, suggestion
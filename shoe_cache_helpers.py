@@ -0,0 +1,196 @@
+"""
+Read-through cache of single shoes for the cart, checkout and product pages.
+
+Adding to cart, the product page, the cart and checkout, the login cart merge
+and wishlist adds all load shoes by primary key, usually with their sizes.
+Each shoe is cached as one compact record (the catalog's display row plus the
+image gallery) under a key that includes a per-shoe version number:
+
+    shoe:version:<id>     -> version, bumped on every commit touching the shoe
+    shoe:<id>:v<version>  -> serialized shoe, sizes and images
+
+A commit that adds, changes or deletes a Shoe, ShoeSize or ProductImage bumps
+the versions of the shoes involved, so readers move to a key nobody has
+written yet instead of racing to delete the old one; superseded entries just
+expire. get_many() resolves any number of shoes with two cache round trips
+and at most one pair of queries for the misses.
+
+With Redis the versions are shared and a write is seen by every worker on its
+next lookup. The per-process SimpleCache only sees its own worker's bumps, so
+entries there live SHOE_CACHE_LOCAL_TTL seconds, about as stale as the
+catalog snapshot is allowed to be.
+"""
+import os
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event
+from extensions import db, cache, cache_is_shared
+from database_helpers import primary_reads
+from models import ProductImage, Shoe, ShoeSize
+from read_model_helpers import CatalogShoe, CatalogSize
+from metrics_helpers import SHOE_CACHE_REQUESTS
+
+# Shoe Cache Configuration
+SHOE_CACHE_TTL = int(os.getenv('SHOE_CACHE_TTL', 3600))  # Seconds; versioning keeps entries fresh with Redis
+SHOE_CACHE_LOCAL_TTL = int(os.getenv('SHOE_CACHE_LOCAL_TTL', 5))  # Seconds, with the per-process SimpleCache
+
+
+class CatalogImage:
+    """Read-only ProductImage"""
+
+    __slots__ = ('id', 'image_url', 'is_primary', 'display_order')
+
+    def __init__(self, id, image_url, is_primary, display_order):
+        self.id = id
+        self.image_url = image_url
+        self.is_primary = is_primary
+        self.display_order = display_order
+
+
+class CachedShoe(CatalogShoe):
+    """Read-only Shoe with its sizes and image gallery"""
+
+    __slots__ = ('images',)
+
+    def __init__(self, *args, images=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.images = tuple(images)
+
+    def to_record(self):
+        return [super().to_record(),
+                [[image.id, image.image_url, image.is_primary, image.display_order] for image in self.images]]
+
+    @classmethod
+    def from_record(cls, record):
+        shoe, images = record
+        *fields, created_at, sizes, popularity = shoe
+        return cls(*fields, datetime.fromisoformat(created_at) if created_at else None,
+                   [CatalogSize(*size) for size in sizes], popularity,
+                   images=[CatalogImage(*image) for image in images])
+
+
+def _version_key(shoe_id):
+    return f"shoe:version:{shoe_id}"
+
+
+def _entry_key(shoe_id, version):
+    return f"shoe:{shoe_id}:v{version}"
+
+
+def _initial_version():
+    # A version key that was evicted restarts above every version it had before
+    return time.time_ns() // 1000
+
+
+def _versions(shoe_ids):
+    """{shoe_id: current version}, creating the missing version keys"""
+    keys = [_version_key(shoe_id) for shoe_id in shoe_ids]
+    versions = dict(zip(shoe_ids, cache.get_many(*keys)))
+    missing = [shoe_id for shoe_id, version in versions.items() if version is None]
+    if missing:
+        for shoe_id in missing:
+            cache.add(_version_key(shoe_id), _initial_version(), timeout=0)
+        # Another worker may have added the key first; use whichever won
+        versions.update(zip(missing, cache.get_many(*[_version_key(shoe_id) for shoe_id in missing])))
+    return versions
+
+
+def _load_shoes(shoe_ids):
+    """CachedShoe rows for the given IDs from the database (two queries)"""
+    # Writes land on the primary first; a replica could cache the old shoe under the new version
+    with primary_reads():
+        shoes = Shoe.query.options(db.selectinload(Shoe.sizes), db.selectinload(Shoe.additional_images))\
+                          .filter(Shoe.id.in_(shoe_ids)).all()
+        return {
+            shoe.id: CachedShoe(
+                shoe.id, shoe.name, shoe.price, shoe.description, shoe.image_url, shoe.category,
+                shoe.created_by, shoe.created_at,
+                sorted((CatalogSize(size.id, size.size, size.quantity) for size in shoe.sizes),
+                       key=lambda size: size.id),
+                images=sorted((CatalogImage(image.id, image.image_url, bool(image.is_primary),
+                                            image.display_order or 0) for image in shoe.additional_images),
+                              key=lambda image: (not image.is_primary, image.display_order, image.id))
+            )
+            for shoe in shoes
+        }
+
+
+def get_many(shoe_ids):
+    """
+    Shoes by ID through the cache
+
+    Returns:
+        dict: {shoe_id: CachedShoe} for the IDs that exist
+    """
+    shoe_ids = list(dict.fromkeys(shoe_ids))
+    if not shoe_ids:
+        return {}
+
+    try:
+        versions = _versions(shoe_ids)
+        records = cache.get_many(*[_entry_key(shoe_id, versions[shoe_id]) for shoe_id in shoe_ids])
+    except Exception as e:
+        current_app.logger.warning(f"Shoe cache unavailable: {str(e)}")
+        return _load_shoes(shoe_ids)
+
+    shoes = {}
+    misses = []
+    for shoe_id, record in zip(shoe_ids, records):
+        if record is None:
+            misses.append(shoe_id)
+        else:
+            shoes[shoe_id] = CachedShoe.from_record(record)
+    SHOE_CACHE_REQUESTS.inc(len(shoes), result='hit')
+    if not misses:
+        return shoes
+
+    SHOE_CACHE_REQUESTS.inc(len(misses), result='miss')
+    loaded = _load_shoes(misses)
+    try:
+        timeout = SHOE_CACHE_TTL if cache_is_shared() else SHOE_CACHE_LOCAL_TTL
+        cache.set_many({_entry_key(shoe_id, versions[shoe_id]): shoe.to_record() for shoe_id, shoe in loaded.items()},
+                       timeout=timeout)
+    except Exception as e:
+        current_app.logger.warning(f"Shoe cache not filled: {str(e)}")
+    shoes.update(loaded)
+    return shoes
+
+
+def get_shoe(shoe_id):
+    """One shoe through the cache, or None"""
+    return get_many([shoe_id]).get(shoe_id)
+
+
+def bump_versions(shoe_ids):
+    """Move these shoes to new cache keys, so every worker reloads them"""
+    try:
+        for shoe_id in shoe_ids:
+            cache.add(_version_key(shoe_id), _initial_version(), timeout=0)
+            cache.cache.inc(_version_key(shoe_id))
+    except Exception as e:
+        current_app.logger.warning(f"Shoe cache versions not bumped, entries expire within "
+                                   f"{SHOE_CACHE_TTL}s: {str(e)}")
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_shoe_changes(session, flush_context):
+    changed = session.info.setdefault('shoe_cache_changed', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Shoe):
+            changed.add(obj.id)
+        elif isinstance(obj, (ShoeSize, ProductImage)):
+            changed.add(obj.shoe_id)
+    changed.discard(None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_shoe_versions(session):
+    changed = session.info.pop('shoe_cache_changed', None)
+    if changed:
+        bump_versions(sorted(changed))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_shoe_changes(session):
+    session.info.pop('shoe_cache_changed', None)
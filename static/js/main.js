@@ -33,26 +33,87 @@ document.addEventListener('DOMContentLoaded', () => {
         localStorage.setItem('theme', currentTheme);
     });
 
-    // Cart animation improvements
-    document.querySelectorAll('.add-to-cart').forEach(button => {
-        button.addEventListener('click', (e) => {
-            e.preventDefault();
-            const card = button.closest('.product-card');
-            
-            // Add animation class
-            card.classList.add('adding-to-cart');
-            
-            // Store original transform
-            const originalTransform = card.style.transform;
-            
-            // Animate
-            card.style.transform = 'scale(0.95)';
-            
-            setTimeout(() => {
-                card.style.transform = originalTransform;
-                window.location.href = button.href;
-            }, 300);
+    // Cart forms: submit in place, then update the badge and cart summary
+    const cartBadge = document.querySelector('[data-cart-count]');
+    const messages = document.querySelector('main .container');
+
+    const showMessage = (message, category) => {
+        if (!messages || !message) return;
+        const alert = document.createElement('div');
+        alert.className = `alert alert-${category || 'info'} alert-dismissible fade show`;
+        alert.append(message);
+        const close = document.createElement('button');
+        close.type = 'button';
+        close.className = 'btn-close';
+        close.setAttribute('data-bs-dismiss', 'alert');
+        alert.append(close);
+        messages.querySelectorAll(':scope > .alert').forEach(el => el.remove());
+        messages.prepend(alert);
+    };
+
+    const updateCartPage = (data) => {
+        const lines = new Map(data.items.map(item => [`${item.shoe_id}|${item.size}`, item]));
+        document.querySelectorAll('[data-cart-line]').forEach(row => {
+            const item = lines.get(row.dataset.cartLine);
+            if (item) {
+                const input = row.querySelector('[data-cart-quantity]');
+                if (input) input.value = item.quantity;
+                return;
+            }
+            const divider = row.nextElementSibling;
+            if (divider && divider.tagName === 'HR') divider.remove();
+            row.remove();
         });
+        const items = data.items.reduce((sum, item) => sum + item.quantity, 0);
+        document.querySelectorAll('[data-cart-items]').forEach(el => { el.textContent = items; });
+        document.querySelectorAll('[data-cart-total]').forEach(el => { el.textContent = `Ksh${data.total.toFixed(2)}`; });
+        // The empty cart page is rendered by the server
+        if (!data.items.length) window.location.reload();
+    };
+
+    document.addEventListener('submit', async (e) => {
+        const form = e.target.closest('form[data-cart-form]');
+        if (!form || !window.fetch) return;
+        e.preventDefault();
+
+        const submitBtn = form.querySelector('button[type="submit"]');
+        const originalHtml = submitBtn ? submitBtn.innerHTML : '';
+        if (submitBtn) {
+            submitBtn.disabled = true;
+            submitBtn.innerHTML = '<span class="spinner-border spinner-border-sm" role="status"></span>';
+        }
+        try {
+            const response = await fetch(form.action, {
+                method: 'POST',
+                body: new FormData(form),
+                headers: { 'X-Requested-With': 'XMLHttpRequest' }
+            });
+            // Errors that aren't cart answers (expired CSRF token, 404) changed nothing and render as pages
+            if (!(response.headers.get('Content-Type') || '').includes('application/json')) {
+                form.submit();
+                return;
+            }
+            const data = await response.json();
+            if (cartBadge && typeof data.count === 'number') {
+                cartBadge.textContent = data.count;
+                cartBadge.classList.toggle('d-none', data.count === 0);
+            }
+            showMessage(data.message, data.category);
+            if (data.items) updateCartPage(data);
+        } catch (error) {
+            // The cart may already have changed, so re-posting could add the item twice
+            if (form.closest('[data-cart-line]')) {
+                window.location.reload();
+            } else {
+                showMessage('Your cart could not be updated here. Please check your cart before trying again.',
+                            'warning');
+            }
+        } finally {
+            if (submitBtn) {
+                submitBtn.disabled = false;
+                submitBtn.innerHTML = originalHtml;
+            }
+        }
     });
 
     // Dynamic event delegation for delete/remove buttons
@@ -89,6 +150,58 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    // Infinite scroll: fetch the "Load more" page and append its products
+    const infiniteContainer = document.querySelector('[data-infinite-scroll]');
+    let nextPageLink = document.querySelector('[data-next-page]');
+    if (infiniteContainer && nextPageLink && 'IntersectionObserver' in window) {
+        document.querySelectorAll('[data-infinite-scroll-hide]').forEach(el => el.classList.add('d-none'));
+        let loading = false;
+
+        const loadNextPage = async () => {
+            if (loading || !nextPageLink) return;
+            loading = true;
+            nextPageLink.classList.add('disabled');
+            try {
+                const response = await fetch(nextPageLink.href, {
+                    headers: { 'X-Requested-With': 'XMLHttpRequest' }
+                });
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                const page = new DOMParser().parseFromString(await response.text(), 'text/html');
+                const items = page.querySelector('[data-infinite-scroll]');
+                if (items) {
+                    infiniteContainer.append(...Array.from(items.children));
+                }
+                const newLink = page.querySelector('[data-next-page]');
+                if (newLink) {
+                    nextPageLink.href = newLink.getAttribute('href');
+                    // Re-observing reports the link again if it's still in view
+                    observer.unobserve(nextPageLink);
+                    observer.observe(nextPageLink);
+                } else {
+                    observer.disconnect();
+                    nextPageLink.parentElement.remove();
+                    nextPageLink = null;
+                }
+            } catch (error) {
+                // Stop loading on scroll; clicking the link tries again
+                observer.disconnect();
+            } finally {
+                loading = false;
+                if (nextPageLink) nextPageLink.classList.remove('disabled');
+            }
+        };
+
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+        }, { rootMargin: '400px' });
+        observer.observe(nextPageLink);
+
+        nextPageLink.addEventListener('click', (e) => {
+            e.preventDefault();
+            loadNextPage();
+        });
+    }
+
     // Add smooth scroll to top
     const scrollToTop = document.createElement('button');
     scrollToTop.id = 'scroll-to-top';
@@ -0,0 +1,36 @@
+from datetime import datetime
+from itertools import count
+from catalog_helpers import CatalogSnapshot, serialize_catalog
+from read_model_helpers import CatalogShoe, CatalogSize
+from search_helpers import normalize_query, search_catalog
+
+_versions = count(1)  # The search cache is per process and keyed by catalog version
+
+
+def _snapshot(*shoes):
+    rows = [CatalogShoe(shoe_id, name, 50.0, description, None, 'Sneakers', None, datetime(2024, 1, shoe_id),
+                        [CatalogSize(shoe_id, '42', 1)])
+            for shoe_id, (name, description) in enumerate(shoes, start=1)]
+    return CatalogSnapshot(serialize_catalog(rows, next(_versions)))
+
+
+def _ids(snapshot, query):
+    positions, _, _ = search_catalog(snapshot, query)
+    return sorted(int(snapshot.ids[position]) for position in positions)
+
+
+def test_catalog_word_is_not_stemmed_into_other_words():
+    # "van" is in "vanilla" but "vans" is not
+    snapshot = _snapshot(('Vans Old Skool', 'Suede skate shoe'),
+                         ('Converse Chuck Taylor', 'Canvas high top in vanilla'))
+
+    assert _ids(snapshot, 'vans') == [1]
+    assert _ids(snapshot, 'Vans') == [1]
+
+
+def test_plural_outside_catalog_is_stemmed():
+    snapshot = _snapshot(('Air Jordan 1', 'Retro basketball shoe'),
+                         ('Converse Chuck Taylor', 'Classic canvas high top'))
+
+    assert normalize_query('Jordans') == 'jordan'
+    assert _ids(snapshot, 'jordans') == [1]
@@ -0,0 +1,171 @@
+"""
+Per-user wishlist membership.
+
+Listing pages only need to know which shoes a user has hearted, so the set
+of wishlisted shoe IDs is cached and a cache hit means the page makes no
+wishlist query at all; a miss reloads just the IDs.
+
+With Redis (REDIS_URL) the IDs are a Redis set, wishlist_ids:<user id>,
+changed with SADD/SREM after each commit, so concurrent hearts can't undo
+each other. A set is only changed while it exists; when it doesn't, a short
+wishlist_ids:<user id>:written marker stops a reader that loaded the IDs
+before the commit from filling the set with the old ones. The set holds a
+0 next to the IDs so an empty wishlist is still cached.
+
+Without Redis the IDs are cached per worker for WISHLIST_CACHE_LOCAL_TTL
+seconds and the worker's copy is deleted after each change.
+"""
+import os
+from array import array
+from flask import current_app
+from extensions import db, cache, cache_is_shared
+from models import Wishlist
+
+WISHLIST_CACHE_TTL = int(os.getenv('WISHLIST_CACHE_TTL', 24 * 3600))  # Seconds, with Redis
+WISHLIST_CACHE_LOCAL_TTL = int(os.getenv('WISHLIST_CACHE_LOCAL_TTL', 5))  # Seconds, with the per-process SimpleCache
+WISHLIST_WRITE_MARKER_SECONDS = 10  # Longer than loading the IDs takes
+
+_EMPTY = 0  # Set member that keeps an empty wishlist cached; not a shoe ID
+
+# KEYS: set, marker; ARGV: 'sadd' or 'srem', shoe ID, marker seconds
+_APPLY = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call(ARGV[1], KEYS[1], ARGV[2])
+end
+redis.call('set', KEYS[2], 1, 'EX', ARGV[3])
+return 0
+"""
+
+# KEYS: set, marker; ARGV: TTL seconds, members...
+_FILL = """
+if redis.call('exists', KEYS[1]) == 1 or redis.call('exists', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('sadd', KEYS[1], unpack(ARGV, 2))
+redis.call('expire', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+def _cache_key(user_id):
+    return f"wishlist_ids:{user_id}"
+
+
+def _marker_key(user_id):
+    return f"wishlist_ids:{user_id}:written"
+
+
+def _redis():
+    """Redis client when the cache is shared, else None"""
+    return current_app.config.get('SESSION_REDIS') if cache_is_shared() else None
+
+
+def _load_ids(user_id):
+    return db.session.scalars(db.select(Wishlist.shoe_id).where(Wishlist.user_id == user_id)).all()
+
+
+def get_wishlist_ids(user_id):
+    """
+    IDs of the shoes in a user's wishlist
+
+    Returns:
+        frozenset: Shoe IDs
+    """
+    client = _redis()
+    try:
+        if client is not None:
+            members = client.smembers(_cache_key(user_id))
+            if members:
+                return frozenset(int(member) for member in members) - {_EMPTY}
+        else:
+            cached = cache.get(_cache_key(user_id))
+            if cached is not None:
+                return frozenset(cached)
+    except Exception as e:
+        current_app.logger.warning(f"Wishlist cache unavailable: {str(e)}")
+        return frozenset(_load_ids(user_id))
+
+    shoe_ids = _load_ids(user_id)
+    try:
+        if client is not None:
+            client.eval(_FILL, 2, _cache_key(user_id), _marker_key(user_id), WISHLIST_CACHE_TTL,
+                        _EMPTY, *shoe_ids)
+        else:
+            cache.set(_cache_key(user_id), array('l', sorted(shoe_ids)), timeout=WISHLIST_CACHE_LOCAL_TTL)
+    except Exception as e:
+        current_app.logger.warning(f"Wishlist cache not filled: {str(e)}")
+    return frozenset(shoe_ids)
+
+
+def _changed(user_id, shoe_id, present):
+    """Apply a committed add/remove to the cached IDs"""
+    client = _redis()
+    try:
+        if client is not None:
+            client.eval(_APPLY, 2, _cache_key(user_id), _marker_key(user_id),
+                        'sadd' if present else 'srem', shoe_id, WISHLIST_WRITE_MARKER_SECONDS)
+        else:
+            cache.delete(_cache_key(user_id))
+    except Exception as e:
+        current_app.logger.warning(f"Wishlist cache not updated for user {user_id}, stale for up to "
+                                   f"{WISHLIST_CACHE_TTL}s: {str(e)}")
+
+
+def add_to_wishlist(user_id, shoe_id):
+    """
+    Add a shoe to a user's wishlist with a single conflict-tolerant INSERT
+
+    Returns:
+        bool: False if the shoe was already in the wishlist
+    """
+    dialect = db.session.get_bind().dialect.name
+    values = {'user_id': user_id, 'shoe_id': shoe_id}
+
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(Wishlist).values(**values, created_at=db.func.now())\
+                               .on_conflict_do_nothing(index_elements=['user_id', 'shoe_id'])
+        added = db.session.execute(stmt).rowcount > 0
+    else:
+        from sqlalchemy.exc import IntegrityError
+        try:
+            with db.session.begin_nested():
+                db.session.add(Wishlist(**values))
+            added = True
+        except IntegrityError:
+            added = False
+
+    db.session.commit()
+    _changed(user_id, shoe_id, True)
+    return added
+
+
+def remove_from_wishlist(user_id, shoe_id):
+    """
+    Remove a shoe from a user's wishlist
+
+    Returns:
+        bool: False if the shoe wasn't in the wishlist
+    """
+    removed = db.session.execute(
+        db.delete(Wishlist).where(Wishlist.user_id == user_id, Wishlist.shoe_id == shoe_id)
+    ).rowcount > 0
+    db.session.commit()
+    _changed(user_id, shoe_id, False)
+    return removed
+
+
+def toggle_wishlist(user_id, shoe_id):
+    """
+    Heart/unheart a shoe, deciding from the database rather than the cache
+
+    Returns:
+        bool: True if the shoe is now in the wishlist
+    """
+    if remove_from_wishlist(user_id, shoe_id):
+        return False
+    add_to_wishlist(user_id, shoe_id)
+    return True